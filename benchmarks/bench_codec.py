@@ -0,0 +1,86 @@
+""" Compares pylontech.codec against the per-byte implementations it replaced.
+
+Run with `python benchmarks/bench_codec.py`.
+"""
+import os
+import sys
+import timeit
+
+import construct
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests"))
+
+from pylontech import codec  # noqa: E402
+from frames import US3000_4MODULES_VALUES  # noqa: E402
+
+
+class LegacyHexToByte(construct.Adapter):
+    def _decode(self, obj, context, path) -> bytes:
+        hexstr = ''.join([chr(x) for x in obj])
+        return bytes.fromhex(hexstr)
+
+
+def legacy_frame_checksum(frame: bytes):
+    sum = 0
+    for byte in frame:
+        sum += byte
+    sum = ~sum
+    sum %= 0x10000
+    sum += 1
+    return sum
+
+
+def legacy_get_info_length(info: bytes) -> int:
+    lenid = len(info)
+    if lenid == 0:
+        return 0
+
+    lenid_sum = (lenid & 0xf) + ((lenid >> 4) & 0xf) + ((lenid >> 8) & 0xf)
+    lenid_modulo = lenid_sum % 16
+    lenid_invert_plus_one = 0b1111 - lenid_modulo + 1
+
+    return (lenid_invert_plus_one << 12) + lenid
+
+
+def legacy_encode_cmd(address: int, cid2: int, info: bytes = b''):
+    info_length = legacy_get_info_length(info)
+    frame = "{:02X}{:02X}{:02X}{:02X}{:04X}".format(0x20, address, 0x46, cid2, info_length).encode()
+    frame += info
+    frame_chksum = legacy_frame_checksum(frame)
+    return b"~" + frame + "{:04X}".format(frame_chksum).encode() + b"\r"
+
+
+def legacy_decode_frame(frame):
+    format = construct.Struct(
+        "ver" / LegacyHexToByte(construct.Array(2, construct.Byte)),
+        "adr" / LegacyHexToByte(construct.Array(2, construct.Byte)),
+        "cid1" / LegacyHexToByte(construct.Array(2, construct.Byte)),
+        "cid2" / LegacyHexToByte(construct.Array(2, construct.Byte)),
+        "infolength" / LegacyHexToByte(construct.Array(4, construct.Byte)),
+        "info" / LegacyHexToByte(construct.GreedyRange(construct.Byte)),
+    )
+    return format.parse(frame)
+
+
+def compare(name, legacy, new, number):
+    t_legacy = min(timeit.repeat(legacy, number=number, repeat=3)) / number
+    t_new = min(timeit.repeat(new, number=number, repeat=3)) / number
+    print("{:<16} legacy {:>10.2f} us   codec {:>10.2f} us   x{:.1f}".format(
+        name, t_legacy * 1e6, t_new * 1e6, t_legacy / t_new))
+
+
+def main():
+    frame = US3000_4MODULES_VALUES[1:-5]
+
+    assert legacy_frame_checksum(frame) == codec.frame_checksum(frame)
+    assert legacy_encode_cmd(2, 0x42, b'FF') == codec.encode_cmd(2, 0x42, b'FF')
+    assert legacy_decode_frame(frame).info == codec.decode_frame(frame).info
+
+    compare("checksum", lambda: legacy_frame_checksum(frame), lambda: codec.frame_checksum(frame), 2000)
+    compare("encode_cmd", lambda: legacy_encode_cmd(2, 0x42, b'FF'), lambda: codec.encode_cmd(2, 0x42, b'FF'), 20000)
+    compare("decode_frame", lambda: legacy_decode_frame(frame), lambda: codec.decode_frame(frame), 200)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+""" Throughput benchmarks for the codec, the decoders and a simulated poll loop.
+
+All benchmarks run against the real frames of tests/frames.py served by an
+in-memory serial port, so they measure the library's CPU cost only (no wire
+time). For every case the suite reports frames per second, the number of
+memory blocks allocated per frame (counted by comparing tracemalloc snapshots
+taken around a call, while its result is still alive) and the peak memory
+allocated while handling one frame.
+
+    python benchmarks/bench_suite.py --output results-0.3.3.json
+    python benchmarks/bench_suite.py --compare results-0.3.3.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, os.path.join(HERE, "..", "tests"))
+
+import frames  # noqa: E402
+from test_basic import MockSerial  # noqa: E402
+
+import pylontech  # noqa: E402
+from pylontech import codec  # noqa: E402
+
+
+class LoopSerial(MockSerial):
+    """ MockSerial answering every request with the same frame """
+    def __init__(self, reply: bytes):
+        super().__init__([])
+        self.reply = reply
+
+    def write(self, data: bytes):
+        self.responses = [self.reply]
+
+
+class StackSerial(MockSerial):
+    """ MockSerial answering serial number probes for addresses 2 to 2 + modules - 1 """
+    def __init__(self, modules: int):
+        super().__init__([])
+        self.baudrate = 115200
+        self.timeout = 2
+        self.replies = {}
+        for adr in range(2, 2 + modules):
+            info = ("{:02X}".format(adr) + ("PPTBH0240000%04d" % adr).encode().hex().upper()).encode()
+            self.replies[adr] = codec.encode_cmd(adr, 0x00, info)
+
+    def write(self, data: bytes):
+        self.responses = [self.replies.get(int(data[3:5], 16), b"")]
+
+
+def bench_pylontech(s, fast_decode=False, lazy_decode=False) -> pylontech.Pylontech:
+    return pylontech.Pylontech(s, fast_decode=fast_decode, lazy_decode=lazy_decode)
+
+
+def _info(raw_frame: bytes) -> bytes:
+    return codec.decode_frame(pylontech.Pylontech._decode_hw_frame(raw_frame)).info
+
+
+def cases():
+    values = frames.US3000_4MODULES_VALUES
+    values_info = _info(values)[1:]
+    single_info = _info(frames.UP2500_SINGLE_VALUES)[1:]
+    management_info = _info(frames.UP2500_MANAGEMENT_INFO)[1:]
+    body = values[1:-5]
+
+    yield "get_frame_checksum", 1, lambda: pylontech.Pylontech.get_frame_checksum(body)
+    yield "_encode_cmd", 1, lambda: pylontech.Pylontech._encode_cmd(2, 0x42, b'FF')
+    yield "decode_hw_frame+decode_frame", 1, \
+        lambda: pylontech.Pylontech._decode_frame(pylontech.Pylontech._decode_hw_frame(values))
+    yield "get_values_fmt.parse", 1, lambda: pylontech.Pylontech.get_values_fmt.parse(values_info)
+    yield "get_values_single_fmt.parse", 1, lambda: pylontech.Pylontech.get_values_single_fmt.parse(single_info)
+    yield "management_info_fmt.parse", 1, lambda: pylontech.Pylontech.management_info_fmt.parse(management_info)
+
+    for name, raw in (("us2000x3", frames.US2000_3MODULES_VALUES), ("us3000x4", frames.US3000_4MODULES_VALUES),
+                      ("mixed", frames.MIXED_US3000_US2000_VALUES)):
+        p = bench_pylontech(LoopSerial(raw))
+        yield "poll get_values %s" % name, 1, p.get_values
+        p = bench_pylontech(LoopSerial(raw), fast_decode=True)
+        yield "poll get_values %s fast" % name, 1, p.get_values
+        p = bench_pylontech(LoopSerial(raw), lazy_decode=True)
+        yield "poll get_values %s lazy SoC" % name, 1, lambda p=p: p.get_values().StateOfCharge
+
+    p = bench_pylontech(LoopSerial(frames.UP2500_SINGLE_VALUES))
+    yield "poll get_values_single up2500", 1, lambda: p.get_values_single(2)
+
+    p = bench_pylontech(StackSerial(16))
+    yield "scan_for_batteries 0-255", 255, lambda: p.scan_for_batteries(0, 255)
+    yield "discover_batteries", 18, lambda: p.discover_batteries()
+
+
+def measure(fn, frames_per_call: int, min_time: float):
+    fn()  # warm up caches
+    number = 1
+    while True:
+        elapsed = timeit.timeit(fn, number=number)
+        if elapsed >= min_time:
+            break
+        number *= 2
+    best = min([elapsed] + timeit.repeat(fn, number=number, repeat=2))
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    fn()
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    return {
+        "frames_per_second": number * frames_per_call / best,
+        "allocations_per_frame": count_allocations(fn) / frames_per_call,
+        "peak_alloc_bytes_per_frame": peak / frames_per_call,
+    }
+
+
+def count_allocations(fn) -> int:
+    """ Memory blocks allocated by one call of `fn` and still alive once it returned, its result included """
+    ignore = (tracemalloc.Filter(False, tracemalloc.__file__),)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot().filter_traces(ignore)
+    result = fn()  # noqa: F841, kept alive until the second snapshot
+    after = tracemalloc.take_snapshot().filter_traces(ignore)
+    tracemalloc.stop()
+    return sum(stat.count_diff for stat in after.compare_to(before, "lineno") if stat.count_diff > 0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare with")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per measurement")
+    parser.add_argument("-k", dest="filter", default="", help="only run cases whose name contains this")
+    args = parser.parse_args(argv)
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)["results"]
+
+    results = {}
+    for name, frames_per_call, fn in cases():
+        if args.filter not in name:
+            continue
+        r = results[name] = measure(fn, frames_per_call, args.min_time)
+        line = "{:<36} {:>12.0f} frames/s {:>8.1f} allocs/frame {:>10.0f} peak B/frame".format(
+            name, r["frames_per_second"], r["allocations_per_frame"], r["peak_alloc_bytes_per_frame"])
+        if name in previous:
+            line += "   x{:.2f} vs previous".format(r["frames_per_second"] / previous[name]["frames_per_second"])
+            if "allocations_per_frame" in previous[name]:
+                line += ", {:+.1f} allocs/frame".format(
+                    r["allocations_per_frame"] - previous[name]["allocations_per_frame"])
+        print(line)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "timestamp": time.time(),
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
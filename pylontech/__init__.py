@@ -1 +1,30 @@
-from .pylontech import Pylontech
+""" Pylontech batteries over RS485.
+
+The public names are imported on first use (PEP 562), so that tools that only
+need a submodule, like the command line client, do not pay for `construct`
+and `serial`.
+"""
+import importlib
+
+_EXPORTS = {
+    "Pylontech": ".pylontech",
+    "AsyncPylontech": ".aio",
+    "PylontechError": ".exceptions",
+    "ReplyTimeout": ".exceptions",
+    "ChecksumError": ".exceptions",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,173 @@
+""" asyncio flavour of the `Pylontech` client.
+
+The serial port is opened with pyserial (so that baudrate, parity and locking
+are set up exactly as for the blocking client) and its file descriptor is then
+handed to the event loop as a pair of read/write pipes. Frames are encoded and
+decoded with the very same functions as `Pylontech`, replies are cut out of the
+stream by the same `FrameReader` and parsed by the same `ReplyParser`.
+"""
+import asyncio
+import logging
+from typing import Dict
+
+import serial
+
+from .pylontech import Pylontech, ReplyParser
+from .exceptions import ChecksumError, ReplyTimeout
+from .framing import FrameReader
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPylontech(ReplyParser):
+    stale_replies = 0  # frames dropped because they did not answer the request in progress
+
+    def __init__(self, serial_port='/dev/ttyUSB0', baudrate=115200, timeout=2, fast_decode=False, lazy_decode=False):
+        self.serial_port = serial_port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.fast_decode = fast_decode
+        self.lazy_decode = lazy_decode
+
+        self.s = None
+        self._reader = None
+        self._read_transport = None
+        self._writer = None
+        self._lock = None
+        self._framer = FrameReader()
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        self.s = serial.Serial(self.serial_port, self.baudrate, bytesize=8, parity=serial.PARITY_NONE, stopbits=1,
+                               timeout=0, exclusive=True)
+
+        self._reader = asyncio.StreamReader()
+        self._read_transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(self._reader), self.s)
+        transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, self.s)
+        self._writer = asyncio.StreamWriter(transport, protocol, self._reader, loop)
+        self._lock = asyncio.Lock()
+
+    async def close(self):
+        if self._read_transport is not None:
+            self._read_transport.close()
+            self._read_transport = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self.s is not None:
+            self.s.close()
+            self.s = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+    async def send_cmd(self, address: int, cmd, info: bytes = b''):
+        raw_frame = Pylontech._encode_cmd(address, cmd, info)
+        self._writer.write(raw_frame)
+        await self._writer.drain()
+
+    def _flush_input(self):
+        """ Drops whatever was received before a request, e.g. the end of a reply that came too late """
+        self._framer.clear()
+        buffered = getattr(self._reader, "_buffer", None)  # StreamReader has no public way to discard its buffer
+        if buffered:
+            self._framer.dropped_bytes += len(buffered)
+            buffered.clear()
+        self.s.reset_input_buffer()
+
+    async def read_frame(self, timeout=None):
+        return await self._read_reply(None, timeout)
+
+    async def _read_reply(self, request, timeout=None):
+        """ Reads the next valid frame, skipping those not answering `request` (address, cid2, info) if given """
+        if timeout is None:
+            timeout = self.timeout
+        try:
+            raw_frame = await asyncio.wait_for(self._read_raw_frame(request), timeout)
+        except asyncio.TimeoutError:
+            self._flush_input()
+            raise ReplyTimeout("No reply within %s s" % timeout) from None
+        f = Pylontech._decode_hw_frame(raw_frame=raw_frame)
+        return Pylontech._decode_frame(f)
+
+    async def _read_raw_frame(self, request=None) -> bytes:
+        bad_frames = self._framer.bad_frames
+        while True:
+            raw_frame = self._framer.next_frame()
+            if raw_frame is not None:
+                if request is None or Pylontech._reply_matches(raw_frame, *request):
+                    return raw_frame
+                logger.debug("Dropping frame not answering %02X to address %d: %r", request[1], request[0], raw_frame)
+                self.stale_replies += 1
+                self._framer.dropped_bytes += len(raw_frame)
+                continue
+            if self._framer.bad_frames > bad_frames:
+                raise ChecksumError("Reply with a bad checksum")
+
+            data = await self._reader.read(4096)
+            if not data:
+                raise EOFError("Serial port closed")
+            self._framer.feed(data)
+
+    async def _command(self, address: int, cmd, info: bytes = b'', parse=None):
+        """ One request/reply round trip; the bus is half-duplex so only one may be in flight.
+
+        The reply frame is returned decoded by `parse(frame)` if given.
+        """
+        async with self._lock:
+            self._flush_input()
+            await self.send_cmd(address, cmd, info)
+            f = await self._read_reply((address, cmd, info))
+        return f if parse is None else parse(f)
+
+
+    async def scan_for_batteries(self, start=0, end=255) -> Dict[int, str]:
+        """ Returns a map of the batteries id to their serial number """
+        batteries = {}
+        for adr in range(start, end, 1):
+            bdevid = "{:02X}".format(adr).encode()
+            try:
+                sn_str = await self._command(adr, 0x93, bdevid, self._parse_serial_number)  # Probe for serial number
+            except (ReplyTimeout, ChecksumError):
+                logger.debug("No battery found at address " + str(adr))
+                continue
+
+            batteries[adr] = sn_str
+            logger.debug("Found battery at address " + str(adr) + " with serial " + sn_str)
+
+        return batteries
+
+
+    async def get_protocol_version(self):
+        return await self._command(0, 0x4f)
+
+    async def get_manufacturer_info(self):
+        return await self._command(0, 0x51, parse=self._parse_manufacturer_info)
+
+    async def get_system_parameters(self, dev_id=None):
+        if dev_id:
+            bdevid = "{:02X}".format(dev_id).encode()
+            return await self._command(dev_id, 0x47, bdevid, self._parse_system_parameters)
+        return await self._command(2, 0x47, parse=self._parse_system_parameters)
+
+    async def get_management_info(self, dev_id):
+        bdevid = "{:02X}".format(dev_id).encode()
+        return await self._command(dev_id, 0x92, bdevid, self._parse_management_info)
+
+    async def get_module_serial_number(self, dev_id=None):
+        if dev_id:
+            bdevid = "{:02X}".format(dev_id).encode()
+            return await self._command(dev_id, 0x93, bdevid, self._parse_module_serial_number)
+        return await self._command(2, 0x93, parse=self._parse_module_serial_number)
+
+    async def get_values(self):
+        return await self._command(2, 0x42, b'FF', self._parse_values)
+
+    async def get_values_single(self, dev_id):
+        bdevid = "{:02X}".format(dev_id).encode()
+        return await self._command(dev_id, 0x42, bdevid, self._parse_values_single)
@@ -0,0 +1,205 @@
+""" Incremental statistics over successive get_values results.
+
+Each sample updates the aggregators in O(1) amortized time, independently of
+how much history they cover, so dashboards can read precomputed values
+instead of scanning the history:
+
+* `WindowedStats`: mean, minimum and maximum over a sliding time window
+  (running sum plus monotonic deques);
+* `Integrator`: charge and discharge totals of a rate, e.g. Wh from `Power`
+  or Ah from `Current`, both since the last reset and over the window.
+  Integration uses the trapezoidal rule split at zero crossings, and skips
+  the gaps longer than `max_gap` where the values are unknown.
+
+`StackAnalytics` keeps a set of them per module and for the whole stack.
+Timestamps must come from a monotonic clock, taken when each frame is received.
+"""
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+SECONDS_PER_HOUR = 3600.0
+
+
+class WindowedStats:
+    def __init__(self, window: float):
+        self.window = window
+        self._samples = deque()  # (t, value)
+        self._min = deque()  # increasing values
+        self._max = deque()  # decreasing values
+        self._sum = 0.0
+        self.last = None  # type: Optional[float]
+
+    def add(self, t: float, value: float):
+        self.last = value
+        self._samples.append((t, value))
+        self._sum += value
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((t, value))
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((t, value))
+        self._expire(t)
+
+    def _expire(self, now: float):
+        start = now - self.window
+        samples = self._samples
+        while samples[0][0] < start:
+            self._sum -= samples.popleft()[1]
+        while self._min[0][0] < start:
+            self._min.popleft()
+        while self._max[0][0] < start:
+            self._max.popleft()
+
+    @property
+    def count(self) -> int:
+        return len(self._samples)
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self._sum / len(self._samples) if self._samples else None
+
+    @property
+    def min(self) -> Optional[float]:
+        return self._min[0][1] if self._min else None
+
+    @property
+    def max(self) -> Optional[float]:
+        return self._max[0][1] if self._max else None
+
+
+class Integrator:
+    """ Integrates a rate into separate charge (positive) and discharge (negative) totals, in hours """
+    def __init__(self, window: float, max_gap: float = 60.0):
+        self.window = window
+        self.max_gap = max_gap
+        self.charged = 0.0  # since reset
+        self.discharged = 0.0  # since reset, positive
+        self.window_charged = 0.0
+        self.window_discharged = 0.0
+        self._increments = deque()  # (t, charged, discharged)
+        self._previous = None  # (t, value)
+
+    def add(self, t: float, value: float):
+        previous = self._previous
+        self._previous = (t, value)
+        if previous is None:
+            return
+        t0, v0 = previous
+        dt = t - t0
+        if dt <= 0 or dt > self.max_gap:
+            return
+
+        if v0 * value >= 0:
+            area = (v0 + value) / 2 * dt
+            charged, discharged = (area, 0.0) if area >= 0 else (0.0, -area)
+        else:  # the sign changes during the interval, split at the zero crossing
+            t_zero = dt * v0 / (v0 - value)
+            a0 = v0 * t_zero / 2
+            a1 = value * (dt - t_zero) / 2
+            charged, discharged = (a0, -a1) if a0 > 0 else (a1, -a0)
+        charged /= SECONDS_PER_HOUR
+        discharged /= SECONDS_PER_HOUR
+
+        self.charged += charged
+        self.discharged += discharged
+        self.window_charged += charged
+        self.window_discharged += discharged
+        increments = self._increments
+        increments.append((t, charged, discharged))
+        start = t - self.window
+        while increments[0][0] <= start:
+            _, c, d = increments.popleft()
+            self.window_charged -= c
+            self.window_discharged -= d
+
+    @property
+    def throughput(self) -> float:
+        return self.charged + self.discharged
+
+    def reset(self):
+        """ Restarts the since-reset totals; the window keeps going """
+        self.charged = 0.0
+        self.discharged = 0.0
+
+
+class SeriesAnalytics:
+    """ The aggregators of one module, or of the whole stack """
+    def __init__(self, window: float, max_gap: float):
+        self.cell_spread = WindowedStats(window)  # V, max - min of the cell voltages
+        self.voltage = WindowedStats(window)
+        self.current = WindowedStats(window)
+        self.power = WindowedStats(window)
+        self.energy = Integrator(window, max_gap)  # Wh
+        self.ampere_hours = Integrator(window, max_gap)  # Ah
+
+    def add(self, t: float, cell_spread: float, voltage: float, current: float, power: float):
+        self.cell_spread.add(t, cell_spread)
+        self.voltage.add(t, voltage)
+        self.current.add(t, current)
+        self.power.add(t, power)
+        self.energy.add(t, power)
+        self.ampere_hours.add(t, current)
+
+    def reset(self):
+        self.energy.reset()
+        self.ampere_hours.reset()
+
+    def summary(self) -> dict:
+        return {
+            "CellSpread": self.cell_spread.last,
+            "CellSpreadMax": self.cell_spread.max,
+            "CellSpreadMean": self.cell_spread.mean,
+            "VoltageMean": self.voltage.mean,
+            "CurrentMean": self.current.mean,
+            "PowerMean": self.power.mean,
+            "ChargedEnergy": self.energy.charged,
+            "DischargedEnergy": self.energy.discharged,
+            "WindowChargedEnergy": self.energy.window_charged,
+            "WindowDischargedEnergy": self.energy.window_discharged,
+            "ChargedAh": self.ampere_hours.charged,
+            "DischargedAh": self.ampere_hours.discharged,
+            "AhThroughput": self.ampere_hours.throughput,
+        }
+
+
+class StackAnalytics:
+    def __init__(self, window: float = 900.0, max_gap: float = 60.0, clock: Callable[[], float] = time.monotonic):
+        self.window = window
+        self.max_gap = max_gap
+        self.clock = clock
+        self.stack = SeriesAnalytics(window, max_gap)
+        self.modules = []  # type: List[SeriesAnalytics]
+        self.samples = 0
+
+    def update(self, values, timestamp: Optional[float] = None):
+        """ Adds a get_values result received at `timestamp` (monotonic, default: now) """
+        t = self.clock() if timestamp is None else timestamp
+        modules = values.Module
+        if len(modules) != len(self.modules):
+            self.modules = [SeriesAnalytics(self.window, self.max_gap) for _ in modules]
+
+        low = high = None
+        current = voltage = 0.0
+        for m, analytics in zip(modules, self.modules):
+            cells = m.CellVoltages
+            m_low, m_high = min(cells), max(cells)
+            analytics.add(t, m_high - m_low, m.Voltage, m.Current, m.Power)
+            low = m_low if low is None or m_low < low else low
+            high = m_high if high is None or m_high > high else high
+            current += m.Current
+            voltage += m.Voltage
+
+        # Modules are in parallel: the stack current is their sum, its voltage their mean
+        self.stack.add(t, high - low, voltage / len(modules), current, values.TotalPower)
+        self.samples += 1
+
+    def reset(self):
+        """ Restarts the since-reset energy and Ah totals of the stack and of every module """
+        self.stack.reset()
+        for m in self.modules:
+            m.reset()
+
+    def summary(self) -> dict:
+        return {"Stack": self.stack.summary(), "Module": [m.summary() for m in self.modules]}
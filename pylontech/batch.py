@@ -0,0 +1,205 @@
+""" Columnar decoding of many captured 0x42 (get_values) replies at once.
+
+Requires numpy (`pip install python-pylontech[numpy]`).
+
+Frames are decoded into raw integer arrays first (millivolts, deci-amps,
+deci-kelvin, ...) and converted to the same units as `Pylontech.get_values_fmt`
+in one vectorised step. Stacks mixing modules with different cell or
+temperature counts are padded with NaN. Large inputs are split across a
+process pool.
+"""
+import binascii
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from .codec import frame_checksum
+
+
+PARALLEL_THRESHOLD = 20000  # frames; below this a process pool costs more than it saves
+
+_MODULE_FIELDS = ("current", "voltage", "remaining_capacity", "total_capacity", "cycle_number", "average_bms_temperature")
+
+
+class ValuesBatch:
+    """ get_values results for T frames and up to M modules, C cells and K grouped temperatures.
+
+    Per module arrays are shaped (T, M), cell voltages (T, M, C) and grouped
+    cell temperatures (T, M, K). Missing modules, cells and temperatures are NaN,
+    and `valid` is False for frames that could not be decoded.
+    """
+    def __init__(self, valid, number_of_modules, number_of_cells, cell_voltages, number_of_temperatures,
+                 average_bms_temperature, grouped_cells_temperatures, current, voltage, remaining_capacity,
+                 total_capacity, cycle_number):
+        self.valid = valid
+        self.number_of_modules = number_of_modules
+        self.number_of_cells = number_of_cells
+        self.cell_voltages = cell_voltages
+        self.number_of_temperatures = number_of_temperatures
+        self.average_bms_temperature = average_bms_temperature
+        self.grouped_cells_temperatures = grouped_cells_temperatures
+        self.current = current
+        self.voltage = voltage
+        self.remaining_capacity = remaining_capacity
+        self.total_capacity = total_capacity
+        self.cycle_number = cycle_number
+
+        self.power = current * voltage
+        self.total_power = np.nansum(self.power, axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.state_of_charge = np.nansum(remaining_capacity, axis=1) / np.nansum(total_capacity, axis=1)
+        self.total_power[~valid] = np.nan
+        self.state_of_charge[~valid] = np.nan
+
+    def __len__(self):
+        return len(self.valid)
+
+
+class _RawBatch:
+    """ Integer arrays for one chunk of frames, sized for that chunk only """
+    def __init__(self, frames: Sequence[bytes]):
+        infos = [_frame_info(f) for f in frames]
+        layouts = [_scan_layout(info) if info is not None else None for info in infos]
+
+        n = len(frames)
+        m = max((len(layout) for layout in layouts if layout), default=0)
+        c = max((cells for layout in layouts if layout for _, cells, _ in layout), default=0)
+        k = max((temps - 1 for layout in layouts if layout for _, _, temps in layout), default=0)
+
+        self.valid = np.zeros(n, dtype=bool)
+        self.number_of_modules = np.zeros(n, dtype=np.int16)
+        self.number_of_cells = np.zeros((n, m), dtype=np.int16)
+        self.number_of_temperatures = np.zeros((n, m), dtype=np.int16)
+        self.cells = np.zeros((n, m, c), dtype=np.int32)
+        self.cells_mask = np.zeros((n, m, c), dtype=bool)
+        self.temperatures = np.zeros((n, m, k), dtype=np.int32)
+        self.temperatures_mask = np.zeros((n, m, k), dtype=bool)
+        self.module_mask = np.zeros((n, m), dtype=bool)
+        for name in _MODULE_FIELDS:
+            setattr(self, name, np.zeros((n, m), dtype=np.int64))
+
+        for t, (info, layout) in enumerate(zip(infos, layouts)):
+            if layout is None:
+                continue
+            self.valid[t] = True
+            self.number_of_modules[t] = len(layout)
+            for i, (offset, cells, temps) in enumerate(layout):
+                self._fill_module(info, t, i, offset, cells, temps)
+
+    def _fill_module(self, info, t, i, offset, cells, temps):
+        self.module_mask[t, i] = True
+        self.number_of_cells[t, i] = cells
+        self.number_of_temperatures[t, i] = temps
+
+        offset += 1
+        self.cells[t, i, :cells] = np.frombuffer(info, dtype=">i2", count=cells, offset=offset)
+        self.cells_mask[t, i, :cells] = True
+        offset += 2 * cells + 1
+
+        self.average_bms_temperature[t, i] = int.from_bytes(info[offset:offset + 2], "big", signed=True)
+        offset += 2
+        self.temperatures[t, i, :temps - 1] = np.frombuffer(info, dtype=">i2", count=temps - 1, offset=offset)
+        self.temperatures_mask[t, i, :temps - 1] = True
+        offset += 2 * (temps - 1)
+
+        self.current[t, i] = int.from_bytes(info[offset:offset + 2], "big", signed=True)
+        self.voltage[t, i] = int.from_bytes(info[offset + 2:offset + 4], "big")
+        remaining = int.from_bytes(info[offset + 4:offset + 6], "big")
+        user_defined = info[offset + 6]
+        total = int.from_bytes(info[offset + 7:offset + 9], "big")
+        self.cycle_number[t, i] = int.from_bytes(info[offset + 9:offset + 11], "big")
+        if user_defined > 2:
+            remaining = int.from_bytes(info[offset + 11:offset + 14], "big")
+            total = int.from_bytes(info[offset + 14:offset + 17], "big")
+        self.remaining_capacity[t, i] = remaining
+        self.total_capacity[t, i] = total
+
+
+def _frame_info(raw_frame: bytes) -> Optional[bytes]:
+    """ Returns the info payload after the INFOFLAG byte, or None for a corrupt frame """
+    frame = raw_frame.strip()
+    if len(frame) < 18 or frame[:1] != b"~":
+        return None
+    try:
+        if frame_checksum(memoryview(frame)[1:-4]) != int(frame[-4:], 16):
+            return None
+        return binascii.unhexlify(memoryview(frame)[13:-4])[1:]
+    except ValueError:
+        return None
+
+
+def _scan_layout(info: bytes):
+    """ Returns (offset, cells, temperatures) for every module block, or None if truncated """
+    try:
+        layout = []
+        offset = 1
+        for _ in range(info[0]):
+            cells = info[offset]
+            temps = info[offset + 1 + 2 * cells]
+            user_defined = info[offset + 2 * cells + 2 * temps + 8]
+            layout.append((offset, cells, temps))
+            offset += 2 * cells + 2 * temps + 13 + (6 if user_defined > 2 else 0)
+        if offset > len(info) or not layout:
+            return None
+        return layout
+    except IndexError:
+        return None
+
+
+def _pad(a, shape, fill):
+    out = np.full(shape, fill, dtype=a.dtype)
+    out[tuple(slice(0, d) for d in a.shape)] = a
+    return out
+
+
+def _merge(chunks: List[_RawBatch]) -> _RawBatch:
+    if len(chunks) == 1:
+        return chunks[0]
+
+    merged = _RawBatch([])
+    m = max(c.module_mask.shape[1] for c in chunks)
+    cells = max(c.cells.shape[2] for c in chunks)
+    k = max(c.temperatures.shape[2] for c in chunks)
+    for name in ("valid", "number_of_modules"):
+        setattr(merged, name, np.concatenate([getattr(c, name) for c in chunks]))
+    for name in ("number_of_cells", "number_of_temperatures", "module_mask") + _MODULE_FIELDS:
+        setattr(merged, name, np.concatenate([_pad(getattr(c, name), (len(c.valid), m), 0) for c in chunks]))
+    for name, depth in (("cells", cells), ("cells_mask", cells), ("temperatures", k), ("temperatures_mask", k)):
+        setattr(merged, name, np.concatenate([_pad(getattr(c, name), (len(c.valid), m, depth), 0) for c in chunks]))
+    return merged
+
+
+def decode_values_batch(frames: Sequence[bytes], processes: Optional[int] = None,
+                        parallel_threshold: int = PARALLEL_THRESHOLD) -> ValuesBatch:
+    """ Decodes raw 0x42 reply frames (as read from the port, `~` to `\\r`) into a ValuesBatch """
+    frames = list(frames)
+    if processes == 1 or len(frames) < parallel_threshold:
+        raw = _RawBatch(frames)
+    else:
+        workers = processes or os.cpu_count() or 1
+        with ProcessPoolExecutor(workers) as pool:
+            size = -(-len(frames) // workers)
+            chunks = [frames[i:i + size] for i in range(0, len(frames), size)]
+            raw = _merge(list(pool.map(_RawBatch, chunks)))
+
+    def scaled(a, mask, offset, divisor):
+        out = (a - offset) / divisor
+        out[~mask] = np.nan
+        return out
+
+    return ValuesBatch(
+        valid=raw.valid,
+        number_of_modules=raw.number_of_modules,
+        number_of_cells=raw.number_of_cells,
+        cell_voltages=scaled(raw.cells, raw.cells_mask, 0, 1000),
+        number_of_temperatures=raw.number_of_temperatures,
+        average_bms_temperature=scaled(raw.average_bms_temperature, raw.module_mask, 2731, 10.0),
+        grouped_cells_temperatures=scaled(raw.temperatures, raw.temperatures_mask, 2731, 10.0),
+        current=scaled(raw.current, raw.module_mask, 0, 10),
+        voltage=scaled(raw.voltage, raw.module_mask, 0, 1000),
+        remaining_capacity=scaled(raw.remaining_capacity, raw.module_mask, 0, 1000),
+        total_capacity=scaled(raw.total_capacity, raw.module_mask, 0, 1000),
+        cycle_number=raw.cycle_number,
+    )
@@ -0,0 +1,115 @@
+""" Thread-safe access to one serial bus shared by many consumers.
+
+A single `BusOwner` thread talks to the port and serves a queue of requests,
+so request/reply pairs can never interleave. Identical requests (same
+address, CID2 and info) still waiting in the queue are merged: ten threads
+asking for `get_values()` at the same time cause one bus transaction.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Optional
+
+from .pylontech import Pylontech
+
+logger = logging.getLogger(__name__)
+
+
+class BusOwner:
+    def __init__(self, p: Pylontech):
+        self.p = p
+        self.transactions = 0
+        self.coalesced = 0
+        self._pending = OrderedDict()  # (address, cid2, info) or callable -> Future
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="pylontech-bus", daemon=True)
+        self._thread.start()
+
+    def _submit(self, key, job) -> Future:
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Bus owner is closed")
+            entry = self._pending.get(key)
+            if entry is not None:
+                self.coalesced += 1
+                return entry[1]
+            future = Future()
+            self._pending[key] = (job, future)
+            self._cond.notify()
+            return future
+
+    def request(self, address: int, cid2: int, info: bytes = b'', timeout: Optional[float] = None):
+        """ Sends a command from the owner thread and returns the decoded reply frame """
+        key = (address, cid2, bytes(info))
+        return self._submit(key, lambda: self.p._command(address, cid2, info)).result(timeout)
+
+    def call(self, fn, *args, timeout: Optional[float] = None):
+        """ Runs `fn(*args)` on the owner thread, with exclusive use of the bus; never merged """
+        job = lambda: fn(*args)  # noqa: E731
+        return self._submit(job, job).result(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                _, (job, future) = self._pending.popitem(last=False)
+
+            if not future.set_running_or_notify_cancel():
+                continue
+            self.transactions += 1
+            try:
+                future.set_result(job())
+            except Exception as e:
+                logger.debug("Bus transaction failed: %r", e)
+                future.set_exception(e)
+
+    def close(self, timeout: Optional[float] = None):
+        """ Stops the owner thread once the queued requests are served """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+
+class SharedPylontech(Pylontech):
+    """ `Pylontech` front end that can be used from any number of threads.
+
+    All bus traffic goes through a `BusOwner` wrapping the given, already opened instance.
+    """
+    def __init__(self, p: Pylontech):
+        self.p = p
+        self.s = p.s
+        self.fast_decode = p.fast_decode
+        self.lazy_decode = p.lazy_decode
+        self.bus = BusOwner(p)
+
+    def _command(self, address: int, cmd, info: bytes = b'', parse=None):
+        # The reply frame may be shared by merged requests, each caller parses its own copy
+        f = self.bus.request(address, cmd, info)
+        return f if parse is None else parse(f)
+
+    def send_cmd(self, address: int, cmd, info: bytes = b''):
+        raise RuntimeError("Raw bus access is reserved to the bus owner thread, use _command()")
+
+    def read_frame(self):
+        raise RuntimeError("Raw bus access is reserved to the bus owner thread, use _command()")
+
+    def read_raw_frame(self):
+        raise RuntimeError("Raw bus access is reserved to the bus owner thread, use _command()")
+
+    def probe_serial_number(self, adr: int, adaptive=True):
+        return self.bus.call(self.p.probe_serial_number, adr, adaptive)
+
+    def scan_for_batteries(self, start=0, end=255):
+        return self.bus.call(self.p.scan_for_batteries, start, end)
+
+    def discover_batteries(self, *args, **kwargs):
+        return self.bus.call(lambda: self.p.discover_batteries(*args, **kwargs))
+
+    def close(self):
+        self.bus.close()
@@ -0,0 +1,277 @@
+""" Recording and replay of the raw frames exchanged with the batteries.
+
+A capture is made of two files:
+
+* the data file: a header followed by length-prefixed records holding the
+  monotonic timestamp, direction, address and CID2 of each frame and the frame
+  itself, exactly as it went over the wire;
+* the index file (`<data file>.idx`): one fixed-size entry per record with its
+  offset in the data file, timestamp, direction, address and CID2, so a time
+  range or an address can be located without reading the frames.
+
+`RecordingSerial` wraps a serial object and records everything going through
+it: valid frames as RX, and line noise, truncated frames and frames with a bad
+checksum as RX_INVALID. `ReplaySerial` plays a capture back to a `Pylontech`
+instance, including the invalid bytes. Both files are read through mmap, so
+opening a large capture costs nothing until records are looked up.
+"""
+import mmap
+import os
+import struct
+import time
+from array import array
+from collections import defaultdict, namedtuple
+from typing import Dict, Iterator, Optional
+
+from .framing import EOI, SOI, FrameReader
+
+MAGIC = b"PYLCAP1\x00"
+FILE_HEADER = struct.Struct("<8sdd")  # magic, wall clock and monotonic time at the start of the capture
+RECORD_HEADER = struct.Struct("<IdBBB")  # frame length, monotonic timestamp, direction, address, cid2
+INDEX_ENTRY = struct.Struct("<QdBBB")  # record offset, monotonic timestamp, direction, address, cid2
+
+TX = 0
+RX = 1
+RX_INVALID = 2  # received bytes that are not a valid frame
+
+CaptureRecord = namedtuple("CaptureRecord", ["timestamp", "direction", "address", "cid2", "frame"])
+
+
+def _frame_address(frame: bytes):
+    """ Returns (address, cid2) from the header of a raw frame, (0xff, 0xff) if unreadable """
+    try:
+        return int(frame[3:5], 16), int(frame[7:9], 16)
+    except ValueError:
+        return 0xff, 0xff
+
+
+class CaptureWriter:
+    def __init__(self, path):
+        self.path = path
+        self.data = open(path, "wb")
+        self.index = open(str(path) + ".idx", "wb")
+        self.data.write(FILE_HEADER.pack(MAGIC, time.time(), time.monotonic()))
+
+    def write(self, direction: int, frame: bytes, timestamp: Optional[float] = None):
+        if timestamp is None:
+            timestamp = time.monotonic()
+        address, cid2 = _frame_address(frame)
+        self.index.write(INDEX_ENTRY.pack(self.data.tell(), timestamp, direction, address, cid2))
+        self.data.write(RECORD_HEADER.pack(len(frame), timestamp, direction, address, cid2))
+        self.data.write(frame)
+
+    def flush(self):
+        self.data.flush()
+        self.index.flush()
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class CaptureReader:
+    """ Random access to a capture; frames are returned as memoryviews into the mmapped file """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.wall_start, self.monotonic_start = FILE_HEADER.unpack_from(self._data, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a pylontech capture: %s" % path)
+
+        with open(str(path) + ".idx", "rb") as f:
+            empty = os.fstat(f.fileno()).st_size == 0  # an empty file cannot be mmapped
+            self._index_data = b"" if empty else mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        size = len(self._index_data)
+        self._index = memoryview(self._index_data)[:size - size % INDEX_ENTRY.size]
+        self._view = memoryview(self._data)
+        self._by_address = None  # type: Optional[Dict[int, array]]
+
+    def close(self):
+        self._view.release()
+        self._index.release()
+        self._data.close()
+        if self._index_data:
+            self._index_data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return len(self._index) // INDEX_ENTRY.size
+
+    def _entry(self, i: int):
+        return INDEX_ENTRY.unpack_from(self._index, i * INDEX_ENTRY.size)
+
+    def record_at(self, offset: int) -> CaptureRecord:
+        length, timestamp, direction, address, cid2 = RECORD_HEADER.unpack_from(self._data, offset)
+        start = offset + RECORD_HEADER.size
+        return CaptureRecord(timestamp, direction, address, cid2, self._view[start:start + length])
+
+    def record(self, i: int) -> CaptureRecord:
+        """ The record at position `i` of the capture """
+        return self.record_at(self._entry(i)[0])
+
+    def __iter__(self) -> Iterator[CaptureRecord]:
+        for i in range(len(self)):
+            yield self.record(i)
+
+    def _first_after(self, timestamp: float) -> int:
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(mid)[1] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def between(self, start: float, end: float) -> Iterator[CaptureRecord]:
+        """ Records with start <= timestamp < end, found by bisecting the index """
+        for i in range(self._first_after(start), len(self)):
+            offset, timestamp = self._entry(i)[:2]
+            if timestamp >= end:
+                return
+            yield self.record_at(offset)
+
+    def _address_index(self) -> Dict[int, array]:
+        """ Positions of the records of each address, built with one pass over the index on first use """
+        if self._by_address is None:
+            by_address = defaultdict(lambda: array("L"))
+            for i, (_, _, _, address, _) in enumerate(INDEX_ENTRY.iter_unpack(self._index)):
+                by_address[address].append(i)
+            self._by_address = dict(by_address)
+        return self._by_address
+
+    def for_address(self, address: int, direction: Optional[int] = None) -> Iterator[CaptureRecord]:
+        for i in self._address_index().get(address, ()):
+            offset, _, d, _, _ = self._entry(i)
+            if direction is None or d == direction:
+                yield self.record_at(offset)
+
+
+def _is_valid_frame(candidate: bytes) -> bool:
+    framer = FrameReader()
+    framer.feed(candidate)
+    return framer.next_frame() == candidate
+
+
+class RecordingSerial:
+    """ Serial wrapper recording every frame written and every byte read.
+
+    The received stream is cut after each end of frame byte; a piece that is not a valid frame
+    (or the garbage before the last start byte of a piece) is recorded as RX_INVALID.
+    """
+    def __init__(self, s, writer: CaptureWriter):
+        self.s = s
+        self.writer = writer
+        self._received = bytearray()
+
+    def __getattr__(self, name):
+        return getattr(self.s, name)
+
+    @property
+    def timeout(self):
+        return self.s.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.s.timeout = value
+
+    def write(self, data: bytes):
+        self.writer.write(TX, bytes(data))
+        return self.s.write(data)
+
+    def read(self, size=1) -> bytes:
+        data = self.s.read(size)
+        if data:
+            received = self._received
+            received += data
+            while True:
+                end = received.find(EOI)
+                if end < 0:
+                    break
+                self._record_received(bytes(received[:end + 1]))
+                del received[:end + 1]
+        return data
+
+    def _record_received(self, piece: bytes):
+        start = piece.rfind(SOI)
+        if start > 0:
+            self.writer.write(RX_INVALID, piece[:start])
+            piece = piece[start:]
+        self.writer.write(RX if start >= 0 and _is_valid_frame(piece) else RX_INVALID, piece)
+
+    def close(self):
+        if self._received:
+            self.writer.write(RX_INVALID, bytes(self._received))
+            del self._received[:]
+        self.writer.close()
+        self.s.close()
+
+
+class ReplaySerial:
+    """ Serial-like transport playing back what was received in a capture, invalid bytes included.
+
+    Every write() skips ahead past the next recorded request, after which read() returns the
+    replies recorded for it; once those are consumed, read() behaves like a timeout. A capture
+    holding no requests at all simply streams every received frame.
+    """
+    def __init__(self, path, baudrate=115200, timeout=2):
+        self.reader = CaptureReader(path)
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self._count = len(self.reader)
+        self._has_requests = any(e[2] == TX for e in INDEX_ENTRY.iter_unpack(self.reader._index))
+        self._cursor = 0
+        self._pending = memoryview(b"")
+
+    def _next_rx(self) -> bool:
+        if self._cursor >= self._count:
+            return False
+        record = self.reader.record(self._cursor)
+        if record.direction == TX:
+            return False
+        self._cursor += 1
+        self._pending = record.frame
+        return True
+
+    def write(self, data: bytes):
+        if not self._has_requests:
+            return len(data)
+        self._pending = memoryview(b"")
+        while self._cursor < self._count:
+            record = self.reader.record(self._cursor)
+            self._cursor += 1
+            if record.direction == TX:
+                break
+        return len(data)
+
+    @property
+    def in_waiting(self) -> int:
+        if not self._pending and not self._next_rx():
+            return 0
+        return len(self._pending)
+
+    def read(self, size=1) -> bytes:
+        out = bytearray()
+        while len(out) < size:
+            if not self._pending and not self._next_rx():
+                break
+            chunk = self._pending[:size - len(out)]
+            out += chunk
+            self._pending = self._pending[len(chunk):]
+        return bytes(out)
+
+    def close(self):
+        self._pending = memoryview(b"")
+        self.reader.close()
@@ -0,0 +1,133 @@
+""" Command line interface: `python -m pylontech`.
+
+    python -m pylontech daemon --port /dev/ttyUSB0 --poll-interval 1
+    python -m pylontech get_values
+    python -m pylontech get_management_info 3
+
+A query is sent to the daemon (see `pylontech.daemon`) over its Unix socket,
+so it only costs the interpreter startup and a round trip to memory. The
+client side imports nothing but the standard library; `construct` and
+`serial` are only loaded by the daemon, or when no daemon is running and the
+query falls back to opening the port itself.
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+
+METHODS = (
+    "get_values",
+    "get_values_single",
+    "get_system_parameters",
+    "get_management_info",
+    "get_module_serial_number",
+    "get_protocol_version",
+    "get_manufacturer_info",
+    "scan_for_batteries",
+    "discover_batteries",
+)
+
+DEFAULT_SOCKET = os.environ.get("PYLONTECH_SOCKET",
+                                os.path.join(os.environ.get("XDG_RUNTIME_DIR", "/tmp"), "pylontech.sock"))
+
+
+class DaemonError(Exception):
+    """ The daemon answered with an error """
+    def __init__(self, error: str, message: str):
+        super().__init__("%s: %s" % (error, message))
+        self.error = error
+
+
+def query(socket_path: str, method: str, args=(), timeout: float = 10.0):
+    """ Sends one request to the daemon and returns the decoded result """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(socket_path)
+        s.sendall(json.dumps({"method": method, "args": list(args)}).encode() + b"\n")
+        buf = b""
+        while not buf.endswith(b"\n"):
+            data = s.recv(65536)
+            if not data:
+                raise ConnectionError("Daemon closed the connection")
+            buf += data
+    reply = json.loads(buf)
+    if not reply["ok"]:
+        raise DaemonError(reply["error"], reply["message"])
+    return reply["result"]
+
+
+def _open(args):
+    from .pylontech import Pylontech
+    return Pylontech(args.port, args.baudrate)
+
+
+def run_direct(args):
+    """ Opens the port for a single query, when no daemon is running """
+    from .daemon import to_builtin
+    p = _open(args)
+    try:
+        return to_builtin(getattr(p, args.method)(*args.args))
+    finally:
+        p.s.close()
+
+
+def run_daemon(args):
+    import logging
+    import signal
+    import threading
+
+    from .daemon import PylontechDaemon
+
+    logging.basicConfig(level=logging.INFO)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    p = _open(args)
+    with PylontechDaemon(p, args.socket, cache_ttl=args.cache_ttl, poll_interval=args.poll_interval):
+        try:
+            stop.wait()
+        except KeyboardInterrupt:
+            pass
+    p.s.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pylontech", description="Query Pylontech batteries")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="daemon socket (default: %(default)s)")
+    parser.add_argument("--port", default="/dev/ttyUSB0", help="serial port")
+    parser.add_argument("--baudrate", type=int, default=115200)
+    sub = parser.add_subparsers(dest="method")
+    sub.required = True
+
+    daemon = sub.add_parser("daemon", help="own the serial port and serve queries on the socket")
+    daemon.add_argument("--cache-ttl", type=float, default=1.0, help="seconds a reply is served from cache")
+    daemon.add_argument("--poll-interval", type=float, help="refresh get_values in the background")
+
+    for method in METHODS:
+        q = sub.add_parser(method)
+        q.add_argument("args", type=int, nargs="*", help="addresses")
+        q.add_argument("--direct", action="store_true", help="open the port even if a daemon is running")
+        q.add_argument("--no-fallback", action="store_true", help="fail instead of opening the port without daemon")
+
+    args = parser.parse_args(argv)
+    if args.method == "daemon":
+        run_daemon(args)
+        return 0
+
+    try:
+        if args.direct:
+            result = run_direct(args)
+        else:
+            try:
+                result = query(args.socket, args.method, args.args)
+            except (FileNotFoundError, ConnectionRefusedError):
+                if args.no_fallback:
+                    raise
+                result = run_direct(args)
+    except (DaemonError, OSError, ValueError) as e:
+        print("error: %s" % e, file=sys.stderr)
+        return 1
+
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 0
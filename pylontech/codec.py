@@ -0,0 +1,59 @@
+""" Wire level encoding and decoding of Pylontech frames.
+
+A frame is `~`, the ASCII hex encoded VER, ADR, CID1, CID2, LENGTH and INFO
+fields, a 4 hex digit checksum and `\\r`. These helpers work on bytes and
+memoryviews without per-byte Python code, and request frames are cached since
+a poll loop keeps sending the same few of them.
+"""
+import binascii
+from functools import lru_cache
+
+import construct
+
+CID1 = 0x46
+VERSION = 0x20
+
+
+def frame_checksum(frame) -> int:
+    return (~sum(frame) & 0xffff) + 1
+
+
+def length_field(lenid: int) -> int:
+    """ Returns the LENGTH field (LCHKSUM + LENID) for an info of `lenid` bytes """
+    if lenid == 0:
+        return 0
+
+    lenid_sum = (lenid & 0xf) + ((lenid >> 4) & 0xf) + ((lenid >> 8) & 0xf)
+    lenid_modulo = lenid_sum % 16
+    lenid_invert_plus_one = (0b1111 - lenid_modulo + 1) & 0xf  # a sum multiple of 16 gives 0, not 16
+
+    return (lenid_invert_plus_one << 12) + lenid
+
+
+def info_length(length: int):
+    """ Returns LENID from the 16 bits LENGTH field, or None if its LCHKSUM is wrong """
+    lenid = length & 0xfff
+    lchksum = length >> 12
+    lenid_sum = (lenid & 0xf) + ((lenid >> 4) & 0xf) + ((lenid >> 8) & 0xf)
+    if (lchksum + lenid_sum) % 16 != 0:
+        return None
+    return lenid
+
+
+@lru_cache(maxsize=1024)
+def encode_cmd(address: int, cid2: int, info: bytes = b'') -> bytes:
+    frame = b"%02X%02X%02X%02X%04X" % (VERSION, address, CID1, cid2, length_field(len(info))) + info
+    return b"~" + frame + b"%04X\r" % frame_checksum(frame)
+
+
+def decode_frame(frame) -> construct.Container:
+    """ Decodes the hex fields of a frame stripped of its `~`, checksum and `\\r` """
+    view = memoryview(frame)
+    return construct.Container(
+        ver=binascii.unhexlify(view[0:2]),
+        adr=binascii.unhexlify(view[2:4]),
+        cid1=binascii.unhexlify(view[4:6]),
+        cid2=binascii.unhexlify(view[6:8]),
+        infolength=binascii.unhexlify(view[8:12]),
+        info=binascii.unhexlify(view[12:]),
+    )
@@ -0,0 +1,136 @@
+""" Local daemon owning the serial port, serving the getters over a Unix socket.
+
+One process opens the port and keeps it; any number of short-lived clients
+(see `pylontech.cli`) send requests as JSON lines:
+
+    {"method": "get_values_single", "args": [3]}
+
+and get one JSON line back, `{"ok": true, "result": {...}}` or
+`{"ok": false, "error": "ReplyTimeout", "message": "..."}`.
+
+Bus access goes through a `SharedPylontech`, so simultaneous identical
+requests cost one transaction, and replies are cached already encoded for
+`cache_ttl` seconds. With `poll_interval`, get_values is refreshed in the
+background so that queries are served from memory without waiting for the bus.
+"""
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+from typing import Optional
+
+from .bus import SharedPylontech
+from .cli import METHODS
+from .pylontech import Pylontech
+from .scheduler import PollScheduler
+
+logger = logging.getLogger(__name__)
+
+
+def to_builtin(obj):
+    """ Converts construct Containers, fastdecode records and bytes to JSON-friendly values """
+    if isinstance(obj, (bool, int, float, str)) or obj is None:
+        return obj
+    if isinstance(obj, (bytes, bytearray)):
+        return bytes(obj).decode(errors="replace")
+    if isinstance(obj, dict):
+        return {str(k): to_builtin(v) for k, v in obj.items() if not str(k).startswith("_")}
+    if isinstance(obj, (list, tuple)):
+        return [to_builtin(v) for v in obj]
+    public_fields = getattr(obj, "_public_fields", None)
+    if public_fields is not None:
+        return {k: to_builtin(getattr(obj, k)) for k in public_fields()}
+    return str(obj)
+
+
+def encode_reply(result) -> bytes:
+    return json.dumps({"ok": True, "result": to_builtin(result)}).encode() + b"\n"
+
+
+def encode_error(e: BaseException) -> bytes:
+    return json.dumps({"ok": False, "error": type(e).__name__, "message": str(e)}).encode() + b"\n"
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                reply = self.server.daemon.query(request["method"], request.get("args", []))
+            except Exception as e:
+                reply = encode_error(e)
+            self.wfile.write(reply)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class PylontechDaemon:
+    def __init__(self, p: Pylontech, socket_path: str, cache_ttl: float = 1.0, poll_interval: Optional[float] = None):
+        self.p = p if isinstance(p, SharedPylontech) else SharedPylontech(p)
+        self.socket_path = socket_path
+        self.cache_ttl = cache_ttl
+        self.scheduler = PollScheduler(self.p)
+        self.cache = self.scheduler.cache
+        if poll_interval:
+            self.scheduler.add(self._key("get_values", []), self._call, "get_values", [], interval=poll_interval)
+        self._server = None  # type: Optional[_Server]
+        self._thread = None
+
+    @staticmethod
+    def _key(method: str, args) -> str:
+        return json.dumps([method, list(args)])
+
+    def _call(self, method: str, args) -> bytes:
+        if method not in METHODS:
+            raise ValueError("Unknown method %r" % method)
+        return encode_reply(getattr(self.p, method)(*args))
+
+    def query(self, method: str, args) -> bytes:
+        """ Encoded reply to `method(*args)`, from the cache when it is fresh enough """
+        key = self._key(method, args)
+        reply = self.cache.get(key)
+        if reply is None:
+            reply = self._call(method, args)
+            self.cache.set(key, reply, self.cache_ttl)
+        return reply
+
+    def start(self) -> "PylontechDaemon":
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+                raise RuntimeError("A daemon is already listening on %s" % self.socket_path)
+            except ConnectionRefusedError:
+                os.unlink(self.socket_path)  # left behind by a daemon that died
+            finally:
+                probe.close()
+
+        self._server = _Server(self.socket_path, _Handler)
+        self._server.daemon = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name="pylontech-daemon", daemon=True)
+        self._thread.start()
+        if self.scheduler.jobs:
+            self.scheduler.start()
+        logger.info("Serving on %s", self.socket_path)
+        return self
+
+    def stop(self):
+        self.scheduler.stop()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            os.unlink(self.socket_path)
+        self.p.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
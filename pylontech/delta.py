@@ -0,0 +1,155 @@
+""" Delta encoding of successive get_values / get_values_single results.
+
+`DeltaEncoder` flattens each result into a list of numbers whose layout
+(field names, module, cell and temperature counts) is computed once and reused
+while the stack shape does not change. It emits a keyframe with every value
+every `keyframe_interval` messages (or when the layout changes) and, in
+between, only the values that moved by at least their deadband since they
+were last sent. `DeltaDecoder` rebuilds the full state on the receiving side.
+
+Messages are plain dicts of lists and numbers, ready for JSON or msgpack.
+"""
+from typing import Dict, List, Optional
+
+STACK_FIELDS = ("TotalPower", "StateOfCharge")
+MODULE_FIELDS = ("AverageBMSTemperature", "Current", "Voltage", "Power", "RemainingCapacity", "TotalCapacity",
+                 "CycleNumber")
+MODULE_ARRAYS = ("CellVoltages", "GroupedCellsTemperatures")
+
+DEFAULT_DEADBANDS = {
+    "CellVoltages": 0.001,  # V
+    "GroupedCellsTemperatures": 0.1,  # °C
+    "AverageBMSTemperature": 0.1,
+    "Current": 0.1,  # A
+    "Voltage": 0.01,
+    "Power": 1.0,  # W
+    "TotalPower": 1.0,
+    "RemainingCapacity": 0.01,  # Ah
+    "StateOfCharge": 0.001,
+}
+
+
+def _modules(values):
+    """ Returns (key prefix, module) pairs for a get_values or a get_values_single result """
+    if hasattr(values, "Module"):
+        return [("Module.%d." % i, m) for i, m in enumerate(values.Module)]
+    return [("", values)]
+
+
+def layout_of(values) -> List[str]:
+    keys = list(STACK_FIELDS)
+    for prefix, m in _modules(values):
+        keys.extend(prefix + field for field in MODULE_FIELDS)
+        for field in MODULE_ARRAYS:
+            keys.extend("%s%s.%d" % (prefix, field, j) for j in range(len(m[field])))
+    return keys
+
+
+def _shape(values) -> tuple:
+    return tuple((len(m.CellVoltages), len(m.GroupedCellsTemperatures)) for _, m in _modules(values))
+
+
+def flatten(values) -> list:
+    """ Values in the order of layout_of(values) """
+    out = [values.TotalPower, values.StateOfCharge]
+    for _, m in _modules(values):
+        out.extend([m.AverageBMSTemperature, m.Current, m.Voltage, m.Power, m.RemainingCapacity,
+                    m.TotalCapacity, m.CycleNumber])
+        out.extend(m.CellVoltages)
+        out.extend(m.GroupedCellsTemperatures)
+    return out
+
+
+class DeltaEncoder:
+    def __init__(self, deadbands: Optional[Dict[str, float]] = None, keyframe_interval: int = 60):
+        self.deadbands = dict(DEFAULT_DEADBANDS if deadbands is None else deadbands)
+        self.keyframe_interval = keyframe_interval
+        self.seq = 0
+        self._shape = None
+        self._layout = []  # type: List[str]
+        self._thresholds = []  # type: List[float]
+        self._sent = []  # type: list
+        self._since_keyframe = 0
+
+    def _field(self, key: str) -> str:
+        parts = key.split(".")
+        return parts[-2] if parts[-1].isdigit() else parts[-1]
+
+    def keyframe(self):
+        """ Forces the next message to be a keyframe, e.g. when a subscriber joins """
+        self._since_keyframe = self.keyframe_interval
+
+    def encode(self, values) -> dict:
+        self.seq += 1
+        current = flatten(values)
+
+        shape = _shape(values)
+        if shape != self._shape:
+            self._shape = shape
+            self._layout = layout_of(values)
+            self._thresholds = [self.deadbands.get(self._field(k), 0.0) for k in self._layout]
+            self._since_keyframe = self.keyframe_interval
+
+        if self._since_keyframe >= self.keyframe_interval:
+            self._since_keyframe = 1
+            self._sent = list(current)
+            return {"type": "key", "seq": self.seq, "layout": self._layout, "values": current}
+
+        self._since_keyframe += 1
+        sent = self._sent
+        thresholds = self._thresholds
+        changes = []
+        for i, value in enumerate(current):
+            diff = abs(value - sent[i])
+            if diff and diff + 1e-9 >= thresholds[i]:
+                sent[i] = value
+                changes.append([i, value])
+        return {"type": "delta", "seq": self.seq, "changes": changes}
+
+
+class SequenceGap(Exception):
+    """ A delta was lost; the decoder needs a keyframe before it can go on """
+
+
+class DeltaDecoder:
+    def __init__(self):
+        self.seq = None
+        self.layout = None  # type: Optional[List[str]]
+        self.values = None  # type: Optional[list]
+
+    def apply(self, message: dict) -> Dict[str, float]:
+        """ Applies a message and returns the full state as a flat key -> value dict """
+        if message["type"] == "key":
+            self.layout = list(message["layout"])
+            self.values = list(message["values"])
+        else:
+            if self.values is None or message["seq"] != self.seq + 1:
+                self.values = None
+                raise SequenceGap("Expected message %s, got %s" % (None if self.seq is None else self.seq + 1,
+                                                                   message["seq"]))
+            for i, value in message["changes"]:
+                self.values[i] = value
+        self.seq = message["seq"]
+        return self.state()
+
+    def state(self) -> Dict[str, float]:
+        return dict(zip(self.layout, self.values))
+
+    def nested(self) -> dict:
+        """ The state shaped like a get_values result: {"TotalPower": .., "Module": [{"CellVoltages": [..]}]} """
+        out = {}  # type: dict
+        for key, value in zip(self.layout, self.values):
+            parts = key.split(".")
+            if parts[0] == "Module":
+                modules = out.setdefault("Module", [])
+                i = int(parts[1])
+                while len(modules) <= i:
+                    modules.append({})
+                target, parts = modules[i], parts[2:]
+            else:
+                target = out
+            if len(parts) == 2:
+                target.setdefault(parts[0], []).append(value)
+            else:
+                target[parts[0]] = value
+        return out
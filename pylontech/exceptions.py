@@ -0,0 +1,17 @@
+""" Errors raised by the bus layer.
+
+They derive from `ValueError`, which is what a missing or corrupted reply used
+to raise, so existing `except ValueError` handlers keep working.
+"""
+
+
+class PylontechError(Exception):
+    """ Base class of the errors raised by this library """
+
+
+class ReplyTimeout(PylontechError, ValueError):
+    """ No valid reply arrived before the deadline """
+
+
+class ChecksumError(PylontechError, ValueError):
+    """ A reply arrived but its checksum did not match """
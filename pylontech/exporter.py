@@ -0,0 +1,204 @@
+""" Prometheus / OpenMetrics text exposition of the battery telemetry.
+
+The exposition text is kept pre-rendered: the series layout (names, labels,
+HELP and TYPE lines) is only rebuilt when the stack shape changes, an update
+only rewrites the values that changed, and a scrape returns the cached buffer
+without ever touching the bus.
+"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+
+def _fmt(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+# Each family has a function giving the labels of its series, only called when the layout changes, and one giving
+# their values in the same order, called on every update.
+
+def _module_labels(values):
+    return ['module="%d"' % (i + 1) for i in range(len(values.Module))]
+
+
+def _module_values(attr):
+    def series(values):
+        return [getattr(m, attr) for m in values.Module]
+    return series
+
+
+def _cell_labels(values):
+    return ['module="%d",cell="%d"' % (i + 1, j + 1)
+            for i, m in enumerate(values.Module) for j in range(len(m.CellVoltages))]
+
+
+def _cell_voltages(values):
+    return [v for m in values.Module for v in m.CellVoltages]
+
+
+def _temperature_labels(values):
+    labels = []
+    for i, m in enumerate(values.Module):
+        labels.append('module="%d",sensor="bms"' % (i + 1))
+        labels.extend('module="%d",sensor="%d"' % (i + 1, j + 1) for j in range(len(m.GroupedCellsTemperatures)))
+    return labels
+
+
+def _temperatures(values):
+    temperatures = []
+    for m in values.Module:
+        temperatures.append(m.AverageBMSTemperature)
+        temperatures.extend(m.GroupedCellsTemperatures)
+    return temperatures
+
+
+def _stack_labels(values):
+    return [""]
+
+
+def _stack_values(attr):
+    def series(values):
+        return [values[attr]]
+    return series
+
+
+def _parameter_names(parameters):
+    return tuple(name for name in parameters if not name.startswith("_"))
+
+
+def _parameter_labels(parameters):
+    return ['parameter="%s"' % name for name in _parameter_names(parameters)]
+
+
+def _parameter_values(parameters):
+    return [parameters[name] for name in _parameter_names(parameters)]
+
+
+def _values_shape(values):
+    return tuple((len(m.CellVoltages), len(m.GroupedCellsTemperatures)) for m in values.Module)
+
+
+VALUES_FAMILIES = [
+    ("cell_voltage_volts", "Voltage of each cell", _cell_labels, _cell_voltages),
+    ("module_temperature_celsius", "Module BMS and grouped cells temperatures", _temperature_labels, _temperatures),
+    ("module_current_amperes", "Module current, negative when discharging", _module_labels,
+     _module_values("Current")),
+    ("module_voltage_volts", "Module voltage", _module_labels, _module_values("Voltage")),
+    ("module_power_watts", "Module power, negative when discharging", _module_labels, _module_values("Power")),
+    ("module_remaining_capacity_amperehours", "Module remaining capacity", _module_labels,
+     _module_values("RemainingCapacity")),
+    ("module_total_capacity_amperehours", "Module total capacity", _module_labels, _module_values("TotalCapacity")),
+    ("module_cycle_count", "Module charge cycles", _module_labels, _module_values("CycleNumber")),
+    ("stack_power_watts", "Stack power, negative when discharging", _stack_labels, _stack_values("TotalPower")),
+    ("stack_state_of_charge_ratio", "Stack state of charge", _stack_labels, _stack_values("StateOfCharge")),
+]
+
+PARAMETERS_FAMILIES = [
+    ("system_parameter", "BMS limits from get_system_parameters", _parameter_labels, _parameter_values),
+]
+
+# source kind, its families, and the function giving the shape key its layout is rebuilt on
+SOURCES = (
+    ("values", VALUES_FAMILIES, _values_shape),
+    ("parameters", PARAMETERS_FAMILIES, _parameter_names),
+)
+
+
+class MetricsExporter:
+    def __init__(self, namespace: str = "pylontech", labels: Optional[Dict[str, str]] = None):
+        self.namespace = namespace
+        self.const_labels = ",".join('%s="%s"' % kv for kv in sorted((labels or {}).items()))
+        self._lock = threading.Lock()
+        self._sources = {}  # kind -> latest result, "values" / "parameters"
+        self._shape = None  # shape key of the current layout
+        self._parts = []  # type: List[str]
+        self._slots = []  # index in _parts of every series value
+        self._values = []  # last raw value of every series
+        self._rendered = b""
+        self._dirty = True
+
+    def _present(self):
+        return [(kind, families, shape, self._sources[kind]) for kind, families, shape in SOURCES
+                if kind in self._sources]
+
+    def _labels(self, labels: str) -> str:
+        joined = ",".join(x for x in (self.const_labels, labels) if x)
+        return "{%s}" % joined if joined else ""
+
+    def _rebuild(self, present, shape):
+        parts, slots, raw = [], [], []
+        for _, families, _, source in present:
+            for name, help, labels_of, values_of in families:
+                metric = "%s_%s" % (self.namespace, name)
+                parts.append("# HELP %s %s\n# TYPE %s gauge\n" % (metric, help, metric))
+                for labels, value in zip(labels_of(source), values_of(source)):
+                    parts.append("%s%s " % (metric, self._labels(labels)))
+                    slots.append(len(parts))
+                    raw.append(value)
+                    parts.append(_fmt(value))
+                    parts.append("\n")
+        self._parts, self._slots, self._values, self._shape = parts, slots, raw, shape
+
+    def _refresh(self):
+        present = self._present()
+        shape = tuple((kind, shape_of(source)) for kind, _, shape_of, source in present)
+        if shape != self._shape:
+            self._rebuild(present, shape)
+            self._dirty = True
+            return
+
+        parts, last, slots = self._parts, self._values, self._slots
+        i = 0
+        for _, families, _, source in present:
+            for _, _, _, values_of in families:
+                for value in values_of(source):
+                    if value != last[i]:
+                        last[i] = value
+                        parts[slots[i]] = _fmt(value)
+                        self._dirty = True
+                    i += 1
+
+    def update(self, values=None, system_parameters=None):
+        """ Feeds new get_values / get_system_parameters results; None leaves the previous ones """
+        with self._lock:
+            if values is not None:
+                self._sources["values"] = values
+            if system_parameters is not None:
+                self._sources["parameters"] = system_parameters
+            self._refresh()
+            if self._dirty:
+                self._rendered = "".join(self._parts).encode()
+                self._dirty = False
+
+    def update_from(self, scheduler):
+        """ Takes the latest cached results of a `scheduler.PollScheduler` """
+        self.update(scheduler.get("values"), scheduler.get("system_parameters"))
+
+    def render(self) -> bytes:
+        return self._rendered
+
+
+def serve(exporter: MetricsExporter, port: int = 9190, address: str = "") -> ThreadingHTTPServer:
+    """ Serves the exposition buffer on http://address:port/metrics from a background thread """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = exporter.render()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), Handler)
+    threading.Thread(target=server.serve_forever, name="pylontech-exporter", daemon=True).start()
+    return server
@@ -0,0 +1,296 @@
+""" Hand-written decoders for the 0x42 analog value replies.
+
+These walk the info payload once with precompiled `struct` formats instead of
+going through `construct`, and return `__slots__` records that expose the same
+attribute names as the `Container` objects built by `Pylontech.get_values_fmt`
+and `Pylontech.get_values_single_fmt`.
+"""
+import struct
+from functools import lru_cache
+from typing import List
+
+
+_I16 = struct.Struct(">h")
+# Current, Voltage, _RemainingCapacity1, _UserDefinedItems, _TotalCapacity1, CycleNumber
+_MODULE_TAIL = struct.Struct(">hHHBHH")
+
+
+@lru_cache(maxsize=None)
+def _int16_array(count: int) -> struct.Struct:
+    return struct.Struct(">%dh" % count)
+
+
+class _Record:
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return hasattr(self, key)
+
+    def __repr__(self):
+        fields = ", ".join("%s=%r" % (k, getattr(self, k)) for k in self._public_fields())
+        return "%s(%s)" % (type(self).__name__, fields)
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return all(getattr(self, k) == getattr(other, k) for k in self._public_fields())
+
+    @classmethod
+    def _public_fields(cls):
+        for klass in reversed(cls.__mro__):
+            for k in getattr(klass, "__slots__", ()):
+                if not k.startswith("_"):
+                    yield k
+
+
+class ModuleValues(_Record):
+    __slots__ = (
+        "NumberOfCells",
+        "CellVoltages",
+        "NumberOfTemperatures",
+        "AverageBMSTemperature",
+        "GroupedCellsTemperatures",
+        "Current",
+        "Voltage",
+        "Power",
+        "_RemainingCapacity1",
+        "_UserDefinedItems",
+        "_TotalCapacity1",
+        "CycleNumber",
+        "RemainingCapacity",
+        "TotalCapacity",
+    )
+
+
+class SingleModuleValues(ModuleValues):
+    __slots__ = ("NumberOfModule", "TotalPower", "StateOfCharge")
+
+
+class StackValues(_Record):
+    __slots__ = ("NumberOfModules", "Module", "TotalPower", "StateOfCharge")
+
+
+def _decode_module(buf, offset: int, m: ModuleValues) -> int:
+    """ Fills `m` from the module block starting at `offset`, returns the offset past it """
+    cells = buf[offset]
+    offset += 1
+    m.NumberOfCells = cells
+    m.CellVoltages = [v / 1000 for v in _int16_array(cells).unpack_from(buf, offset)]
+    offset += 2 * cells
+
+    temps = buf[offset]
+    offset += 1
+    m.NumberOfTemperatures = temps
+    m.AverageBMSTemperature = (_I16.unpack_from(buf, offset)[0] - 2731) / 10.0
+    offset += 2
+    m.GroupedCellsTemperatures = [(t - 2731) / 10.0 for t in _int16_array(temps - 1).unpack_from(buf, offset)]
+    offset += 2 * (temps - 1)
+
+    current, voltage, remaining1, user_defined, total1, cycles = _MODULE_TAIL.unpack_from(buf, offset)
+    offset += _MODULE_TAIL.size
+    m.Current = current / 10
+    m.Voltage = voltage / 1000
+    m.Power = m.Current * m.Voltage
+    m._RemainingCapacity1 = remaining1 / 1000
+    m._UserDefinedItems = user_defined
+    m._TotalCapacity1 = total1 / 1000
+    m.CycleNumber = cycles
+
+    if user_defined > 2:
+        m.RemainingCapacity = int.from_bytes(buf[offset:offset + 3], "big") / 1000
+        m.TotalCapacity = int.from_bytes(buf[offset + 3:offset + 6], "big") / 1000
+        offset += 6
+    else:
+        m.RemainingCapacity = m._RemainingCapacity1
+        m.TotalCapacity = m._TotalCapacity1
+
+    return offset
+
+
+def decode_values(info: bytes) -> StackValues:
+    """ Fast equivalent of `Pylontech.get_values_fmt.parse(info)` """
+    buf = memoryview(info)
+    count = buf[0]
+    offset = 1
+    modules = []  # type: List[ModuleValues]
+    for _ in range(count):
+        m = ModuleValues()
+        offset = _decode_module(buf, offset, m)
+        modules.append(m)
+
+    d = StackValues()
+    d.NumberOfModules = count
+    d.Module = modules
+    d.TotalPower = sum([x.Power for x in modules])
+    d.StateOfCharge = sum([x.RemainingCapacity for x in modules]) / sum([x.TotalCapacity for x in modules])
+    return d
+
+
+def decode_values_single(info: bytes) -> SingleModuleValues:
+    """ Fast equivalent of `Pylontech.get_values_single_fmt.parse(info)` """
+    buf = memoryview(info)
+    d = SingleModuleValues()
+    d.NumberOfModule = buf[0]
+    _decode_module(buf, 1, d)
+    d.TotalPower = d.Power
+    d.StateOfCharge = d.RemainingCapacity / d.TotalCapacity
+    return d
+
+
+def _scan_modules(buf, offset: int, count: int) -> List[int]:
+    """ Offsets of the (Current, Voltage, ...) tail of each module block, found from the cell and
+    temperature counts only """
+    tails = []
+    for _ in range(count):
+        offset += 1 + 2 * buf[offset]  # cells
+        offset += 1 + 2 * buf[offset]  # temperatures, BMS average included
+        tails.append(offset)
+        offset += _MODULE_TAIL.size
+        if buf[offset - 5] > 2:  # _UserDefinedItems, 24 bits capacities follow
+            offset += 6
+    return tails
+
+
+class LazyModuleValues(_Record):
+    """ A module of a get_values result, decoded from the payload when its fields are read """
+    __slots__ = ("_buf", "_offset", "_tail", "_cells", "_temps")
+
+    def __init__(self, buf, offset: int, tail: int):
+        self._buf = buf
+        self._offset = offset
+        self._tail = tail
+        self._cells = None
+        self._temps = None
+
+    @classmethod
+    def _public_fields(cls):
+        return ModuleValues._public_fields()
+
+    @property
+    def NumberOfCells(self) -> int:
+        return self._buf[self._offset]
+
+    @property
+    def CellVoltages(self) -> List[float]:
+        if self._cells is None:
+            self._cells = [v / 1000 for v in _int16_array(self.NumberOfCells).unpack_from(self._buf, self._offset + 1)]
+        return self._cells
+
+    @property
+    def _temperature_offset(self) -> int:
+        return self._offset + 1 + 2 * self.NumberOfCells
+
+    @property
+    def NumberOfTemperatures(self) -> int:
+        return self._buf[self._temperature_offset]
+
+    @property
+    def AverageBMSTemperature(self) -> float:
+        return (_I16.unpack_from(self._buf, self._temperature_offset + 1)[0] - 2731) / 10.0
+
+    @property
+    def GroupedCellsTemperatures(self) -> List[float]:
+        if self._temps is None:
+            offset = self._temperature_offset
+            temps = _int16_array(self._buf[offset] - 1).unpack_from(self._buf, offset + 3)
+            self._temps = [(t - 2731) / 10.0 for t in temps]
+        return self._temps
+
+    @property
+    def Current(self) -> float:
+        return _I16.unpack_from(self._buf, self._tail)[0] / 10
+
+    @property
+    def Voltage(self) -> float:
+        return int.from_bytes(self._buf[self._tail + 2:self._tail + 4], "big") / 1000
+
+    @property
+    def Power(self) -> float:
+        return self.Current * self.Voltage
+
+    @property
+    def _RemainingCapacity1(self) -> float:
+        return int.from_bytes(self._buf[self._tail + 4:self._tail + 6], "big") / 1000
+
+    @property
+    def _UserDefinedItems(self) -> int:
+        return self._buf[self._tail + 6]
+
+    @property
+    def _TotalCapacity1(self) -> float:
+        return int.from_bytes(self._buf[self._tail + 7:self._tail + 9], "big") / 1000
+
+    @property
+    def CycleNumber(self) -> int:
+        return int.from_bytes(self._buf[self._tail + 9:self._tail + 11], "big")
+
+    @property
+    def RemainingCapacity(self) -> float:
+        if self._UserDefinedItems > 2:
+            return int.from_bytes(self._buf[self._tail + 11:self._tail + 14], "big") / 1000
+        return self._RemainingCapacity1
+
+    @property
+    def TotalCapacity(self) -> float:
+        if self._UserDefinedItems > 2:
+            return int.from_bytes(self._buf[self._tail + 14:self._tail + 17], "big") / 1000
+        return self._TotalCapacity1
+
+
+class LazyStackValues(_Record):
+    """ A get_values result that only scans the module offsets up front. The aggregates are computed
+    from the current, voltage and capacity fields without decoding the cell arrays """
+    __slots__ = ("_buf", "_offsets", "_tails", "_modules")
+
+    def __init__(self, info: bytes):
+        buf = memoryview(info)
+        self._buf = buf
+        self._tails = _scan_modules(buf, 1, buf[0])
+        self._offsets = [1] + [self._module_end(t) for t in self._tails[:-1]]
+        self._modules = None
+
+    def _module_end(self, tail: int) -> int:
+        return tail + _MODULE_TAIL.size + (6 if self._buf[tail + 6] > 2 else 0)
+
+    @classmethod
+    def _public_fields(cls):
+        return StackValues._public_fields()
+
+    @property
+    def NumberOfModules(self) -> int:
+        return self._buf[0]
+
+    @property
+    def Module(self) -> List[LazyModuleValues]:
+        if self._modules is None:
+            self._modules = [LazyModuleValues(self._buf, o, t) for o, t in zip(self._offsets, self._tails)]
+        return self._modules
+
+    @property
+    def TotalPower(self) -> float:
+        power = 0
+        for tail in self._tails:
+            current, voltage = _MODULE_TAIL.unpack_from(self._buf, tail)[:2]
+            power += current / 10 * (voltage / 1000)
+        return power
+
+    @property
+    def StateOfCharge(self) -> float:
+        buf = self._buf
+        remaining = total = 0
+        for tail in self._tails:
+            remaining1, user_defined, total1 = _MODULE_TAIL.unpack_from(buf, tail)[2:5]
+            if user_defined > 2:
+                remaining1 = int.from_bytes(buf[tail + 11:tail + 14], "big")
+                total1 = int.from_bytes(buf[tail + 14:tail + 17], "big")
+            remaining += remaining1
+            total += total1
+        return remaining / total
+
+
+def decode_values_lazy(info: bytes) -> LazyStackValues:
+    """ Lazy equivalent of `Pylontech.get_values_fmt.parse(info)` """
+    return LazyStackValues(info)
@@ -0,0 +1,97 @@
+""" Parallel polling of several stacks, each behind its own RS485 master.
+
+Every stack is polled on its own worker thread, so a fleet refresh takes as
+long as the slowest bus instead of the sum of all of them. A bus that stops
+answering is reported as stale with its last known values and does not hold
+back the other ones; the fleet totals leave stale stacks out and list them
+in `StaleStacks`.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Optional
+
+from .pylontech import Pylontech
+
+logger = logging.getLogger(__name__)
+
+
+class StackSnapshot:
+    def __init__(self, name: str, values=None, timestamp: Optional[float] = None, latency: Optional[float] = None,
+                 error: Optional[BaseException] = None, stale: bool = False):
+        self.name = name
+        self.values = values
+        self.timestamp = timestamp
+        self.latency = latency
+        self.error = error
+        self.stale = stale
+
+    def __repr__(self):
+        return "StackSnapshot(%r, stale=%r, error=%r)" % (self.name, self.stale, self.error)
+
+
+class FleetSnapshot:
+    """ Per-stack get_values results plus fleet totals over the stacks that answered this refresh """
+    def __init__(self, stacks: Dict[str, StackSnapshot]):
+        self.stacks = stacks
+        self.StaleStacks = [s.name for s in stacks.values() if s.stale]
+
+        fresh = [s.values for s in stacks.values() if s.values is not None and not s.stale]
+        modules = [m for v in fresh for m in v.Module]
+        self.NumberOfModules = len(modules)
+        self.TotalPower = sum([v.TotalPower for v in fresh])
+        self.RemainingCapacity = sum([m.RemainingCapacity for m in modules])
+        self.TotalCapacity = sum([m.TotalCapacity for m in modules])
+        self.StateOfCharge = self.RemainingCapacity / self.TotalCapacity if self.TotalCapacity else None
+
+    def __getitem__(self, name: str) -> StackSnapshot:
+        return self.stacks[name]
+
+
+class FleetManager:
+    def __init__(self, stacks: Dict[str, Pylontech], max_workers: Optional[int] = None):
+        self.stacks = stacks
+        self._pool = ThreadPoolExecutor(max_workers or len(stacks) or 1, thread_name_prefix="pylontech-fleet")
+        self._inflight = {}  # name -> Future still running from an earlier refresh
+        self._last = {name: StackSnapshot(name) for name in stacks}
+
+    @classmethod
+    def open(cls, ports: Iterable[str], **kwargs) -> "FleetManager":
+        """ Opens a Pylontech on every port, stacks are named after their port """
+        return cls({port: Pylontech(port, **kwargs) for port in ports})
+
+    def _poll(self, name: str) -> StackSnapshot:
+        start = time.monotonic()
+        values = self.stacks[name].get_values()
+        end = time.monotonic()
+        return StackSnapshot(name, values, timestamp=end, latency=end - start)
+
+    def refresh(self, timeout: float = 5.0) -> FleetSnapshot:
+        """ Polls every stack in parallel, waiting at most `timeout` seconds for the slow ones """
+        for name in self.stacks:
+            if name not in self._inflight:
+                self._inflight[name] = self._pool.submit(self._poll, name)
+
+        wait(list(self._inflight.values()), timeout)
+
+        snapshots = {}
+        for name in self.stacks:
+            future = self._inflight[name]
+            last = self._last[name]
+            if not future.done():
+                logger.debug("Stack %s did not answer within %ss", name, timeout)
+                snapshots[name] = StackSnapshot(name, last.values, last.timestamp, last.latency,
+                                                TimeoutError("No answer within %ss" % timeout), stale=True)
+                continue
+
+            del self._inflight[name]
+            try:
+                snapshots[name] = self._last[name] = future.result()
+            except Exception as e:
+                logger.debug("Polling stack %s failed: %r", name, e)
+                snapshots[name] = StackSnapshot(name, last.values, last.timestamp, last.latency, e, stale=True)
+
+        return FleetSnapshot(snapshots)
+
+    def close(self):
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,113 @@
+""" Incremental framer for the `~ ... \\r` frames of the Pylontech RS485 protocol.
+
+Bytes read from the port are appended to a single reusable buffer; complete
+frames are cut out of it using the LENID field of their header. Anything that
+is not a well-formed frame (line noise, a truncated frame, a bad checksum) is
+dropped and the framer resynchronises on the next `~`.
+"""
+import logging
+from typing import Iterator, Optional
+
+from .codec import frame_checksum, info_length
+
+logger = logging.getLogger(__name__)
+
+SOI = 0x7e  # '~'
+EOI = 0x0d  # '\r'
+HEADER_LENGTH = 13  # SOI, VER, ADR, CID1, CID2, LENGTH
+TRAILER_LENGTH = 5  # CHKSUM, EOI
+
+
+class FrameReader:
+    def __init__(self):
+        self.buffer = bytearray()
+        self.dropped_bytes = 0
+        self.bad_frames = 0
+
+    def feed(self, data: bytes):
+        self.buffer += data
+
+    def clear(self):
+        self.dropped_bytes += len(self.buffer)
+        del self.buffer[:]
+
+    def wanted(self) -> int:
+        """ Number of bytes still missing to complete the frame at the head of the buffer """
+        start = self.buffer.find(SOI)
+        if start < 0:
+            return HEADER_LENGTH
+        available = len(self.buffer) - start
+        if available < HEADER_LENGTH:
+            return HEADER_LENGTH - available
+        length = self._frame_length(start)
+        if length is None:
+            return 1
+        return max(length - available, 1)
+
+    def _frame_length(self, start: int) -> Optional[int]:
+        try:
+            length = int(self.buffer[start + 9:start + HEADER_LENGTH], 16)
+        except ValueError:
+            return None
+        lenid = info_length(length)
+        if lenid is None:
+            return None
+        return HEADER_LENGTH + lenid + TRAILER_LENGTH
+
+    def _drop(self, count: int):
+        self.dropped_bytes += count
+        del self.buffer[:count]
+
+    def next_frame(self) -> Optional[bytes]:
+        """ Returns the next complete, checksum-valid raw frame, or None if more bytes are needed """
+        buf = self.buffer
+        while True:
+            start = buf.find(SOI)
+            if start < 0:
+                self._drop(len(buf))
+                return None
+            if start:
+                logger.debug("Dropping %d bytes of garbage before frame start", start)
+                self._drop(start)
+
+            if len(buf) < HEADER_LENGTH:
+                return None
+
+            length = self._frame_length(0)
+            if length is None:
+                logger.debug("Dropping frame with invalid header %r", bytes(buf[:HEADER_LENGTH]))
+                self._drop(1)
+                continue
+
+            if len(buf) < length:
+                # A new start byte in the middle means the current frame was cut short
+                restart = buf.find(SOI, 1)
+                if restart > 0:
+                    logger.debug("Dropping truncated frame")
+                    self._drop(restart)
+                    continue
+                return None
+
+            if buf[length - 1] != EOI:
+                logger.debug("Dropping frame without end byte")
+                self._drop(1)
+                continue
+
+            frame = bytes(buf[:length])
+            del buf[:length]
+            try:
+                valid = frame_checksum(memoryview(frame)[1:-TRAILER_LENGTH]) == int(frame[-TRAILER_LENGTH:-1], 16)
+            except ValueError:
+                valid = False
+            if not valid:
+                logger.debug("Dropping frame with bad checksum %r", frame)
+                self.bad_frames += 1
+                continue
+            return frame
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                return
+            yield frame
@@ -0,0 +1,236 @@
+""" Fixed-capacity history of get_values snapshots in preallocated numpy arrays.
+
+Requires numpy (`pip install python-pylontech[numpy]`).
+
+Every field of `Pylontech.get_values_fmt` gets a slot per module (and per cell
+or temperature sensor) in one preallocated 2D array, missing modules, cells
+and sensors being NaN. Each row is written twice, at `i` and `i + capacity`,
+so that the last N samples are always contiguous: `last()` returns views into
+the buffer, never copies.
+
+`append_info()` decodes the 0x42 info payload straight into the next row.
+The positions, signedness and scaling of all the 16 bits fields of a stack
+layout are computed once; after that a sample costs a few `np.take` and
+ufunc calls into preallocated scratch arrays, whatever the number of cells.
+"""
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+STACK_FIELDS = ("NumberOfModules", "TotalPower", "StateOfCharge")
+MODULE_FIELDS = ("NumberOfCells", "NumberOfTemperatures", "AverageBMSTemperature", "Current", "Voltage", "Power",
+                 "RemainingCapacity", "TotalCapacity", "CycleNumber")
+
+
+class _Plan:
+    """ Where each value of a payload of a given stack layout goes, and how to scale it """
+    def __init__(self, buffer: "SnapshotBuffer", info: bytes):
+        columns = buffer.columns
+        modules = info[0]
+        if modules > buffer.modules:
+            raise ValueError("%d modules do not fit a buffer sized for %d" % (modules, buffer.modules))
+
+        # (payload position, signed, subtract, divide, destination column) of every 16 bits field
+        words = []  # type: List[Tuple[int, bool, float, float, int]]
+        wide = []  # type: List[Tuple[int, int]] # 24 bits capacities
+        constants = {columns["NumberOfModules"]: modules}
+        filled = set()
+        offset = 1
+        for i in range(modules):
+            cells = info[offset]
+            if cells > buffer.cells:
+                raise ValueError("%d cells do not fit a buffer sized for %d" % (cells, buffer.cells))
+            constants[columns["NumberOfCells"] + i] = cells
+            first = columns["CellVoltages"] + i * buffer.cells
+            words.extend((offset + 1 + 2 * j, True, 0, 1000, first + j) for j in range(cells))
+            filled.update(range(first, first + cells))
+            offset += 1 + 2 * cells
+
+            temps = info[offset]
+            if temps - 1 > buffer.temperatures:
+                raise ValueError("%d temperatures do not fit a buffer sized for %d" % (temps - 1, buffer.temperatures))
+            constants[columns["NumberOfTemperatures"] + i] = temps
+            words.append((offset + 1, True, 2731, 10, columns["AverageBMSTemperature"] + i))
+            first = columns["GroupedCellsTemperatures"] + i * buffer.temperatures
+            words.extend((offset + 3 + 2 * j, True, 2731, 10, first + j) for j in range(temps - 1))
+            filled.update(range(first, first + temps - 1))
+            offset += 1 + 2 * temps
+
+            extended = info[offset + 6] > 2
+            words.append((offset, True, 0, 10, columns["Current"] + i))
+            words.append((offset + 2, False, 0, 1000, columns["Voltage"] + i))
+            words.append((offset + 9, False, 0, 1, columns["CycleNumber"] + i))
+            if extended:
+                wide.append((offset + 11, columns["RemainingCapacity"] + i))
+                wide.append((offset + 14, columns["TotalCapacity"] + i))
+            else:
+                words.append((offset + 4, False, 0, 1000, columns["RemainingCapacity"] + i))
+                words.append((offset + 7, False, 0, 1000, columns["TotalCapacity"] + i))
+            offset += 11 + (6 if extended else 0)
+            filled.update(columns[f] + i for f in MODULE_FIELDS)
+        if offset != len(info):
+            raise ValueError("Payload of %d bytes, expected %d from its module headers" % (len(info), offset))
+
+        self.modules = modules
+        self.length = len(info)
+        # The cell and temperature counts identify the layout
+        self.count_positions = np.array(sorted(p for p in self._count_positions(info)), dtype=np.intp)
+        self.counts = np.frombuffer(info, dtype=np.uint8)[self.count_positions].copy()
+
+        # Group the words by parity and signedness, so each group is read from one big endian view
+        groups = []
+        for parity in (0, 1):
+            for signed in (False, True):
+                group = [w for w in words if w[0] % 2 == parity and w[1] == signed]
+                if group:
+                    dtype = ">i2" if signed else ">u2"
+                    index = np.array([(w[0] - parity) // 2 for w in group], dtype=np.intp)
+                    groups.append((parity, dtype, index, np.empty(len(group), dtype=dtype)))
+        ordered = [w for parity in (0, 1) for signed in (False, True) for w in words
+                   if w[0] % 2 == parity and w[1] == signed]
+        self.groups = groups
+        self.subtract = np.array([w[2] for w in ordered], dtype=float)
+        self.divide = np.array([w[3] for w in ordered], dtype=float)
+        self.destination = np.array([w[4] for w in ordered] + [w[1] for w in wide], dtype=np.intp)
+        self.scratch = np.empty(len(ordered) + len(wide))
+
+        self.wide_positions = [np.array([p + k for p, _ in wide], dtype=np.intp) for k in range(3)]
+        self.wide_bytes = np.empty(len(wide), dtype=np.uint8)
+
+        self.constant_columns = np.array(list(constants), dtype=np.intp)
+        self.constant_values = np.array(list(constants.values()), dtype=float)
+        unused = sorted(set(range(buffer.width)) - filled - set(constants) -
+                        {columns["TotalPower"], columns["StateOfCharge"]})
+        self.nan_columns = np.array(unused, dtype=np.intp)
+
+    @staticmethod
+    def _count_positions(info: bytes):
+        offset = 1
+        for _ in range(info[0]):
+            yield offset
+            offset += 1 + 2 * info[offset]
+            yield offset
+            offset += 1 + 2 * info[offset]
+            yield offset + 6
+            offset += 11 + (6 if info[offset + 6] > 2 else 0)
+
+    def matches(self, raw: np.ndarray) -> bool:
+        return len(raw) == self.length and np.array_equal(raw[self.count_positions], self.counts)
+
+    def decode(self, info: bytes, raw: np.ndarray, row: np.ndarray):
+        scratch = self.scratch
+        views = {}
+        start = 0
+        for parity, dtype, index, out in self.groups:
+            view = views.get((parity, dtype))
+            if view is None:
+                view = views[(parity, dtype)] = np.frombuffer(info, dtype=dtype, offset=parity,
+                                                              count=(len(info) - parity) // 2)
+            np.take(view, index, out=out)
+            scratch[start:start + len(out)] = out
+            start += len(out)
+
+        if len(self.wide_bytes):
+            wide = scratch[start:]
+            wide.fill(0)
+            for positions in self.wide_positions:  # most significant byte first
+                np.take(raw, positions, out=self.wide_bytes)
+                np.multiply(wide, 256, out=wide)
+                np.add(wide, self.wide_bytes, out=wide)
+            np.divide(wide, 1000, out=wide)
+
+        words = scratch[:start]
+        np.subtract(words, self.subtract, out=words)
+        np.divide(words, self.divide, out=words)
+        row.put(self.destination, scratch)
+        row.put(self.constant_columns, self.constant_values)
+        row.put(self.nan_columns, np.nan)
+
+
+class SnapshotBuffer:
+    def __init__(self, capacity: int = 3600, modules: int = 16, cells: int = 16, temperatures: int = 4,
+                 dtype=np.float64):
+        self.capacity = capacity
+        self.modules = modules
+        self.cells = cells
+        self.temperatures = temperatures  # grouped cell temperatures per module, the BMS average excluded
+
+        self.columns = {}  # type: Dict[str, int]
+        self.shapes = {}  # type: Dict[str, tuple]
+        width = 0
+        for name in STACK_FIELDS:
+            self.columns[name], self.shapes[name] = width, ()
+            width += 1
+        for name in MODULE_FIELDS:
+            self.columns[name], self.shapes[name] = width, (modules,)
+            width += modules
+        for name, size in (("CellVoltages", cells), ("GroupedCellsTemperatures", temperatures)):
+            self.columns[name], self.shapes[name] = width, (modules, size)
+            width += modules * size
+        self.width = width
+
+        self.data = np.full((2 * capacity, width), np.nan, dtype=dtype)
+        self.timestamps = np.full(2 * capacity, np.nan)
+        self.count = 0  # samples appended so far
+        self._next = 0
+        self._plans = {}  # type: Dict[int, _Plan]
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def _commit(self, timestamp: float):
+        i = self._next
+        row = self.data[i]
+        c = self.columns
+        m = int(row[c["NumberOfModules"]])
+        power = row[c["Power"]:c["Power"] + self.modules]
+        np.multiply(row[c["Current"]:c["Current"] + m], row[c["Voltage"]:c["Voltage"] + m], out=power[:m])
+        row[c["TotalPower"]] = power[:m].sum()
+        remaining = row[c["RemainingCapacity"]:c["RemainingCapacity"] + m].sum()
+        row[c["StateOfCharge"]] = remaining / row[c["TotalCapacity"]:c["TotalCapacity"] + m].sum()
+
+        self.data[i + self.capacity] = row
+        self.timestamps[i] = self.timestamps[i + self.capacity] = timestamp
+        self._next = (i + 1) % self.capacity
+        self.count += 1
+
+    def append_info(self, info: bytes, timestamp: float):
+        """ Appends a 0x42 reply payload, as given to `Pylontech.get_values_fmt.parse` """
+        raw = np.frombuffer(info, dtype=np.uint8)
+        plan = self._plans.get(len(info))
+        if plan is None or not plan.matches(raw):
+            plan = self._plans[len(info)] = _Plan(self, info)
+        plan.decode(info, raw, self.data[self._next])
+        self._commit(timestamp)
+
+    def append(self, values, timestamp: float):
+        """ Appends a decoded get_values result (construct Container or fastdecode record) """
+        row = self.data[self._next]
+        row.fill(np.nan)
+        c = self.columns
+        row[c["NumberOfModules"]] = len(values.Module)
+        for i, m in enumerate(values.Module):
+            for name in MODULE_FIELDS:
+                row[c[name] + i] = m[name]
+            first = c["CellVoltages"] + i * self.cells
+            row[first:first + len(m.CellVoltages)] = m.CellVoltages
+            first = c["GroupedCellsTemperatures"] + i * self.temperatures
+            row[first:first + len(m.GroupedCellsTemperatures)] = m.GroupedCellsTemperatures
+        self._commit(timestamp)
+
+    def last(self, n: Optional[int] = None, name: Optional[str] = None) -> np.ndarray:
+        """ View of the last `n` (default: all stored) samples of field `name`, oldest first.
+
+        Without `name`, returns the timestamps. The view is only valid until the
+        buffer wraps around onto it: copy it to keep it longer.
+        """
+        stored = len(self)
+        n = stored if n is None else min(n, stored)
+        end = self._next + self.capacity if self.count >= self.capacity else self._next
+        if name is None:
+            return self.timestamps[end - n:end]
+        column = self.columns[name]
+        shape = self.shapes[name]
+        size = int(np.prod(shape)) if shape else 1
+        block = self.data[end - n:end, column:column + size]
+        return block.reshape((n,) + shape) if shape else block[:, 0]
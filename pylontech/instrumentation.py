@@ -0,0 +1,92 @@
+""" Instrumentation hooks for the bus transactions of `Pylontech`.
+
+Register any object with an `on_command(stats)` method with
+`Pylontech.add_hook()`; it is called after every request/reply round trip
+with a `CommandStats`, serial number probes included. Without hooks the
+transactions are not timed at all.
+`BusMetrics` is a ready-made hook keeping counters and latency histograms.
+"""
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, Sequence
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0)
+
+
+class CommandStats:
+    __slots__ = ("address", "cid2", "tx_bytes", "rx_bytes", "encode_time", "wire_time", "decode_time",
+                 "timeout", "checksum_errors", "dropped_bytes")
+
+    def __init__(self, address: int, cid2: int):
+        self.address = address
+        self.cid2 = cid2
+        self.tx_bytes = 0
+        self.rx_bytes = 0
+        self.encode_time = 0.0
+        self.wire_time = 0.0  # from the start of the write until the complete reply frame is read
+        self.decode_time = 0.0  # frame checks and payload parsing, e.g. the construct Struct
+        self.timeout = False
+        self.checksum_errors = 0
+        self.dropped_bytes = 0
+
+    @property
+    def latency(self) -> float:
+        return self.encode_time + self.wire_time + self.decode_time
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """ Upper bound of the bucket holding the q-quantile """
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            seen += n
+            if seen >= rank and n:
+                return bound
+        return 0.0
+
+
+class BusMetrics:
+    """ Latency histograms per CID2 and per address, byte, timeout and checksum error counters """
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.latency_by_command = defaultdict(lambda: Histogram(self.buckets))  # type: Dict[int, Histogram]
+        self.latency_by_address = defaultdict(lambda: Histogram(self.buckets))  # type: Dict[int, Histogram]
+        self.commands = 0
+        self.tx_bytes = 0
+        self.rx_bytes = 0
+        self.timeouts = 0
+        self.checksum_errors = 0
+        self.dropped_bytes = 0
+        self.encode_time = 0.0
+        self.wire_time = 0.0
+        self.decode_time = 0.0  # frame checks and payload parsing, e.g. the construct Struct
+
+    def on_command(self, stats: CommandStats):
+        with self._lock:
+            self.commands += 1
+            self.tx_bytes += stats.tx_bytes
+            self.rx_bytes += stats.rx_bytes
+            self.checksum_errors += stats.checksum_errors
+            self.dropped_bytes += stats.dropped_bytes
+            self.encode_time += stats.encode_time
+            self.wire_time += stats.wire_time
+            self.decode_time += stats.decode_time
+            if stats.timeout:
+                self.timeouts += 1
+                return
+            self.latency_by_command[stats.cid2].observe(stats.latency)
+            self.latency_by_address[stats.address].observe(stats.latency)
@@ -0,0 +1,226 @@
+""" Vectorised checking of get_values snapshots against the get_system_parameters limits.
+
+Requires numpy (`pip install python-pylontech[numpy]`).
+
+Every check of every cell, temperature sensor and module is one element of a
+flat array built once per stack layout: which measured value it reads, its
+threshold, whether going above or below is bad, its hysteresis and whether
+it only applies while charging or discharging. A snapshot is then checked
+with a handful of numpy operations whatever the number of cells, and only the
+transitions are turned into `AlarmEvent`s: an alarm is raised when a value
+crosses its limit and cleared once it is back by more than the hysteresis.
+The temperature limits are checked against every sensor and against the
+AverageBMSTemperature of each module.
+
+When the stack layout changes (a module or sensor appears or disappears), the
+checks are rebuilt and the alarms still raised are dropped with a warning.
+"""
+import logging
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+CELL_VOLTAGE = "cell_voltage"
+TEMPERATURE = "temperature"
+BMS_TEMPERATURE = "bms_temperature"
+MODULE_VOLTAGE = "module_voltage"
+CURRENT = "current"
+
+HIGH = 1
+LOW = -1
+
+ALWAYS = 0
+CHARGING = 1
+DISCHARGING = 2
+
+# limit name, quantity checked, bad direction, when it applies
+CHECKS = (
+    ("CellHighVoltageLimit", CELL_VOLTAGE, HIGH, ALWAYS),
+    ("CellLowVoltageLimit", CELL_VOLTAGE, LOW, ALWAYS),
+    ("CellUnderVoltageLimit", CELL_VOLTAGE, LOW, ALWAYS),
+    ("ChargeHighTemperatureLimit", TEMPERATURE, HIGH, CHARGING),
+    ("ChargeLowTemperatureLimit", TEMPERATURE, LOW, CHARGING),
+    ("DischargeHighTemperatureLimit", TEMPERATURE, HIGH, DISCHARGING),
+    ("DischargeLowTemperatureLimit", TEMPERATURE, LOW, DISCHARGING),
+    ("ModuleHighVoltageLimit", MODULE_VOLTAGE, HIGH, ALWAYS),
+    ("ModuleLowVoltageLimit", MODULE_VOLTAGE, LOW, ALWAYS),
+    ("ModuleUnderVoltageLimit", MODULE_VOLTAGE, LOW, ALWAYS),
+    ("ChargeCurrentLimit", CURRENT, HIGH, ALWAYS),
+    ("DischargeCurrentLimit", CURRENT, LOW, ALWAYS),
+    ("ChargeHighTemperatureLimit", BMS_TEMPERATURE, HIGH, CHARGING),
+    ("ChargeLowTemperatureLimit", BMS_TEMPERATURE, LOW, CHARGING),
+    ("DischargeHighTemperatureLimit", BMS_TEMPERATURE, HIGH, DISCHARGING),
+    ("DischargeLowTemperatureLimit", BMS_TEMPERATURE, LOW, DISCHARGING),
+)
+
+DEFAULT_HYSTERESIS = {
+    CELL_VOLTAGE: 0.05,  # V
+    TEMPERATURE: 2.0,  # °C
+    BMS_TEMPERATURE: 2.0,  # °C
+    MODULE_VOLTAGE: 0.5,  # V
+    CURRENT: 1.0,  # A
+}
+
+logger = logging.getLogger(__name__)
+
+
+class AlarmEvent:
+    __slots__ = ("limit", "module", "index", "value", "threshold", "raised", "timestamp")
+
+    def __init__(self, limit: str, module: int, index: Optional[int], value: float, threshold: float, raised: bool,
+                 timestamp: float):
+        self.limit = limit  # name of the system parameter, e.g. "CellHighVoltageLimit"
+        self.module = module  # index in get_values().Module
+        self.index = index  # cell or temperature index, None for module level checks
+        self.value = value
+        self.threshold = threshold
+        self.raised = raised  # False when the alarm clears
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        where = "module %d" % self.module if self.index is None else "module %d #%d" % (self.module, self.index)
+        return "AlarmEvent(%s %s %s: %r vs %r)" % (self.limit, "raised" if self.raised else "cleared", where,
+                                                    self.value, self.threshold)
+
+
+class _Layout:
+    """ The flat check arrays of one stack shape """
+    def __init__(self, shape: tuple):
+        self.shape = shape
+        modules = len(shape)
+        cells = sum(c for c, _ in shape)
+        temps = sum(t for _, t in shape)
+        # Measured values are gathered as [cells..., temperatures..., BMS temperatures..., module voltages..., currents...]
+        base = {CELL_VOLTAGE: 0, TEMPERATURE: cells, BMS_TEMPERATURE: cells + temps,
+                MODULE_VOLTAGE: cells + temps + modules, CURRENT: cells + temps + 2 * modules}
+        self.size = cells + temps + 3 * modules
+
+        cell_module = np.repeat(np.arange(modules), [c for c, _ in shape])
+        temp_module = np.repeat(np.arange(modules), [t for _, t in shape])
+        cell_index = np.concatenate([np.arange(c) for c, _ in shape]) if cells else np.zeros(0, int)
+        temp_index = np.concatenate([np.arange(t) for _, t in shape]) if temps else np.zeros(0, int)
+        per_quantity = {
+            CELL_VOLTAGE: (cell_module, cell_index),
+            TEMPERATURE: (temp_module, temp_index),
+            BMS_TEMPERATURE: (np.arange(modules), np.full(modules, -1)),
+            MODULE_VOLTAGE: (np.arange(modules), np.full(modules, -1)),
+            CURRENT: (np.arange(modules), np.full(modules, -1)),
+        }
+
+        source, check, module, index = [], [], [], []
+        for i, (_, quantity, _, _) in enumerate(CHECKS):
+            m, idx = per_quantity[quantity]
+            source.append(base[quantity] + np.arange(len(m)))
+            check.append(np.full(len(m), i))
+            module.append(m)
+            index.append(idx)
+        self.source = np.concatenate(source)
+        self.check = np.concatenate(check)
+        self.module = np.concatenate(module)
+        self.index = np.concatenate(index)
+        self.direction = np.array([c[2] for c in CHECKS], dtype=float)[self.check]
+        gate = np.array([c[3] for c in CHECKS])[self.check]
+        self.charging_only = gate == CHARGING
+        self.discharging_only = gate == DISCHARGING
+        self.current_source = base[CURRENT]
+
+
+class LimitChecker:
+    def __init__(self, parameters=None, hysteresis: Optional[Dict[str, float]] = None):
+        self.hysteresis = dict(DEFAULT_HYSTERESIS, **(hysteresis or {}))
+        self.parameters = None  # type: Optional[tuple]
+        self._limits = np.full(len(CHECKS), np.nan)
+        self._layout = None  # type: Optional[_Layout]
+        self._threshold = self._clear = None
+        self.active = np.zeros(0, dtype=bool)
+        if parameters is not None:
+            self.set_parameters(parameters)
+
+    def set_parameters(self, parameters) -> bool:
+        """ Loads the limits of a get_system_parameters result, returns False if they did not change """
+        values = tuple(float(parameters[name]) for name, _, _, _ in CHECKS)
+        if values == self.parameters:
+            return False
+        self.parameters = values
+        self._limits = np.array(values)
+        if self._layout is not None:
+            self._build_thresholds()
+        return True
+
+    def _build_thresholds(self):
+        layout = self._layout
+        hysteresis = np.array([self.hysteresis[c[1]] for c in CHECKS])[layout.check]
+        self._threshold = self._limits[layout.check]
+        # A value is back to normal once it is `hysteresis` on the good side of the limit
+        self._clear = -hysteresis
+
+    def _set_layout(self, shape: tuple):
+        if self._layout is not None:
+            dropped = self.active_alarms()
+            logger.warning("Stack layout changed from %r to %r, %d active alarms dropped: %r",
+                           self._layout.shape, shape, len(dropped), dropped)
+        self._layout = _Layout(shape)
+        self._build_thresholds()
+        self.active = np.zeros(len(self._layout.source), dtype=bool)
+
+    @staticmethod
+    def _gather(values):
+        """ The measured values in layout order, and the stack shape, in one pass over the modules """
+        cells, temps, bms_temps, voltages, currents, shape = [], [], [], [], [], []
+        for m in values.Module:
+            c, t = m.CellVoltages, m.GroupedCellsTemperatures
+            cells.extend(c)
+            temps.extend(t)
+            bms_temps.append(m.AverageBMSTemperature)
+            voltages.append(m.Voltage)
+            currents.append(m.Current)
+            shape.append((len(c), len(t)))
+        cells.extend(temps)
+        cells.extend(bms_temps)
+        cells.extend(voltages)
+        cells.extend(currents)
+        return cells, tuple(shape)
+
+    def check(self, values, parameters=None, timestamp: Optional[float] = None) -> List[AlarmEvent]:
+        """ Checks a get_values result and returns the alarms raised and cleared since the previous one """
+        if parameters is not None:
+            self.set_parameters(parameters)
+        if self.parameters is None:
+            raise ValueError("No system parameters loaded")
+
+        measured, shape = self._gather(values)
+        if self._layout is None or shape != self._layout.shape:
+            self._set_layout(shape)
+        layout = self._layout
+
+        measured = np.array(measured)
+        currents = measured[layout.current_source:]
+        x = measured[layout.source]
+        excess = layout.direction * (x - self._threshold)  # > 0 beyond the limit
+
+        applies = ~((layout.charging_only & ~(currents > 0)[layout.module]) |
+                    (layout.discharging_only & ~(currents < 0)[layout.module]))
+        violated = (excess > 0) & applies
+        cleared = (excess < self._clear) | ~applies
+
+        raised = violated & ~self.active
+        dropped = cleared & self.active
+        self.active = (self.active | raised) & ~dropped
+
+        changed = np.flatnonzero(raised | dropped)
+        if not len(changed):
+            return []
+        if timestamp is None:
+            timestamp = time.time()
+        return [AlarmEvent(CHECKS[layout.check[i]][0], int(layout.module[i]),
+                           None if layout.index[i] < 0 else int(layout.index[i]), float(x[i]),
+                           float(self._threshold[i]), bool(raised[i]), timestamp) for i in changed]
+
+    def active_alarms(self) -> List[tuple]:
+        """ (limit name, module, index) of the alarms currently raised """
+        if self._layout is None:
+            return []
+        layout = self._layout
+        return [(CHECKS[layout.check[i]][0], int(layout.module[i]), None if layout.index[i] < 0 else int(layout.index[i]))
+                for i in np.flatnonzero(self.active)]
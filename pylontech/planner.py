@@ -0,0 +1,174 @@
+""" Chooses, per poll cycle, between one broadcast 0x42 FF and per-module 0x42 queries.
+
+The broadcast returns the whole stack in one large frame, which is the
+cheapest way to read every module but wastes bus time when only a few are
+wanted, and fails as a whole when a single module garbles its part. The
+planner keeps a moving average of the measured cost and error rate of both
+kinds of requests and picks, for the wanted modules, the one with the lowest
+expected time (a broadcast that fails costs the broadcast plus the fallback
+to per-module queries, a module query that fails costs the time lost waiting
+for its reply). Until a request has been measured, its cost is
+modelled from the frame lengths at the current baudrate.
+
+Whatever the strategy, `poll()` returns the same structure as `get_values()`,
+restricted to the wanted modules, with `TotalPower` and `StateOfCharge`
+computed over them.
+"""
+import logging
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from .fastdecode import StackValues
+
+logger = logging.getLogger(__name__)
+
+BROADCAST = "broadcast"
+SINGLE = "single"
+
+MODULE_INFO_LENGTH = 53  # 15 cells, 5 temperatures, 16 bits capacities
+
+
+class PlannedValues(StackValues):
+    """ get_values() like result; `Addresses` gives the address of each entry of `Module` """
+    __slots__ = ("Addresses", "Missing", "Strategy")
+
+
+class _Estimate:
+    __slots__ = ("cost", "failure_cost", "error_rate", "samples")
+
+    def __init__(self):
+        self.cost = None  # seconds, None until measured
+        self.failure_cost = 0.0  # seconds lost by a failed request
+        self.error_rate = 0.0
+        self.samples = 0
+
+
+class PollPlanner:
+    def __init__(self, p, modules: Optional[int] = None, first_address: int = 2, request_overhead: float = 0.02,
+                 alpha: float = 0.2, explore_interval: int = 50, clock: Callable[[], float] = time.monotonic):
+        self.p = p
+        self.clock = clock
+        self.modules = modules  # modules in the stack, learned from the first broadcast when None
+        self.first_address = first_address
+        self.request_overhead = request_overhead  # BMS processing time assumed before any measurement
+        self.alpha = alpha
+        self.explore_interval = explore_interval
+        self.broadcast = _Estimate()
+        self.single = {}  # type: Dict[int, _Estimate]
+        self._module_info = {}  # type: Dict[int, int]
+        self._cycles = 0
+
+    def _update(self, e: _Estimate, elapsed: float, failed: bool):
+        e.samples += 1
+        e.error_rate += self.alpha * ((1.0 if failed else 0.0) - e.error_rate)
+        if failed:  # a timeout says nothing about the cost of an answer
+            e.failure_cost = elapsed if not e.failure_cost else e.failure_cost + self.alpha * (elapsed - e.failure_cost)
+        else:
+            e.cost = elapsed if e.cost is None else e.cost + self.alpha * (elapsed - e.cost)
+
+    def _modelled_cost(self, info_length: int) -> float:
+        return self.request_overhead + self.p.expected_frame_time(1) + self.p.expected_frame_time(info_length)
+
+    def single_cost(self, address: int) -> float:
+        """ Expected time of a get_values_single of `address`, the time lost to its failures included """
+        e = self.single.get(address)
+        if e is not None and e.cost is not None:
+            cost = e.cost
+        else:
+            cost = self._modelled_cost(2 + self._module_info.get(address, MODULE_INFO_LENGTH))
+        if e is not None:
+            cost += e.error_rate * e.failure_cost
+        return cost
+
+    def broadcast_cost(self) -> float:
+        if self.broadcast.cost is not None:
+            return self.broadcast.cost
+        addresses = range(self.first_address, self.first_address + (self.modules or 0))
+        return self._modelled_cost(2 + sum(self._module_info.get(a, MODULE_INFO_LENGTH) for a in addresses))
+
+    def plan(self, wanted: List[int]) -> str:
+        """ The strategy the next poll of `wanted` will use """
+        if self.modules is None:
+            return BROADCAST
+        singles = sum(self.single_cost(a) for a in wanted)
+        b = self.broadcast
+        broadcast = self.broadcast_cost() + b.error_rate * (b.failure_cost + singles)
+        choice = BROADCAST if broadcast <= singles else SINGLE
+        if self.explore_interval and self._cycles % self.explore_interval == self.explore_interval - 1:
+            choice = SINGLE if choice == BROADCAST else BROADCAST  # keep the other estimate up to date
+        return choice
+
+    def poll(self, wanted: Optional[Iterable[int]] = None) -> PlannedValues:
+        """ Reads the modules at the `wanted` addresses, all of them by default """
+        if wanted is None:
+            wanted = range(self.first_address, self.first_address + self.modules) if self.modules else []
+        wanted = sorted(wanted)
+        strategy = self.plan(wanted)
+        self._cycles += 1
+
+        modules = None
+        if strategy == BROADCAST:
+            modules = self._poll_broadcast()
+            if self.modules is not None and not wanted:
+                wanted = list(range(self.first_address, self.first_address + self.modules))
+        if modules is None:
+            strategy = SINGLE
+            modules = self._poll_single(wanted)
+
+        found = [a for a in wanted if a in modules]
+        if not found:
+            raise ValueError("None of the modules %s answered" % wanted)
+        return self._combine(found, [modules[a] for a in found], [a for a in wanted if a not in modules], strategy)
+
+    def _poll_broadcast(self) -> Optional[Dict[int, object]]:
+        start = self.clock()
+        try:
+            values = self.p.get_values()
+        except ValueError as e:
+            logger.debug("Broadcast get_values failed: %s", e)
+            self._update(self.broadcast, self.clock() - start, True)
+            return None
+        self._update(self.broadcast, self.clock() - start, False)
+
+        self.modules = values.NumberOfModules
+        modules = {}
+        for i, m in enumerate(values.Module):
+            address = self.first_address + i
+            modules[address] = m
+            self._module_info[address] = _info_length(m)
+        return modules
+
+    def _poll_single(self, wanted: List[int]) -> Dict[int, object]:
+        modules = {}
+        for address in wanted:
+            e = self.single.get(address)
+            if e is None:
+                e = self.single[address] = _Estimate()
+            start = self.clock()
+            try:
+                m = self.p.get_values_single(address)
+            except ValueError as error:
+                logger.debug("get_values_single(%d) failed: %s", address, error)
+                self._update(e, self.clock() - start, True)
+                continue
+            self._update(e, self.clock() - start, False)
+            modules[address] = m
+            self._module_info[address] = _info_length(m)
+        return modules
+
+    @staticmethod
+    def _combine(addresses: List[int], modules: list, missing: List[int], strategy: str) -> PlannedValues:
+        d = PlannedValues()
+        d.NumberOfModules = len(modules)
+        d.Module = modules
+        d.Addresses = addresses
+        d.Missing = missing
+        d.Strategy = strategy
+        d.TotalPower = sum([m.Power for m in modules])
+        d.StateOfCharge = sum([m.RemainingCapacity for m in modules]) / sum([m.TotalCapacity for m in modules])
+        return d
+
+
+def _info_length(m) -> int:
+    """ Bytes taken by a module block in a 0x42 reply """
+    return 2 * m.NumberOfCells + 2 * m.NumberOfTemperatures + 13 + (6 if m._UserDefinedItems > 2 else 0)
@@ -1,19 +1,30 @@
 from typing import Dict
+import json
 import logging
+import os
+import time
 import serial
 import construct
 
-logger = logging.getLogger(__name__)
+from .fastdecode import decode_values, decode_values_lazy, decode_values_single
+from . import codec
+from .framing import FrameReader
+from .exceptions import ChecksumError, ReplyTimeout
+from .instrumentation import CommandStats
+from .timing import frame_time
 
-class HexToByte(construct.Adapter):
-    def _decode(self, obj, context, path) -> bytes:
-        hexstr = ''.join([chr(x) for x in obj])
-        return bytes.fromhex(hexstr)
+logger = logging.getLogger(__name__)
 
+PROBE_MARGIN = 0.1  # seconds a BMS may take before it starts answering
+# The serial timeout is only reprogrammed (a termios call on a real port) when it is longer than the time left,
+# or shorter by more than this factor
+TIMEOUT_TOLERANCE = 1.25
+# Offset of the module address in the reply info, for the commands whose request info is that address
+REPLY_ADDRESS_OFFSET = {0x42: 1, 0x92: 0, 0x93: 0}
 
 class JoinBytes(construct.Adapter):
     def _decode(self, obj, context, path) -> bytes:
-        return ''.join([chr(x) for x in obj]).encode()
+        return bytes(obj)
 
 
 class DivideBy1000(construct.Adapter):
@@ -43,11 +54,15 @@ class ToCelsius(construct.Adapter):
 
 
 
-class Pylontech:
+class ReplyParser:
+    """ Formats and parsers of the replies, shared by `Pylontech` and `aio.AsyncPylontech` """
+    fast_decode = False
+    lazy_decode = False
+
     manufacturer_info_fmt = construct.Struct(
-        "DeviceName" / JoinBytes(construct.Array(10, construct.Byte)),
+        "DeviceName" / JoinBytes(construct.Bytes(10)),
         "SoftwareVersion" / construct.Array(2, construct.Byte),
-        "ManufacturerName" / JoinBytes(construct.GreedyRange(construct.Byte)),
+        "ManufacturerName" / JoinBytes(construct.GreedyBytes),
     )
 
     system_parameters_fmt = construct.Struct(
@@ -89,7 +104,7 @@ class Pylontech:
 
     module_serial_number_fmt = construct.Struct(
         "CommandValue" / construct.Byte,
-        "ModuleSerialNumber" / JoinBytes(construct.Array(16, construct.Byte)),
+        "ModuleSerialNumber" / JoinBytes(construct.Bytes(16)),
     )
 
     get_values_fmt = construct.Struct(
@@ -140,95 +155,300 @@ class Pylontech:
         "StateOfCharge" / construct.Computed(construct.this.RemainingCapacity / construct.this.TotalCapacity),
     )
 
-    def __init__(self, serial_port='/dev/ttyUSB0', baudrate=115200):
-        self.s = serial.Serial(serial_port, baudrate, bytesize=8, parity=serial.PARITY_NONE, stopbits=1, timeout=2, exclusive=True)
+    def _parse_manufacturer_info(self, f):
+        return self.manufacturer_info_fmt.parse(f.info)
+
+    def _parse_system_parameters(self, f):
+        return self.system_parameters_fmt.parse(f.info[1:])
+
+    def _parse_management_info(self, f):
+        logger.debug("Management info: %r", f.info)
+        return self.management_info_fmt.parse(f.info[1:])
+
+    def _parse_module_serial_number(self, f):
+        # infoflag = f.info[0]
+        return self.module_serial_number_fmt.parse(f.info[0:])
+
+    def _parse_serial_number(self, f) -> str:
+        return self._parse_module_serial_number(f)["ModuleSerialNumber"].decode()
+
+    def _parse_values(self, f):
+        # infoflag = f.info[0]
+        if self.lazy_decode:
+            return decode_values_lazy(f.info[1:])
+        if self.fast_decode:
+            return decode_values(f.info[1:])
+        return self.get_values_fmt.parse(f.info[1:])
+
+    def _parse_values_single(self, f):
+        # infoflag = f.info[0]
+        if self.fast_decode:
+            return decode_values_single(f.info[1:])
+        return self.get_values_single_fmt.parse(f.info[1:])
+
+
+class Pylontech(ReplyParser):
+    hooks = ()
+    timeouts = None
+    retries = 0
+    retry_backoff = 0.05
+    stale_replies = 0  # frames dropped because they did not answer the request in progress
+    _framer = None
+
+    def __init__(self, serial_port='/dev/ttyUSB0', baudrate=115200, fast_decode=False, lazy_decode=False,
+                 timeouts=None, retries=0, retry_backoff=0.05):
+        self.fast_decode = fast_decode
+        self.lazy_decode = lazy_decode
+        self.timeouts = timeouts  # a timing.AdaptiveTimeout, or None for the fixed serial timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        if isinstance(serial_port, str):
+            self.s = serial.Serial(serial_port, baudrate, bytesize=8, parity=serial.PARITY_NONE, stopbits=1, timeout=2, exclusive=True)
+        else:
+            # An already opened serial-like object, e.g. a capture.ReplaySerial
+            self.s = serial_port
 
 
     @staticmethod
     def get_frame_checksum(frame: bytes):
         assert isinstance(frame, bytes)
-
-        sum = 0
-        for byte in frame:
-            sum += byte
-        sum = ~sum
-        sum %= 0x10000
-        sum += 1
-        return sum
+        return codec.frame_checksum(frame)
 
     @staticmethod
     def get_info_length(info: bytes) -> int:
-        lenid = len(info)
-        if lenid == 0:
-            return 0
-
-        lenid_sum = (lenid & 0xf) + ((lenid >> 4) & 0xf) + ((lenid >> 8) & 0xf)
-        lenid_modulo = lenid_sum % 16
-        lenid_invert_plus_one = 0b1111 - lenid_modulo + 1
-
-        return (lenid_invert_plus_one << 12) + lenid
+        return codec.length_field(len(info))
 
 
     def send_cmd(self, address: int, cmd, info: bytes = b''):
         raw_frame = self._encode_cmd(address, cmd, info)
+        self._flush_input()
         self.s.write(raw_frame)
 
+    def _flush_input(self):
+        """ Drops whatever was received before a request, e.g. the end of a reply that came too late """
+        if self._framer is None:
+            self._framer = FrameReader()
+        self._framer.clear()
+        reset_input_buffer = getattr(self.s, 'reset_input_buffer', None)
+        if reset_input_buffer is not None:
+            reset_input_buffer()
 
-    def _encode_cmd(self, address: int, cid2: int, info: bytes = b''):
-        cid1 = 0x46
 
-        info_length = Pylontech.get_info_length(info)
-
-        frame = "{:02X}{:02X}{:02X}{:02X}{:04X}".format(0x20, address, cid1, cid2, info_length).encode()
-        frame += info
-
-        frame_chksum = Pylontech.get_frame_checksum(frame)
-        whole_frame = (b"~" + frame + "{:04X}".format(frame_chksum).encode() + b"\r")
-        return whole_frame
+    @staticmethod
+    def _encode_cmd(address: int, cid2: int, info: bytes = b''):
+        return codec.encode_cmd(address, cid2, bytes(info))
 
 
-    def _decode_hw_frame(self, raw_frame: bytes) -> bytes:
+    @staticmethod
+    def _decode_hw_frame(raw_frame: bytes) -> bytes:
         # XXX construct
         frame_data = raw_frame[1:len(raw_frame) - 5]
         frame_chksum = raw_frame[len(raw_frame) - 5:-1]
 
+        if not raw_frame:
+            raise ReplyTimeout("No reply before the timeout")
         got_frame_checksum = Pylontech.get_frame_checksum(frame_data)
-        assert got_frame_checksum == int(frame_chksum, 16)
+        if got_frame_checksum != int(frame_chksum, 16):
+            raise ChecksumError("Bad frame checksum %s, expected %04X" % (frame_chksum, got_frame_checksum))
 
         return frame_data
 
-    def _decode_frame(self, frame):
-        format = construct.Struct(
-            "ver" / HexToByte(construct.Array(2, construct.Byte)),
-            "adr" / HexToByte(construct.Array(2, construct.Byte)),
-            "cid1" / HexToByte(construct.Array(2, construct.Byte)),
-            "cid2" / HexToByte(construct.Array(2, construct.Byte)),
-            "infolength" / HexToByte(construct.Array(4, construct.Byte)),
-            "info" / HexToByte(construct.GreedyRange(construct.Byte)),
-        )
-
-        return format.parse(frame)
-
+    @staticmethod
+    def _decode_frame(frame):
+        return codec.decode_frame(frame)
+
+
+    def read_raw_frame(self, deadline: float = None) -> bytes:
+        """ Returns the next valid raw frame from the port, or b'' if the read timed out.
+
+        It also returns b'' as soon as a frame with a bad checksum is dropped, rather than waiting
+        for the timeout, so that a retry can start right away. When `deadline` (a time.monotonic()
+        value) is given, it replaces the serial timeout: no read waits past it.
+        """
+        if self._framer is None:
+            self._framer = FrameReader()
+
+        framer = self._framer
+        bad_frames = framer.bad_frames
+        while True:
+            raw_frame = framer.next_frame()
+            if raw_frame is not None:
+                return raw_frame
+            if framer.bad_frames > bad_frames:
+                return b''
+
+            waiting, wanted = self.s.in_waiting, framer.wanted()
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return b''
+                if waiting < wanted:  # the read may block
+                    self._set_timeout(remaining)
+            data = self.s.read(max(waiting, wanted))
+            if not data:
+                if deadline is None or time.monotonic() >= deadline:
+                    return b''
+                continue  # the serial timeout was shorter than the time left
+            framer.feed(data)
+
+    def _set_timeout(self, timeout: float):
+        """ Makes sure a read waits at most `timeout` seconds, without reprogramming the port if it is close enough """
+        current = self.s.timeout
+        if current is None or not timeout / TIMEOUT_TOLERANCE <= current <= timeout:
+            self.s.timeout = timeout
 
     def read_frame(self):
-        raw_frame = self.s.readline()
-        f = self._decode_hw_frame(raw_frame=raw_frame)
-        parsed = self._decode_frame(f)
-        return parsed
+        if self._framer is None:
+            self._framer = FrameReader()
+        bad_frames = self._framer.bad_frames
+        return self._parse_reply(self.read_raw_frame(), bad_frames)
+
+    def _parse_reply(self, raw_reply: bytes, bad_frames: int):
+        """ Decodes a reply from read_raw_frame(); `bad_frames` is the framer counter before the read """
+        if not raw_reply and self._framer.bad_frames > bad_frames:
+            raise ChecksumError("Reply with a bad checksum")
+        return self._decode_frame(self._decode_hw_frame(raw_frame=raw_reply))
+
+
+    def add_hook(self, hook):
+        """ Registers an instrumentation hook, see the `instrumentation` module """
+        self.hooks = tuple(self.hooks) + (hook,)
+
+    def remove_hook(self, hook):
+        self.hooks = tuple(h for h in self.hooks if h is not hook)
+
+    def _command(self, address: int, cmd, info: bytes = b'', parse=None):
+        """ One request/reply round trip, tried again up to `retries` times on timeouts and bad checksums """
+        attempt = 0
+        while True:
+            try:
+                return self._transaction(address, cmd, info, parse)
+            except (ReplyTimeout, ChecksumError) as e:
+                if attempt >= self.retries:
+                    raise
+                delay = self.retry_backoff * 2 ** attempt
+                attempt += 1
+                logger.debug("%s from address %d for command %02X, retry %d in %.3fs", type(e).__name__, address,
+                             cmd, attempt, delay)
+                time.sleep(delay)
+
+    def _transaction(self, address: int, cmd, info: bytes = b'', parse=None, adaptive=True):
+        """ One request/reply round trip; the reply frame is returned decoded by `parse(frame)` if given """
+        if self.hooks:
+            return self._instrumented_command(address, cmd, info, parse, adaptive)
+        if self._framer is None:
+            self._framer = FrameReader()
+        bad_frames = self._framer.bad_frames
+        raw_reply = self._exchange(address, cmd, info, self._encode_cmd(address, cmd, info), adaptive)
+        f = self._parse_reply(raw_reply, bad_frames)
+        return f if parse is None else parse(f)
+
+    def _exchange(self, address: int, cmd, info: bytes, raw_frame: bytes, adaptive=True) -> bytes:
+        """ Writes an encoded request and returns the raw reply, b'' on timeout.
+
+        Without `adaptive`, the serial timeout applies even if `timeouts` is set.
+        """
+        self._flush_input()
+        if self.timeouts is None or not adaptive:
+            self.s.write(raw_frame)
+            return self._read_reply(address, cmd, info)
+
+        info = bytes(info)
+        baudrate = getattr(self.s, 'baudrate', 115200)
+        start = time.monotonic()
+        self.s.write(raw_frame)
+        raw_reply = self._read_reply(address, cmd, info, start + self.timeouts.deadline(address, cmd, info, baudrate))
+        if raw_reply:
+            reply_info_length = (len(raw_reply) - 18) // 2
+            self.timeouts.on_reply(address, cmd, info, reply_info_length, time.monotonic() - start, baudrate)
+        else:
+            self.timeouts.on_timeout(cmd)
+        return raw_reply
+
+    def _read_reply(self, address: int, cmd, info: bytes, deadline: float = None) -> bytes:
+        """ read_raw_frame(), skipping the frames that do not answer the request, e.g. a late reply to the previous one """
+        while True:
+            raw_reply = self.read_raw_frame(deadline)
+            if not raw_reply or self._reply_matches(raw_reply, address, cmd, info):
+                return raw_reply
+            logger.debug("Dropping frame not answering %02X to address %d: %r", cmd, address, raw_reply)
+            self.stale_replies += 1
+            self._framer.dropped_bytes += len(raw_reply)
 
+    @staticmethod
+    def _reply_matches(raw_reply: bytes, address: int, cmd, info: bytes) -> bool:
+        """ Checks the ADR of a reply and, when the request info is the module address, the address in the reply info.
+
+        Requests to address 0 (protocol version, manufacturer info) are answered by whichever module
+        is the master, so their ADR is not checked. A frame carrying the request CID2 is an echo of the request.
+        """
+        try:
+            if address and int(raw_reply[3:5], 16) != address:
+                return False
+            if int(raw_reply[7:9], 16) == cmd:
+                return False
+            offset = REPLY_ADDRESS_OFFSET.get(cmd)
+            if offset is not None and bytes(info) == b"%02X" % address:
+                start = 13 + 2 * offset
+                return int(raw_reply[start:start + 2], 16) == address
+        except ValueError:
+            return False
+        return True
+
+    def _instrumented_command(self, address: int, cmd, info: bytes = b'', parse=None, adaptive=True):
+        stats = CommandStats(address, cmd)
+        if self._framer is None:
+            self._framer = FrameReader()
+        bad_frames, dropped_bytes = self._framer.bad_frames, self._framer.dropped_bytes
+
+        t0 = time.perf_counter()
+        raw_frame = self._encode_cmd(address, cmd, info)
+        t1 = time.perf_counter()
+        raw_reply = self._exchange(address, cmd, info, raw_frame, adaptive)
+        t2 = time.perf_counter()
+
+        stats.tx_bytes = len(raw_frame)
+        stats.rx_bytes = len(raw_reply)
+        stats.encode_time = t1 - t0
+        stats.wire_time = t2 - t1
+        stats.timeout = not raw_reply
+        stats.checksum_errors = self._framer.bad_frames - bad_frames
+        stats.dropped_bytes = self._framer.dropped_bytes - dropped_bytes
+        try:
+            # On timeout this fails the same way as read_frame()
+            parsed = self._parse_reply(raw_reply, bad_frames)
+            if parse is not None:
+                parsed = parse(parsed)
+            stats.decode_time = time.perf_counter() - t2  # frame and payload
+            return parsed
+        finally:
+            for hook in self.hooks:
+                hook.on_command(stats)
+
+
+    def expected_frame_time(self, info_length: int) -> float:
+        """ Seconds needed to transfer a frame carrying `info_length` info bytes at the current baudrate """
+        return frame_time(info_length, getattr(self.s, 'baudrate', 115200))
+
+    def probe_serial_number(self, adr: int, adaptive=True):
+        """ Asks `adr` for its serial number and returns it, or None if nothing (valid) answered.
+
+        A single attempt, without retries; with `adaptive=False` the serial timeout is used even if
+        `timeouts` is set.
+        """
+        bdevid = "{:02X}".format(adr).encode()
+        try:
+            return self._transaction(adr, 0x93, bdevid, self._parse_serial_number, adaptive)
+        except (ReplyTimeout, ChecksumError):
+            return None
 
     def scan_for_batteries(self, start=0, end=255) -> Dict[int, str]:
         """ Returns a map of the batteries id to their serial number """
         batteries = {}
         for adr in range(start, end, 1):
-            bdevid = "{:02X}".format(adr).encode()
-            self.send_cmd(adr, 0x93, bdevid) # Probe for serial number
-            raw_frame = self.s.readline()
-
-            if raw_frame:
-                sn = self.get_module_serial_number(adr)
-                sn_str = sn["ModuleSerialNumber"].decode()
+            sn_str = self.probe_serial_number(adr)
 
+            if sn_str is not None:
                 batteries[adr] = sn_str
                 logger.debug("Found battery at address " + str(adr) + " with serial " + sn_str)
             else:
@@ -236,65 +456,95 @@ class Pylontech:
 
         return batteries
 
+    def discover_batteries(self, start=2, end=255, max_missing=1, cache_file=None,
+                           probe_margin=PROBE_MARGIN) -> Dict[int, str]:
+        """ Fast variant of scan_for_batteries for stacks using contiguous addresses.
+
+        Each probe only waits for the time the serial number reply needs on the wire (plus
+        `probe_margin` seconds for the BMS to answer), and the scan stops after `max_missing`
+        silent addresses in a row following a battery. When `cache_file` is given, the map found is stored there and
+        the next call only re-checks the cached addresses, falling back to a scan if they changed. Replies coming
+        after the probe timeout are dropped, and the map is then not cached since it may miss batteries.
+        """
+        stale_replies = self.stale_replies
+        old_timeout = self.s.timeout
+        self.s.timeout = self.expected_frame_time(2) + self.expected_frame_time(17) + probe_margin
+        try:
+            cached = self._load_topology(cache_file) if cache_file else {}
+            if cached and all(self.probe_serial_number(adr, adaptive=False) == sn for adr, sn in cached.items()):
+                logger.debug("Cached battery topology confirmed: " + str(cached))
+                return cached
+
+            batteries = {}
+            missing = 0
+            for adr in range(start, end, 1):
+                sn_str = self.probe_serial_number(adr, adaptive=False)
+                if sn_str is None:
+                    logger.debug("No battery found at address " + str(adr))
+                    missing += 1
+                    if batteries and missing >= max_missing:
+                        break
+                    continue
+
+                missing = 0
+                batteries[adr] = sn_str
+                logger.debug("Found battery at address " + str(adr) + " with serial " + sn_str)
+        finally:
+            self.s.timeout = old_timeout
+
+        if self.stale_replies > stale_replies:
+            logger.warning("%d probe replies came too late, consider a larger probe_margin; topology not cached",
+                           self.stale_replies - stale_replies)
+        elif cache_file:
+            self._save_topology(cache_file, batteries)
+        return batteries
+
+    @staticmethod
+    def _load_topology(cache_file) -> Dict[int, str]:
+        try:
+            with open(cache_file) as f:
+                return {int(adr): sn for adr, sn in json.load(f).items()}
+        except (OSError, ValueError, AttributeError):
+            return {}
+
+    @staticmethod
+    def _save_topology(cache_file, batteries: Dict[int, str]):
+        tmp = str(cache_file) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({str(adr): sn for adr, sn in batteries.items()}, f)
+        os.replace(tmp, cache_file)
+
 
     def get_protocol_version(self):
-        self.send_cmd(0, 0x4f)
-        return self.read_frame()
+        return self._command(0, 0x4f)
 
 
     def get_manufacturer_info(self):
-        self.send_cmd(0, 0x51)
-        f = self.read_frame()
-        return self.manufacturer_info_fmt.parse(f.info)
+        return self._command(0, 0x51, parse=self._parse_manufacturer_info)
 
 
     def get_system_parameters(self, dev_id=None):
         if dev_id:
             bdevid = "{:02X}".format(dev_id).encode()
-            self.send_cmd(dev_id, 0x47, bdevid)
-        else:
-            self.send_cmd(2, 0x47)
-
-        f = self.read_frame()
-        return self.system_parameters_fmt.parse(f.info[1:])
+            return self._command(dev_id, 0x47, bdevid, self._parse_system_parameters)
+        return self._command(2, 0x47, parse=self._parse_system_parameters)
 
     def get_management_info(self, dev_id):
         bdevid = "{:02X}".format(dev_id).encode()
-        self.send_cmd(dev_id, 0x92, bdevid)
-        f = self.read_frame()
-
-        print(f.info)
-        print(len(f.info))
-        ff = self.management_info_fmt.parse(f.info[1:])
-        print(ff)
-        return ff
+        return self._command(dev_id, 0x92, bdevid, self._parse_management_info)
 
     def get_module_serial_number(self, dev_id=None):
         if dev_id:
             bdevid = "{:02X}".format(dev_id).encode()
-            self.send_cmd(dev_id, 0x93, bdevid)
-        else:
-            self.send_cmd(2, 0x93)
-
-        f = self.read_frame()
-        # infoflag = f.info[0]
-        return self.module_serial_number_fmt.parse(f.info[0:])
+            return self._command(dev_id, 0x93, bdevid, self._parse_module_serial_number)
+        return self._command(2, 0x93, parse=self._parse_module_serial_number)
 
     def get_values(self):
-        self.send_cmd(2, 0x42, b'FF')
-        f = self.read_frame()
-
-        # infoflag = f.info[0]
-        d = self.get_values_fmt.parse(f.info[1:])
-        return d
+        return self._command(2, 0x42, b'FF', self._parse_values)
 
     def get_values_single(self, dev_id):
         bdevid = "{:02X}".format(dev_id).encode()
-        self.send_cmd(dev_id, 0x42, bdevid)
-        f = self.read_frame()
-        # infoflag = f.info[0]
-        d = self.get_values_single_fmt.parse(f.info[1:])
-        return d
+        return self._command(dev_id, 0x42, bdevid, self._parse_values_single)
 
 
 if __name__ == '__main__':
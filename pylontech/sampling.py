@@ -0,0 +1,211 @@
+""" Per-module poll intervals that follow the activity of the batteries.
+
+Each module gets its own interval between `min_interval` and `max_interval`.
+After every sample, the interval is set so that current, power and cell
+spread (max - min cell voltage) move by about one `resolution` step between
+two samples: a module whose current ramps quickly is polled quickly. When
+nothing moves, the interval grows by at most `growth` per sample, so an idle
+stack slows down gradually. A module close to one of its
+`get_system_parameters` limits (within `margins`) is polled at `min_interval`.
+
+The modules that are due are read together through a `PollPlanner`, which
+picks between one broadcast and per-module requests. The bus time of the
+resulting schedule is estimated from the planner costs; when it would exceed
+`max_utilisation`, every interval is stretched by the same factor.
+
+`rates()` reports the chosen and effective interval of each module and why,
+for debugging.
+"""
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from .planner import PlannedValues, PollPlanner
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESOLUTION = {
+    "Current": 1.0,  # A
+    "Power": 50.0,  # W
+    "CellSpread": 0.005,  # V
+}
+
+# limit name, measured quantity, bad direction (1: above, -1: below)
+LIMITS = (
+    ("CellHighVoltageLimit", "cell_voltage", 1),
+    ("CellLowVoltageLimit", "cell_voltage", -1),
+    ("ChargeHighTemperatureLimit", "temperature", 1),
+    ("ChargeLowTemperatureLimit", "temperature", -1),
+    ("DischargeHighTemperatureLimit", "temperature", 1),
+    ("DischargeLowTemperatureLimit", "temperature", -1),
+    ("ModuleHighVoltageLimit", "module_voltage", 1),
+    ("ModuleLowVoltageLimit", "module_voltage", -1),
+    ("ChargeCurrentLimit", "current", 1),
+    ("DischargeCurrentLimit", "current", -1),
+)
+
+DEFAULT_MARGINS = {
+    "cell_voltage": 0.05,  # V
+    "temperature": 3.0,  # °C
+    "module_voltage": 0.5,  # V
+    "current": 1.0,  # A
+}
+
+
+class ModuleRate:
+    __slots__ = ("address", "interval", "effective_interval", "reason", "next_due", "last_sample", "samples")
+
+    def __init__(self, address: int, interval: float):
+        self.address = address
+        self.interval = interval  # chosen from the activity
+        self.effective_interval = interval  # after the bus utilisation cap
+        self.reason = "initial"
+        self.next_due = 0.0
+        self.last_sample = None  # (t, current, power, cell spread)
+        self.samples = 0
+
+    def as_dict(self) -> dict:
+        return {"interval": self.interval, "effective_interval": self.effective_interval, "reason": self.reason,
+                "samples": self.samples}
+
+
+class AdaptiveSampler:
+    def __init__(self, p, parameters=None, min_interval: float = 1.0, max_interval: float = 60.0, growth: float = 1.5,
+                 resolution: Optional[Dict[str, float]] = None, margins: Optional[Dict[str, float]] = None,
+                 max_utilisation: float = 0.5, clock: Callable[[], float] = time.monotonic):
+        self.planner = p if isinstance(p, PollPlanner) else PollPlanner(p, clock=clock)
+        self.clock = clock
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.growth = growth
+        self.resolution = dict(DEFAULT_RESOLUTION if resolution is None else resolution)
+        self.margins = dict(DEFAULT_MARGINS if margins is None else margins)
+        self.max_utilisation = max_utilisation
+        self.utilisation = 0.0  # estimated fraction of the bus time used by the schedule, after the cap
+        self.modules = {}  # type: Dict[int, ModuleRate]
+        self._limits = []  # type: List[tuple]
+        if parameters is not None:
+            self.set_parameters(parameters)
+
+    def set_parameters(self, parameters):
+        """ Loads the limits of a get_system_parameters result """
+        self._limits = [(name, quantity, direction, float(parameters[name])) for name, quantity, direction in LIMITS]
+
+    def _near_limit(self, m) -> Optional[str]:
+        """ Name of the first limit `m` is within its margin of (or beyond), None if none """
+        if not self._limits:
+            return None
+        measured = {
+            "cell_voltage": (min(m.CellVoltages), max(m.CellVoltages)),
+            "temperature": (min(m.GroupedCellsTemperatures, default=m.AverageBMSTemperature),
+                            max(m.GroupedCellsTemperatures, default=m.AverageBMSTemperature)),
+            "module_voltage": (m.Voltage, m.Voltage),
+            "current": (m.Current, m.Current),
+        }
+        for name, quantity, direction, limit in self._limits:
+            low, high = measured[quantity]
+            distance = limit - high if direction > 0 else low - limit
+            if distance < self.margins[quantity]:
+                return name
+        return None
+
+    def _update(self, rate: ModuleRate, t: float, m):
+        cells = m.CellVoltages
+        sample = (t, m.Current, m.Power, max(cells) - min(cells))
+        previous = rate.last_sample
+        rate.last_sample = sample
+        rate.samples += 1
+
+        limit = self._near_limit(m)
+        if limit is not None:
+            interval, reason = self.min_interval, "near %s" % limit
+        elif previous is None or t <= previous[0]:
+            interval, reason = rate.interval, rate.reason
+        else:
+            dt = t - previous[0]
+            # How many resolution steps the fastest moving value changed by since the previous sample
+            steps, fastest = 0.0, None
+            for name, now, before in zip(("Current", "Power", "CellSpread"), sample[1:], previous[1:]):
+                s = abs(now - before) / self.resolution[name]
+                if s > steps:
+                    steps, fastest = s, name
+            ceiling = rate.interval * self.growth
+            if steps and dt / steps < ceiling:
+                interval, reason = dt / steps, "%s changing" % fastest
+            else:
+                interval, reason = ceiling, "steady"
+        interval = min(max(interval, self.min_interval), self.max_interval)
+        if interval == self.max_interval and reason == "steady":
+            reason = "idle"
+
+        if reason != rate.reason:
+            logger.debug("Module %d: interval %.1f s (%s)", rate.address, interval, reason)
+        rate.interval = interval
+        rate.reason = reason
+
+    def _apply_cap(self):
+        """ Stretches all the intervals by the same factor when the schedule would use too much bus time """
+        planner = self.planner
+        demand = sum(planner.single_cost(a) / r.interval for a, r in self.modules.items())
+        scale = max(1.0, demand / self.max_utilisation) if self.max_utilisation else 1.0
+        for r in self.modules.values():
+            r.effective_interval = r.interval * scale
+        self.utilisation = demand / scale
+
+    def due(self, now: Optional[float] = None) -> List[int]:
+        """ Addresses of the modules that should be read now """
+        now = self.clock() if now is None else now
+        return sorted(a for a, r in self.modules.items() if r.next_due <= now)
+
+    def next_due(self) -> float:
+        """ Seconds until the next module is due, 0 if one already is """
+        if not self.modules:
+            return 0.0
+        return max(0.0, min(r.next_due for r in self.modules.values()) - self.clock())
+
+    def poll(self) -> Optional[PlannedValues]:
+        """ Reads the modules that are due, None if none is """
+        if self.modules:
+            wanted = self.due()
+            if not wanted:
+                return None
+        else:
+            wanted = None  # the whole stack, to learn its modules
+        try:
+            values = self.planner.poll(wanted)
+        except ValueError as e:
+            logger.debug("Poll of %s failed: %s", wanted, e)
+            values = None
+        now = self.clock()
+
+        if values is not None:
+            for address, m in zip(values.Addresses, values.Module):
+                rate = self.modules.get(address)
+                if rate is None:
+                    rate = self.modules[address] = ModuleRate(address, self.min_interval)
+                self._update(rate, now, m)
+        self._apply_cap()
+        if wanted is None:
+            wanted = values.Addresses if values is not None else []
+        missing = wanted if values is None else values.Missing
+        for address in wanted:
+            rate = self.modules.get(address)
+            if rate is None:
+                continue
+            if address in missing:
+                rate.reason = "no reply"
+            rate.next_due = now + rate.effective_interval
+        return values
+
+    def run(self, callback: Callable[[PlannedValues], None], stop: threading.Event):
+        """ Polls until `stop` is set, calling `callback` with every result """
+        while not stop.is_set():
+            values = self.poll()
+            if values is not None:
+                callback(values)
+            stop.wait(self.next_due() if self.modules else self.min_interval)
+
+    def rates(self) -> Dict[int, dict]:
+        """ Interval, effective interval after the utilisation cap, reason and sample count, per address """
+        return {a: r.as_dict() for a, r in sorted(self.modules.items())}
@@ -0,0 +1,149 @@
+""" Multi-rate polling of a `Pylontech` stack with a TTL cache of the results.
+
+Each command gets its own interval: fast changing values are polled often,
+while parameters, serial numbers and versions are fetched rarely or once.
+Only the scheduler talks to the bus; readers get the latest cached snapshot
+immediately.
+"""
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self._entries = {}  # type: Dict[str, tuple]
+        self._lock = threading.Lock()
+
+    def set(self, key: str, value, ttl: Optional[float] = None):
+        now = self.clock()
+        expires = now + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, now, expires)
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return default
+        value, _, expires = entry
+        if expires is not None and self.clock() >= expires:
+            return default
+        return value
+
+    def age(self, key: str) -> Optional[float]:
+        """ Seconds since `key` was last stored, None if it never was """
+        with self._lock:
+            entry = self._entries.get(key)
+        return None if entry is None else self.clock() - entry[1]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """ All entries that have not expired yet """
+        now = self.clock()
+        with self._lock:
+            entries = dict(self._entries)
+        return {k: v for k, (v, _, expires) in entries.items() if expires is None or now < expires}
+
+
+class PollJob:
+    def __init__(self, name: str, fn: Callable, args: tuple, interval: Optional[float], ttl: Optional[float]):
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.interval = interval  # None: run once
+        self.ttl = ttl
+        self.next_run = 0.0
+        self.done = False
+        self.failures = 0  # in a row
+
+
+class PollScheduler:
+    """ Runs the bus commands of a `Pylontech` instance at per-command rates """
+
+    TTL_FACTOR = 3  # a result stays valid for this many polling intervals
+    RETRY_DELAY = 1.0  # first retry of a failed one-shot job, doubled on every failure
+
+    def __init__(self, p, clock: Callable[[], float] = time.monotonic):
+        self.p = p
+        self.clock = clock
+        self.cache = TTLCache(clock)
+        self.jobs = []  # type: list
+        self._thread = None
+        self._stop = threading.Event()
+
+    def add(self, name: str, fn: Callable, *args, interval: Optional[float] = None, ttl: Optional[float] = None):
+        """ Polls `fn(*args)` every `interval` seconds (once if None) and caches it under `name` """
+        if ttl is None and interval is not None:
+            ttl = interval * self.TTL_FACTOR
+        self.jobs.append(PollJob(name, fn, args, interval, ttl))
+
+    @classmethod
+    def default(cls, p, addresses: Iterable[int] = (2,), values_interval=1.0, management_interval=10.0,
+                parameters_interval=3600.0, **kwargs) -> "PollScheduler":
+        """ Values every second, management info every 10 s, parameters hourly, serials and versions once """
+        scheduler = cls(p, **kwargs)
+        scheduler.add("values", p.get_values, interval=values_interval)
+        scheduler.add("system_parameters", p.get_system_parameters, interval=parameters_interval)
+        scheduler.add("protocol_version", p.get_protocol_version)
+        scheduler.add("manufacturer_info", p.get_manufacturer_info)
+        for adr in addresses:
+            scheduler.add("management_info/%d" % adr, p.get_management_info, adr, interval=management_interval)
+            scheduler.add("serial_number/%d" % adr, p.get_module_serial_number, adr)
+        return scheduler
+
+    def get(self, name: str, default=None):
+        """ Latest cached result of `name`, never touches the bus """
+        return self.cache.get(name, default)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return self.cache.snapshot()
+
+    def run_pending(self) -> Optional[float]:
+        """ Runs the due jobs, returns the time until the next one is due (None if nothing is left) """
+        for job in self.jobs:
+            if job.done or self.clock() < job.next_run:
+                continue
+            try:
+                self.cache.set(job.name, job.fn(*job.args), job.ttl)
+            except Exception:
+                logger.exception("Polling %s failed", job.name)
+                job.failures += 1
+                if job.interval is None:
+                    job.next_run = self.clock() + self._retry_delay(job)
+                    continue
+            else:
+                job.failures = 0
+            if job.interval is None:
+                job.done = True
+            else:
+                job.next_run = self.clock() + job.interval
+
+        pending = [job.next_run for job in self.jobs if not job.done]
+        if not pending:
+            return None
+        return max(min(pending) - self.clock(), 0.0)
+
+    def _retry_delay(self, job: PollJob) -> float:
+        """ Exponential backoff, up to the longest polling interval """
+        longest = max([j.interval for j in self.jobs if j.interval is not None], default=self.RETRY_DELAY)
+        return min(self.RETRY_DELAY * 2 ** (job.failures - 1), max(longest, self.RETRY_DELAY))
+
+    def run(self):
+        while not self._stop.is_set():
+            delay = self.run_pending()
+            self._stop.wait(1.0 if delay is None else delay)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="pylontech-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
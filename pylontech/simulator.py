@@ -0,0 +1,236 @@
+""" Pseudo-terminal simulator of a Pylontech stack, for load and latency tests.
+
+The simulator opens a pty and answers the commands the library speaks (0x42,
+0x47, 0x4F, 0x51, 0x92 and 0x93) on its slave side, which `Pylontech` can open
+like any serial port:
+
+    >>> sim = StackSimulator([SimulatedModule() for _ in range(16)]).start()
+    >>> p = Pylontech(sim.port)
+
+It models the transmit time of the replies at the configured baudrate plus a
+per-module processing delay, and can inject faults: dropped replies, bad
+checksums and garbage bytes, either at random or on demand.
+
+    python -m pylontech.simulator --modules 16 --baudrate 9600
+"""
+import argparse
+import logging
+import os
+import random
+import select
+import struct
+import threading
+import time
+import tty
+from collections import deque
+from typing import List, Optional
+
+from . import codec
+from .framing import FrameReader
+
+logger = logging.getLogger(__name__)
+
+DROP = "drop"
+BAD_CHECKSUM = "bad_checksum"
+GARBAGE = "garbage"
+
+RTN_OK = 0x00
+RTN_INVALID_CID2 = 0x04
+
+
+class SimulatedModule:
+    """ One battery module; the attributes can be changed while the simulator runs """
+    def __init__(self, cells: int = 15, cell_voltage: int = 3300, temperatures: int = 5, temperature: int = 2981,
+                 current: int = -25, remaining_capacity: int = 33500, total_capacity: int = 50000,
+                 cycles: int = 31, extended_capacity: bool = False, serial_number: str = None):
+        self.cell_voltages = [cell_voltage] * cells  # mV
+        self.temperatures = [temperature] * temperatures  # deci-Kelvin, BMS average first
+        self.current = current  # deci-Amps
+        self.remaining_capacity = remaining_capacity  # mAh
+        self.total_capacity = total_capacity  # mAh
+        self.cycles = cycles
+        self.extended_capacity = extended_capacity  # 24 bits capacities, as sent by US3000
+        self.serial_number = serial_number
+
+    def analog_values(self) -> bytes:
+        cells = self.cell_voltages
+        temps = self.temperatures
+        block = struct.pack(">B%dhB%dh" % (len(cells), len(temps)), len(cells), *cells, len(temps), *temps)
+        voltage = sum(cells)
+        if self.extended_capacity:
+            block += struct.pack(">hHHBHH", self.current, voltage, 0xffff, 4, 0xffff, self.cycles)
+            block += self.remaining_capacity.to_bytes(3, "big") + self.total_capacity.to_bytes(3, "big")
+        else:
+            block += struct.pack(">hHHBHH", self.current, voltage, self.remaining_capacity, 2,
+                                 self.total_capacity, self.cycles)
+        return block
+
+
+class StackSimulator:
+    def __init__(self, modules: List[SimulatedModule], first_address: int = 2, baudrate: int = 115200,
+                 response_delay: float = 0.0, module_delay: float = 0.0, drop_rate: float = 0.0,
+                 bad_checksum_rate: float = 0.0, garbage_rate: float = 0.0, seed: Optional[int] = None):
+        self.modules = modules
+        self.first_address = first_address
+        self.baudrate = baudrate
+        self.response_delay = response_delay  # seconds before any reply
+        self.module_delay = module_delay  # extra seconds per module reported in a reply
+        self.drop_rate = drop_rate
+        self.bad_checksum_rate = bad_checksum_rate
+        self.garbage_rate = garbage_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.replies = 0
+
+        for i, m in enumerate(modules):
+            if m.serial_number is None:
+                m.serial_number = "PPTBH%011d" % (first_address + i)
+
+        self._faults = deque()
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def inject(self, fault: str, count: int = 1):
+        """ Applies `fault` (DROP, BAD_CHECKSUM or GARBAGE) to the next `count` replies """
+        self._faults.extend([fault] * count)
+
+    def start(self) -> "StackSimulator":
+        self._thread = threading.Thread(target=self._run, name="pylontech-simulator", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _run(self):
+        framer = FrameReader()
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._master], [], [], 0.05)
+            if not readable:
+                continue
+            try:
+                data = os.read(self._master, 4096)
+            except OSError:
+                continue  # EIO while no client has the slave open
+            framer.feed(data)
+            for request in framer:
+                self._handle(request)
+
+    def _module(self, address: int) -> Optional[SimulatedModule]:
+        index = address - self.first_address
+        if 0 <= index < len(self.modules):
+            return self.modules[index]
+        return None
+
+    def _handle(self, request: bytes):
+        self.requests += 1
+        f = codec.decode_frame(request[1:-5])
+        address, cid2, info = f.adr[0], f.cid2[0], f.info
+        reply_info, modules = self.answer(address, cid2, info)
+        if reply_info is None:
+            logger.debug("No module at address %d", address)
+            return
+
+        reply = codec.encode_cmd(address, RTN_OK if cid2 in self.COMMANDS else RTN_INVALID_CID2,
+                                 reply_info.hex().upper().encode())
+        fault = self._faults.popleft() if self._faults else self._random_fault()
+        if fault == DROP:
+            logger.debug("Dropping reply to %02X at address %d", cid2, address)
+            return
+        if fault == BAD_CHECKSUM:
+            reply = reply[:-5] + b"%04X\r" % ((int(reply[-5:-1], 16) + 1) & 0xffff)
+        elif fault == GARBAGE:
+            reply = bytes(self.random.randrange(256) for _ in range(8)).replace(b"~", b"") + reply
+
+        time.sleep(self.response_delay + self.module_delay * modules + len(reply) * 10 / self.baudrate)
+        os.write(self._master, reply)
+        self.replies += 1
+
+    def _random_fault(self) -> Optional[str]:
+        r = self.random.random()
+        for fault, rate in ((DROP, self.drop_rate), (BAD_CHECKSUM, self.bad_checksum_rate),
+                            (GARBAGE, self.garbage_rate)):
+            if r < rate:
+                return fault
+            r -= rate
+        return None
+
+    COMMANDS = (0x42, 0x47, 0x4f, 0x51, 0x92, 0x93)
+
+    def answer(self, address: int, cid2: int, info: bytes):
+        """ Returns (reply info, number of modules reported), (None, 0) when nobody answers """
+        if cid2 in (0x4f, 0x51) and address == 0:
+            module = self.modules[0] if self.modules else None
+        else:
+            module = self._module(address)
+        if module is None:
+            return None, 0
+
+        if cid2 == 0x42:
+            if info == b"\xff":
+                body = b"".join(m.analog_values() for m in self.modules)
+                return bytes([0x11, len(self.modules)]) + body, len(self.modules)
+            return bytes([0x10, address]) + module.analog_values(), 1
+        if cid2 == 0x47:
+            return bytes([0x11]) + struct.pack(">HHhhhhHHHhhh", 3700, 3050, 2900, 3341, 2731, 102, 54000, 46000,
+                                               44500, 3341, 2731, -100), 1
+        if cid2 == 0x4f:
+            return b"", 1
+        if cid2 == 0x51:
+            return b"US2000C\x00\x00\x00" + bytes([1, 2]) + b"PYLON", 1
+        if cid2 == 0x92:
+            return bytes([address]) + struct.pack(">HHhhB", 53200, 47000, 250, -250, 0xc0), 1
+        if cid2 == 0x93:
+            return bytes([address]) + module.serial_number.encode()[:16].ljust(16, b" "), 1
+        return b"", 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulated Pylontech stack on a pseudo-terminal")
+    parser.add_argument("--modules", type=int, default=3)
+    parser.add_argument("--cells", type=int, default=15)
+    parser.add_argument("--extended-capacity", action="store_true", help="send 24 bits capacities (US3000)")
+    parser.add_argument("--baudrate", type=int, default=115200)
+    parser.add_argument("--response-delay", type=float, default=0.0)
+    parser.add_argument("--module-delay", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--bad-checksum-rate", type=float, default=0.0)
+    parser.add_argument("--garbage-rate", type=float, default=0.0)
+    parser.add_argument("--link", help="also make the pty available under this path")
+    args = parser.parse_args(argv)
+
+    modules = [SimulatedModule(cells=args.cells, extended_capacity=args.extended_capacity)
+               for _ in range(args.modules)]
+    sim = StackSimulator(modules, baudrate=args.baudrate, response_delay=args.response_delay,
+                         module_delay=args.module_delay, drop_rate=args.drop_rate,
+                         bad_checksum_rate=args.bad_checksum_rate, garbage_rate=args.garbage_rate)
+    if args.link:
+        os.symlink(sim.port, args.link)
+    print(sim.port, flush=True)
+    sim.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sim.stop()
+        if args.link:
+            os.unlink(args.link)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+""" Batched push of the telemetry to InfluxDB (line protocol over HTTP) or MQTT.
+
+The line protocol template of a stack (one line per cell, temperature sensor
+and module, plus a stack line) is built once per stack shape, with `%`
+placeholders for the values, so a sample is rendered with a single string
+formatting operation and appended to the current batch buffer.
+
+A background thread sends the batches: when the buffer reaches `max_bytes`,
+or every `flush_interval` seconds. `write()` never touches the network.
+When the backend cannot keep up and batches pile up beyond `max_pending`
+times `max_bytes`, the sink drops to a coarser rate, keeping only one sample
+in `decimation` (doubled on every overflow, halved back once batches go
+through again), and drops the samples that still do not fit. A batch the
+backend fails to take is dropped too; every sample lost is counted.
+"""
+import http.client
+import logging
+import socket
+import struct
+import threading
+import time
+from typing import Callable, Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+def _escape_tag(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+
+def build_template(values, tags: str) -> str:
+    """ Line protocol for the shape of `values`, with a %r per value and a %s per timestamp """
+    lines = []
+    for i, m in enumerate(values.Module):
+        module = "%s,module=%d" % (tags, i + 1)
+        for j in range(len(m.CellVoltages)):
+            lines.append("pylontech_cell%s,cell=%d voltage=%%r %%s\n" % (module, j + 1))
+        lines.append("pylontech_temperature%s,sensor=bms celsius=%%r %%s\n" % module)
+        for j in range(len(m.GroupedCellsTemperatures)):
+            lines.append("pylontech_temperature%s,sensor=%d celsius=%%r %%s\n" % (module, j + 1))
+        lines.append("pylontech_module%s voltage=%%r,current=%%r,power=%%r,remaining_capacity=%%r,"
+                     "total_capacity=%%r,cycles=%%di %%s\n" % module)
+    lines.append("pylontech_stack%s total_power=%%r,state_of_charge=%%r %%s\n" % tags)
+    return "".join(lines)
+
+
+def template_args(values, ts: str) -> list:
+    """ The arguments of build_template(values), in the same order """
+    args = []  # type: list
+    for m in values.Module:
+        for v in m.CellVoltages:
+            args.append(float(v))
+            args.append(ts)
+        args.append(float(m.AverageBMSTemperature))
+        args.append(ts)
+        for t in m.GroupedCellsTemperatures:
+            args.append(float(t))
+            args.append(ts)
+        args.extend((float(m.Voltage), float(m.Current), float(m.Power), float(m.RemainingCapacity),
+                     float(m.TotalCapacity), m.CycleNumber, ts))
+    args.extend((float(values.TotalPower), float(values.StateOfCharge), ts))
+    return args
+
+
+class HttpTransport:
+    """ POSTs each batch to an InfluxDB write endpoint over a kept-alive connection, e.g.
+    http://localhost:8086/api/v2/write?bucket=batteries&precision=ns """
+    def __init__(self, url: str, headers: Optional[dict] = None, timeout: float = 5.0):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port
+        self.https = parts.scheme == "https"
+        self.path = parts.path + ("?" + parts.query if parts.query else "")
+        self.headers = dict(headers or {})
+        self.headers.setdefault("Content-Type", "text/plain; charset=utf-8")
+        self.timeout = timeout
+        self._conn = None
+
+    def send(self, data: bytes):
+        if self._conn is None:
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            self._conn = cls(self.host, self.port, timeout=self.timeout)
+        try:
+            self._conn.request("POST", self.path, body=data, headers=self.headers)
+            response = self._conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            self.close()
+            raise
+        if response.status >= 300:
+            raise OSError("HTTP %d %s" % (response.status, response.reason))
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def _mqtt_string(s: str) -> bytes:
+    data = s.encode()
+    return struct.pack(">H", len(data)) + data
+
+
+def mqtt_packet(packet_type: int, body: bytes) -> bytes:
+    """ Fixed header (type and flags byte, variable length remaining length) followed by `body` """
+    header = bytearray([packet_type])
+    length = len(body)
+    while True:
+        byte, length = length % 128, length // 128
+        header.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(header) + body
+
+
+class MqttTransport:
+    """ Publishes each batch as one QoS 0 message, with a minimal MQTT 3.1.1 client """
+    def __init__(self, host: str, port: int = 1883, topic: str = "pylontech/influx", client_id: str = "pylontech",
+                 timeout: float = 5.0):
+        self.host = host
+        self.port = port
+        self.topic = topic
+        self.client_id = client_id
+        self.timeout = timeout
+        self._sock = None
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        # protocol name, level 4, clean session, keep alive disabled
+        sock.sendall(mqtt_packet(0x10, _mqtt_string("MQTT") + bytes([4, 0x02, 0, 0]) + _mqtt_string(self.client_id)))
+        connack = b""
+        while len(connack) < 4:
+            data = sock.recv(4 - len(connack))
+            if not data:
+                raise ConnectionError("MQTT broker closed the connection")
+            connack += data
+        if connack[0] != 0x20 or connack[3] != 0:
+            sock.close()
+            raise ConnectionError("MQTT connection refused, return code %d" % connack[3])
+        self._sock = sock
+
+    def send(self, data: bytes):
+        if self._sock is None:
+            self._connect()
+        try:
+            self._sock.sendall(mqtt_packet(0x30, _mqtt_string(self.topic) + data))
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.sendall(mqtt_packet(0xe0, b""))
+            except OSError:
+                pass
+            self._sock.close()
+            self._sock = None
+
+
+class LineProtocolSink:
+    def __init__(self, transport, tags: Optional[dict] = None, max_bytes: int = 65536, flush_interval: float = 1.0,
+                 max_pending: int = 4, max_decimation: int = 64, clock: Callable[[], float] = time.monotonic):
+        self.transport = transport
+        self.tags = "".join(",%s=%s" % (_escape_tag(k), _escape_tag(v)) for k, v in sorted((tags or {}).items()))
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_decimation = max_decimation
+        self.clock = clock
+
+        self.decimation = 1
+        self.sent_batches = 0
+        self.sent_bytes = 0
+        self.failed_batches = 0
+        self.failed_samples = 0  # in the batches the backend failed to take
+        self.skipped_samples = 0  # left out by the decimation
+        self.dropped_samples = 0  # did not fit in the buffer
+
+        self._shape = None
+        self._template = ""
+        self._seen = 0
+        self._buffer = bytearray()
+        self._buffer_samples = 0
+        self._spare = bytearray()
+        self._ready = False  # the buffer should be sent without waiting for the flush interval
+        self._last_flush = clock()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="pylontech-sink", daemon=True)
+        self._thread.start()
+
+    def write(self, values, timestamp: Optional[float] = None):
+        """ Queues a get_values result taken at `timestamp` (epoch seconds, default now); never blocks on I/O """
+        with self._cond:
+            self._seen += 1
+            skip = self._seen % self.decimation
+            if skip:
+                self.skipped_samples += 1
+        if skip:
+            return
+
+        shape = tuple((len(m.CellVoltages), len(m.GroupedCellsTemperatures)) for m in values.Module)
+        if shape != self._shape:
+            self._template = build_template(values, self.tags)
+            self._shape = shape
+        ts = "%d" % ((time.time() if timestamp is None else timestamp) * 1e9)
+        data = (self._template % tuple(template_args(values, ts))).encode()
+
+        with self._cond:
+            if len(self._buffer) + len(data) > self.max_bytes * self.max_pending:
+                self.dropped_samples += 1
+                self.decimation = min(self.decimation * 2, self.max_decimation)
+                logger.debug("Sink backend too slow, keeping one sample in %d", self.decimation)
+                return
+            self._buffer += data
+            self._buffer_samples += 1
+            if len(self._buffer) >= self.max_bytes:
+                self._ready = True
+                self._cond.notify()
+
+    def flush(self):
+        """ Asks for the buffered samples to be sent now, without waiting for them to be """
+        with self._cond:
+            self._ready = True
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._buffer and (self._ready or self._closed or
+                                         self.clock() - self._last_flush >= self.flush_interval):
+                        break
+                    if self._closed:
+                        return
+                    timeout = self._last_flush + self.flush_interval - self.clock()
+                    self._cond.wait(max(timeout, 0.001) if self._buffer else self.flush_interval)
+                    if not self._buffer:
+                        self._last_flush = self.clock()
+                batch, self._buffer, self._spare = self._buffer, self._spare, None
+                samples, self._buffer_samples = self._buffer_samples, 0
+                self._ready = False
+                self._last_flush = self.clock()
+
+            try:
+                self.transport.send(batch)
+            except Exception as e:
+                logger.warning("Sending %d bytes failed, %d samples lost: %r", len(batch), samples, e)
+                with self._cond:
+                    self.failed_batches += 1
+                    self.failed_samples += samples
+                    self.decimation = min(self.decimation * 2, self.max_decimation)
+            else:
+                with self._cond:
+                    self.sent_batches += 1
+                    self.sent_bytes += len(batch)
+                    if len(self._buffer) < self.max_bytes and self.decimation > 1:
+                        self.decimation //= 2  # caught up, back to a finer rate
+            batch.clear()
+            with self._cond:
+                self._spare = batch
+
+    def close(self, timeout: Optional[float] = None):
+        """ Sends what is buffered and stops the sender thread """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
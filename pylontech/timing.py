@@ -0,0 +1,95 @@
+""" Per-command reply deadlines.
+
+A reply cannot arrive before the request and the reply itself have been
+transmitted, which takes a time known from the baudrate and the frame
+lengths; what is left is the BMS processing time. `AdaptiveTimeout` estimates
+the latter per command from the measured round trips, like TCP does for its
+retransmission timer (smoothed RTT plus four deviations), and applies it on
+top of the wire time of the expected reply. The reply length is learned per
+request, so a 16 modules 0x42 reply gets a longer deadline than a 0x93 probe.
+
+Timed out round trips are not measured (their RTT is unknown); instead the
+margin of the command is doubled until a reply comes back.
+"""
+from typing import Dict, Tuple
+
+# Info bytes expected in the reply before any was seen, per CID2
+DEFAULT_REPLY_INFO = {
+    0x42: 2 + 16 * 59,  # get_values of a 16 modules stack, 24 bits capacities
+    0x47: 25,
+    0x4f: 0,
+    0x51: 17,
+    0x92: 10,
+    0x93: 17,
+}
+UNKNOWN_REPLY_INFO = 64
+
+
+def frame_time(info_length: int, baudrate: int) -> float:
+    """ Seconds needed to transfer a frame carrying `info_length` info bytes (8N1: 10 bits per byte) """
+    return (18 + 2 * info_length) * 10 / baudrate
+
+
+def request_time(info: bytes, baudrate: int) -> float:
+    """ Seconds needed to transfer a request; its `info` is already hex encoded """
+    return (18 + len(info)) * 10 / baudrate
+
+
+class _Estimator:
+    __slots__ = ("srtt", "rttvar", "backoff")
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = 0.0
+        self.backoff = 1
+
+
+class AdaptiveTimeout:
+    def __init__(self, initial_margin: float = 0.5, min_margin: float = 0.02, max_timeout: float = 2.0,
+                 deviations: float = 4.0):
+        self.initial_margin = initial_margin  # BMS processing time allowed before any measurement
+        self.min_margin = min_margin
+        self.max_timeout = max_timeout
+        self.deviations = deviations
+        self._estimators = {}  # type: Dict[int, _Estimator]
+        self._reply_info = {}  # type: Dict[Tuple[int, int, bytes], int]
+
+    def _estimator(self, cid2: int) -> _Estimator:
+        e = self._estimators.get(cid2)
+        if e is None:
+            e = self._estimators[cid2] = _Estimator()
+        return e
+
+    def margin(self, cid2: int) -> float:
+        """ Processing time allowed to the BMS for `cid2` """
+        e = self._estimator(cid2)
+        if e.srtt is None:
+            margin = self.initial_margin
+        else:
+            margin = max(self.min_margin, e.srtt + self.deviations * e.rttvar)
+        return margin * e.backoff
+
+    def deadline(self, address: int, cid2: int, info: bytes, baudrate: int) -> float:
+        """ Seconds to wait for the reply to a request, counted from the start of its transmission """
+        reply_info = self._reply_info.get((address, cid2, info))
+        if reply_info is None:
+            reply_info = DEFAULT_REPLY_INFO.get(cid2, UNKNOWN_REPLY_INFO)
+        wire = request_time(info, baudrate) + frame_time(reply_info, baudrate)
+        return min(self.max_timeout, wire + self.margin(cid2))
+
+    def on_reply(self, address: int, cid2: int, info: bytes, reply_info_length: int, rtt: float, baudrate: int):
+        """ Records a successful round trip of `rtt` seconds """
+        self._reply_info[(address, cid2, info)] = reply_info_length
+        sample = max(0.0, rtt - request_time(info, baudrate) - frame_time(reply_info_length, baudrate))
+        e = self._estimator(cid2)
+        if e.srtt is None:
+            e.srtt = sample
+            e.rttvar = sample / 2
+        else:
+            e.rttvar = 0.75 * e.rttvar + 0.25 * abs(e.srtt - sample)
+            e.srtt = 0.875 * e.srtt + 0.125 * sample
+        e.backoff = 1
+
+    def on_timeout(self, cid2: int):
+        e = self._estimator(cid2)
+        e.backoff = min(e.backoff * 2, 64)
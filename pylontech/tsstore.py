@@ -0,0 +1,278 @@
+""" Compact append-only store for cell level telemetry, with min/max/mean rollups.
+
+Samples are kept in the raw integer units of the protocol (mV, deci-amps,
+deci-kelvin, mAh) instead of floats. They are buffered into chunks of a fixed
+number of samples; each chunk stores every series delta-encoded and
+zlib-compressed, so slowly moving cell voltages cost almost nothing.
+
+1-minute and 1-hour rollups are built as samples arrive, and `query()` reads
+from the coarsest resolution that still gives enough points, so a query over
+a year of one-second data never has to decode the raw chunks.
+
+A store directory holds:
+
+* `layout.json`: the series names, fixed when the store is created;
+* `raw.bin`: the chunks, each with a small header (sample count, time range);
+* `rollup-60.bin`, `rollup-3600.bin`: one fixed-size record per bucket.
+"""
+import json
+import os
+import struct
+import zlib
+from array import array
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+CHUNK_HEADER = struct.Struct("<4sIIqq")  # magic, samples, payload length, first and last timestamp (ms)
+CHUNK_MAGIC = b"PYTS"
+ROLLUPS = (60, 3600)  # seconds
+ROLLUP_READ_RECORDS = 256  # rollup records read at once by a query
+
+
+def series_names(values) -> List[str]:
+    names = []
+    for i, m in enumerate(values.Module):
+        p = "m%d." % i
+        names.extend(p + "cell%d" % j for j in range(len(m.CellVoltages)))
+        names.append(p + "temp_bms")
+        names.extend(p + "temp%d" % j for j in range(len(m.GroupedCellsTemperatures)))
+        names.extend(p + x for x in ("current", "voltage", "remaining", "total", "cycles"))
+    return names
+
+
+def raw_row(values) -> List[int]:
+    """ A get_values result converted back to the integer units of the protocol """
+    row = []
+    for m in values.Module:
+        row.extend(round(v * 1000) for v in m.CellVoltages)
+        row.append(round(m.AverageBMSTemperature * 10) + 2731)
+        row.extend(round(t * 10) + 2731 for t in m.GroupedCellsTemperatures)
+        row.extend((round(m.Current * 10), round(m.Voltage * 1000), round(m.RemainingCapacity * 1000),
+                    round(m.TotalCapacity * 1000), m.CycleNumber))
+    return row
+
+
+class _Bucket:
+    __slots__ = ("start", "count", "mins", "maxs", "sums")
+
+    def __init__(self, start: int, row: Sequence[int]):
+        self.start = start
+        self.count = 1
+        self.mins = list(row)
+        self.maxs = list(row)
+        self.sums = list(row)
+
+    def add(self, row: Sequence[int]):
+        self.count += 1
+        mins, maxs, sums = self.mins, self.maxs, self.sums
+        for i, v in enumerate(row):
+            if v < mins[i]:
+                mins[i] = v
+            elif v > maxs[i]:
+                maxs[i] = v
+            sums[i] += v
+
+
+class Rollup:
+    __slots__ = ("start", "count", "mins", "maxs", "means")
+
+    def __init__(self, start: int, count: int, mins: List[int], maxs: List[int], means: List[float]):
+        self.start = start  # ms
+        self.count = count
+        self.mins = mins
+        self.maxs = maxs
+        self.means = means
+
+    def merge(self, other: "Rollup"):
+        total = self.count + other.count
+        self.means = [(a * self.count + b * other.count) / total for a, b in zip(self.means, other.means)]
+        self.mins = [min(a, b) for a, b in zip(self.mins, other.mins)]
+        self.maxs = [max(a, b) for a, b in zip(self.maxs, other.maxs)]
+        self.count = total
+
+
+class TelemetryStore:
+    """ Store in directory `path`; the series are fixed by `series` or by the first get_values appended """
+    def __init__(self, path, series: Optional[List[str]] = None, chunk_samples: int = 3600):
+        self.path = path
+        self.chunk_samples = chunk_samples
+        os.makedirs(path, exist_ok=True)
+
+        self.series = None  # type: Optional[List[str]]
+        layout_file = os.path.join(path, "layout.json")
+        if os.path.exists(layout_file):
+            with open(layout_file) as f:
+                self.series = json.load(f)
+        elif series is not None:
+            self._set_series(series)
+
+        self._timestamps = array("q")
+        self._rows = []  # type: List[List[int]]
+        self._buckets = {}  # resolution -> _Bucket
+        self._raw = open(os.path.join(path, "raw.bin"), "ab")
+        self._rollups = {r: open(os.path.join(path, "rollup-%d.bin" % r), "ab") for r in ROLLUPS}
+
+    def _set_series(self, series: List[str]):
+        with open(os.path.join(self.path, "layout.json"), "w") as f:
+            json.dump(list(series), f)
+        self.series = list(series)
+
+    @property
+    def _rollup_record(self) -> struct.Struct:
+        """ bucket start (ms), sample count, then the minimums, maximums and means of every series """
+        n = len(self.series)
+        return struct.Struct("<qI%di%di%df" % (n, n, n))
+
+    def append(self, values, timestamp: float):
+        """ Appends a get_values result taken at `timestamp` (seconds) """
+        if self.series is None:
+            self._set_series(series_names(values))
+        row = raw_row(values)
+        if len(row) != len(self.series):
+            raise ValueError("Stack layout changed, this store holds %d series, got %d" % (len(self.series), len(row)))
+        self.append_raw(row, timestamp)
+
+    def append_raw(self, row: List[int], timestamp: float):
+        """ Appends one sample already in protocol units, in the order of `series` """
+        ms = int(round(timestamp * 1000))
+        self._timestamps.append(ms)
+        self._rows.append(row)
+        if len(self._rows) >= self.chunk_samples:
+            self._write_chunk()
+
+        for resolution in ROLLUPS:
+            start = ms - ms % (resolution * 1000)
+            bucket = self._buckets.get(resolution)
+            if bucket is not None and bucket.start == start:
+                bucket.add(row)
+                continue
+            if bucket is not None:
+                self._write_rollup(resolution, bucket)
+            self._buckets[resolution] = _Bucket(start, row)
+
+    def _write_chunk(self):
+        if not self._rows:
+            return
+        timestamps = self._timestamps
+        deltas = array("q", [timestamps[0]] + [b - a for a, b in zip(timestamps, timestamps[1:])])
+        columns = array("i")
+        for column in zip(*self._rows):
+            columns.append(column[0])
+            columns.extend([b - a for a, b in zip(column, column[1:])])
+        payload = zlib.compress(deltas.tobytes() + columns.tobytes())
+        self._raw.write(CHUNK_HEADER.pack(CHUNK_MAGIC, len(timestamps), len(payload), timestamps[0], timestamps[-1]))
+        self._raw.write(payload)
+        self._timestamps = array("q")
+        self._rows = []
+
+    def _write_rollup(self, resolution: int, bucket: _Bucket):
+        means = [s / bucket.count for s in bucket.sums]
+        self._rollups[resolution].write(self._rollup_record.pack(bucket.start, bucket.count,
+                                                                 *bucket.mins, *bucket.maxs, *means))
+
+    def flush(self):
+        """ Writes the pending samples as a (short) chunk and the open rollup buckets """
+        self._write_chunk()
+        for resolution, bucket in self._buckets.items():
+            self._write_rollup(resolution, bucket)
+        self._buckets = {}
+        self._raw.flush()
+        for f in self._rollups.values():
+            f.flush()
+
+    def close(self):
+        if self.series is not None:
+            self.flush()
+        self._raw.close()
+        for f in self._rollups.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def read_raw(self, start: float, end: float) -> Iterator[Tuple[float, List[int]]]:
+        """ (timestamp, row) for the flushed samples with start <= timestamp < end """
+        start_ms, end_ms = start * 1000, end * 1000
+        n = len(self.series)
+        with open(os.path.join(self.path, "raw.bin"), "rb") as f:
+            while True:
+                header = f.read(CHUNK_HEADER.size)
+                if len(header) < CHUNK_HEADER.size:
+                    return
+                magic, samples, length, first, last = CHUNK_HEADER.unpack(header)
+                if magic != CHUNK_MAGIC:
+                    raise ValueError("Corrupt chunk in %s" % self.path)
+                if last < start_ms or first >= end_ms:
+                    f.seek(length, os.SEEK_CUR)
+                    continue
+
+                data = zlib.decompress(f.read(length))
+                timestamps = array("q")
+                timestamps.frombytes(data[:8 * samples])
+                values = array("i")
+                values.frombytes(data[8 * samples:])
+                for i in range(1, samples):
+                    timestamps[i] += timestamps[i - 1]
+                columns = []
+                for s in range(n):
+                    column = values[s * samples:(s + 1) * samples]
+                    for i in range(1, samples):
+                        column[i] += column[i - 1]
+                    columns.append(column)
+                for i in range(samples):
+                    if start_ms <= timestamps[i] < end_ms:
+                        yield timestamps[i] / 1000, [c[i] for c in columns]
+
+    def read_rollups(self, resolution: int, start: float, end: float) -> List[Rollup]:
+        """ Rollups of `resolution` seconds (60 or 3600) whose bucket starts in [start, end) """
+        record = self._rollup_record
+        n = len(self.series)
+        start_ms, end_ms = start * 1000, end * 1000
+        merged = {}  # bucket start -> Rollup, a bucket may be split over a flush
+        with open(os.path.join(self.path, "rollup-%d.bin" % resolution), "rb") as f:
+            f.seek(self._first_rollup(f, record.size, start_ms) * record.size)
+            done = False
+            while not done:
+                data = f.read(record.size * ROLLUP_READ_RECORDS)
+                done = len(data) < record.size * ROLLUP_READ_RECORDS
+                for offset in range(0, len(data) - record.size + 1, record.size):
+                    fields = record.unpack_from(data, offset)
+                    bucket_start, count = fields[0], fields[1]
+                    if bucket_start >= end_ms:
+                        done = True
+                        break
+                    r = Rollup(bucket_start, count, list(fields[2:2 + n]), list(fields[2 + n:2 + 2 * n]),
+                               list(fields[2 + 2 * n:]))
+                    if bucket_start in merged:
+                        merged[bucket_start].merge(r)
+                    else:
+                        merged[bucket_start] = r
+        return [merged[k] for k in sorted(merged)]
+
+    @staticmethod
+    def _first_rollup(f, size: int, start_ms: float) -> int:
+        """ Position of the first record of the rollup file `f` whose bucket starts at or after `start_ms`.
+
+        Rollup records are written in time order, so this bisects on their bucket start.
+        """
+        lo, hi = 0, os.fstat(f.fileno()).st_size // size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            f.seek(mid * size)
+            if struct.unpack("<q", f.read(8))[0] < start_ms:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def query(self, name: str, start: float, end: float, max_points: int = 2000):
+        """ (timestamp, min, max, mean) of one series, from the finest resolution giving about max_points
+        at most; raw samples are assumed to come at most once per second """
+        i = self.series.index(name)
+        span = end - start
+        if span <= max_points:
+            return [(t, row[i], row[i], row[i]) for t, row in self.read_raw(start, end)]
+        resolution = ROLLUPS[0] if span / ROLLUPS[0] <= max_points else ROLLUPS[1]
+        return [(r.start / 1000, r.mins[i], r.maxs[i], r.means[i]) for r in self.read_rollups(resolution, start, end)]
@@ -13,7 +13,10 @@ setup(
     packages=['pylontech'],
     long_description=open("README.md", "r").read(),
     long_description_content_type="text/markdown",
+    python_requires='>=3.7',
     install_requires=['pyserial', 'construct'],
+    extras_require={'numpy': ['numpy']},
+    entry_points={'console_scripts': ['pylontech=pylontech.cli:main']},
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Topic :: Utilities",
@@ -0,0 +1,74 @@
+""" Raw frames captured from real stacks, shared by the tests and the benchmarks """
+import pylontech
+
+US2000_3MODULES_VALUES = (
+    b"~20024600914211030F0CE70CE80CE60CE70CE80CE80CE80CE60CE50CE60CE80CE70CEA0CE50CE6050B910B870B870B870B87FFE6C18982DC02C350001F0F0CE20CE60CE60CE10CE50CE70CE60CE30CE20CE50CE30CE90CE70CE90CE9050B910B870B870B870B87FFE7C17082DC02C350001F0F0CE20CE50CE50CE20CE30CE30CE40CE50CE60CE60CE30CE40CE40CE60CE6050B910B7D0B7D0B7D0B7DFFE5C16082DC02C350001FB476\r"
+)
+
+US3000_4MODULES_VALUES = (
+    b"~2002460061DC11040F0CFD0CFC0CFC0CFB0CFC0CFB0CFD0CFC0CFC0CFB0CFA0CFD0CFB0CFE0CFA050BE10BCD0BCD0BCD0BCD0000C2C1FFFF04FFFF002F00EFEC0121100F0CEB0CEB0CEB0CEA0CEA0CEC0CEB0CEB0CE90CE80CE60CE90CE90CEA0CE8050BE10BCD0BCD0BCD0BCDFFBCC1B2FFFF04FFFF002800F2D00121100F0CE80CE90CEA0CEA0CEA0CE90CEA0CEA0CEB0CEC0CEB0CEB0CEB0CEA0CEA050BE10BC30BC30BC30BC3FFB7C1B8FFFF04FFFF007100E7400121100F0CE90CEC0CEB0CEA0CEA0CEB0CE90CE80CEA0CEA0CEA0CEB0CEC0CEA0CEA050BD70BC30BC30BC30BB9FFBBC1B9FFFF04FFFF006B00ED080121108D63\r"
+)
+
+MIXED_US3000_US2000_VALUES = (
+    b"~2002460010F011020F0CCD0CCE0CCC0CCE0CCB0CCC0CCD0CCC0CCD0CCB0CCC0CCD0CCD0CCE0CCC050BE10BCD0BCD0BD70BCDFFC3BFFDFFFF04FFFF0234007F300121100F0CCA0CCA0CCB0CCC0CCA0CCC0CCB0CCB0CCB0CCB0CCB0CCA0CCC0CCC0CCB050BEB0BCD0BCD0BCD0BC3FFD1BFE5FFFF04FFFF0292005FB400C350C4A7\r"
+)
+
+UP2500_SINGLE_VALUES = (
+    b"~20024600D05E1002080D020D020D020D030D000D010D010D03050B7D0B690B690B690B73FFFA680EFFFF04FFFF00000174E401B198E906\r"
+)
+
+UP2500_MANAGEMENT_INFO = (
+    b"~20024600B014026EF05AA0022BFDD5C0F915\r"
+)
+
+GET_VALUES_FRAMES = [
+    US2000_3MODULES_VALUES,
+    US3000_4MODULES_VALUES,
+    MIXED_US3000_US2000_VALUES,
+]
+
+
+def info_payload(frame: bytes) -> bytes:
+    """ The info field of a reply frame, without its leading flag byte """
+    return pylontech.Pylontech._decode_frame(pylontech.Pylontech._decode_hw_frame(frame)).info[1:]
+
+
+def parsed_values(frame: bytes = US2000_3MODULES_VALUES):
+    """ What `Pylontech.get_values()` returns for the given get values reply """
+    return pylontech.Pylontech.get_values_fmt.parse(info_payload(frame))
+
+
+class ClockedStack:
+    """ get_values and get_values_single answered from a captured frame on a simulated clock, every request
+    taking its transfer time at 9600 bauds; while `flaky` is set, the broadcast and module 3 time out """
+    def __init__(self, frame: bytes = US2000_3MODULES_VALUES):
+        self.values = parsed_values(frame)
+        self.flaky = False
+        self.requests = []  # "all" for a broadcast, else the module address
+        self.now = 0.0
+
+    @property
+    def broadcasts(self) -> int:
+        return self.requests.count("all")
+
+    def clock(self):
+        return self.now
+
+    def expected_frame_time(self, info_length):
+        return (18 + 2 * info_length) * 10 / 9600
+
+    def get_values(self):
+        self.requests.append("all")
+        if self.flaky:
+            self.now += 2.0
+            raise pylontech.ReplyTimeout("module 3 garbled the frame")
+        self.now += self.expected_frame_time(2 + 53 * self.values.NumberOfModules)
+        return self.values
+
+    def get_values_single(self, dev_id):
+        self.requests.append(dev_id)
+        if self.flaky and dev_id == 3:
+            self.now += 2.0
+            raise pylontech.ReplyTimeout("no reply")
+        self.now += self.expected_frame_time(55)
+        return self.values.Module[dev_id - 2]
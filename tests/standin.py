@@ -0,0 +1,147 @@
+""" In-process stand-ins for an InfluxDB write endpoint and an MQTT broker.
+
+They only accept what `pylontech.sink` sends and keep it in memory, so the
+sink can be tested without network services. `delay` makes every request
+take that long, to exercise the backpressure.
+"""
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import List, Tuple
+
+
+class _HttpHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like InfluxDB
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server = self.server.standin
+        time.sleep(server.delay)
+        with server.lock:
+            server.bodies.append(body)
+            server.paths.append(self.path)
+        self.send_response(server.status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadingHttpServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StandInHttpServer:
+    def __init__(self, delay: float = 0.0, status: int = 204):
+        self.delay = delay
+        self.status = status
+        self.bodies = []  # type: List[bytes]
+        self.paths = []  # type: List[str]
+        self.lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return "http://%s:%d/api/v2/write?bucket=test&precision=ns" % (host, port)
+
+    def lines(self) -> List[bytes]:
+        with self.lock:
+            return b"".join(self.bodies).splitlines()
+
+    def start(self) -> "StandInHttpServer":
+        self._server = _ThreadingHttpServer(("127.0.0.1", 0), _HttpHandler)
+        self._server.standin = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name="standin-http", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def _read_exactly(rfile, n: int) -> bytes:
+    data = rfile.read(n)
+    if len(data) < n:
+        raise EOFError
+    return data
+
+
+class _MqttHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        broker = self.server.standin
+        try:
+            while True:
+                packet_type = _read_exactly(self.rfile, 1)[0] >> 4
+                length, shift = 0, 0
+                while True:
+                    byte = _read_exactly(self.rfile, 1)[0]
+                    length |= (byte & 0x7f) << shift
+                    shift += 7
+                    if not byte & 0x80:
+                        break
+                body = _read_exactly(self.rfile, length)
+                if packet_type == 1:  # CONNECT
+                    self.wfile.write(bytes([0x20, 2, 0, 0]))
+                elif packet_type == 3:  # PUBLISH, QoS 0: topic then payload
+                    time.sleep(broker.delay)
+                    topic_length = int.from_bytes(body[:2], "big")
+                    with broker.lock:
+                        broker.messages.append((body[2:2 + topic_length].decode(), body[2 + topic_length:]))
+                elif packet_type == 14:  # DISCONNECT
+                    return
+        except (EOFError, ConnectionError):
+            return
+
+
+class _ThreadingTcpServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class StandInMqttBroker:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.messages = []  # type: List[Tuple[str, bytes]]
+        self.lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._server.server_address[:2]
+
+    def lines(self) -> List[bytes]:
+        with self.lock:
+            return b"".join(payload for _, payload in self.messages).splitlines()
+
+    def start(self) -> "StandInMqttBroker":
+        self._server = _ThreadingTcpServer(("127.0.0.1", 0), _MqttHandler)
+        self._server.standin = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name="standin-mqtt", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
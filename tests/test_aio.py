@@ -0,0 +1,103 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from frames import US2000_3MODULES_VALUES, UP2500_MANAGEMENT_INFO
+
+from pylontech import AsyncPylontech, ChecksumError, ReplyTimeout
+from pylontech.simulator import BAD_CHECKSUM, SimulatedModule, StackSimulator
+
+
+def _serve(master: int, responses):
+    """ Answers every request written to the pty with the next canned response """
+    loop = asyncio.get_running_loop()
+    buf = bytearray()
+
+    def on_readable():
+        buf.extend(os.read(master, 4096))
+        while b'\r' in buf:
+            del buf[:buf.index(b'\r') + 1]
+            if responses:
+                os.write(master, responses.pop(0))
+
+    loop.add_reader(master, on_readable)
+
+
+def _open_pty():
+    master, slave = os.openpty()
+    return master, slave, os.ttyname(slave)
+
+
+def test_async_get_values_and_management_info():
+    master, slave, name = _open_pty()
+
+    async def run():
+        _serve(master, [US2000_3MODULES_VALUES, UP2500_MANAGEMENT_INFO])
+        async with AsyncPylontech(name) as p:
+            d = await p.get_values()
+            m = await p.get_management_info(2)
+        asyncio.get_running_loop().remove_reader(master)
+        return d, m
+
+    try:
+        d, m = asyncio.run(run())
+    finally:
+        os.close(master)
+        os.close(slave)
+
+    assert d.NumberOfModules == 3
+    assert d.StateOfCharge == pytest.approx(0.67)
+    assert m.ChargeVoltageLimit == 28.4
+
+
+def test_async_read_frame_timeout():
+    master, slave, name = _open_pty()
+
+    async def run():
+        async with AsyncPylontech(name, timeout=0.05) as p:
+            with pytest.raises(ReplyTimeout):
+                await p.get_values()
+
+    try:
+        asyncio.run(run())
+    finally:
+        os.close(master)
+        os.close(slave)
+
+
+def test_async_late_reply_is_not_taken_for_the_next_one():
+    modules = [SimulatedModule(current=10 * i) for i in range(3)]
+
+    async def run(sim):
+        async with AsyncPylontech(sim.port, timeout=0.1) as p:
+            sim.response_delay = 0.15
+            with pytest.raises(ReplyTimeout):
+                await p.get_values_single(2)
+            sim.response_delay = 0.0
+            p.timeout = 1.0
+            single = await p.get_values_single(3)  # module 2 answers meanwhile
+            return single, p.stale_replies
+
+    with StackSimulator(modules) as sim:
+        single, stale_replies = asyncio.run(run(sim))
+    assert (single.NumberOfModule, single.Current) == (3, 1.0)
+    assert stale_replies == 1
+
+
+def test_async_bad_checksum_fails_fast():
+    async def run(sim):
+        async with AsyncPylontech(sim.port, timeout=1.0) as p:
+            sim.inject(BAD_CHECKSUM)
+            start = time.monotonic()
+            with pytest.raises(ChecksumError):
+                await p.get_module_serial_number(3)
+            elapsed = time.monotonic() - start
+            p.timeout = 0.2
+            return elapsed, await p.scan_for_batteries(2, 5)
+
+    with StackSimulator([SimulatedModule() for _ in range(2)]) as sim:
+        elapsed, batteries = asyncio.run(run(sim))
+    assert elapsed < 0.5
+    assert batteries == {2: "PPTBH00000000002", 3: "PPTBH00000000003"}
@@ -0,0 +1,63 @@
+import pytest
+
+from frames import parsed_values
+
+from pylontech.analytics import Integrator, StackAnalytics, WindowedStats
+
+
+def test_windowed_stats_slide():
+    stats = WindowedStats(window=10)
+    for t, v in enumerate([5, 1, 4, 3, 2]):
+        stats.add(float(t), v)
+    assert (stats.min, stats.max, stats.mean, stats.count) == (1, 5, 3, 5)
+
+    stats.add(11.5, 3)  # t=0 and 1 leave the window
+    assert (stats.min, stats.max, stats.count) == (2, 4, 4)
+    assert stats.mean == pytest.approx(3)
+
+
+def test_integrator_splits_charge_and_discharge():
+    i = Integrator(window=3600, max_gap=3600)
+    i.add(0.0, 10.0)
+    i.add(360.0, 10.0)  # 1 Ah in
+    assert i.charged == pytest.approx(1.0)
+    i.add(720.0, -10.0)  # crosses zero halfway: 0.25 Ah in, 0.25 Ah out
+    assert i.charged == pytest.approx(1.25)
+    assert i.discharged == pytest.approx(0.25)
+    assert i.throughput == pytest.approx(1.5)
+
+    i.add(720.0 + 7200, -10.0)  # a two hours gap is not integrated
+    assert i.discharged == pytest.approx(0.25)
+
+    i.reset()
+    i.add(7920.0 + 360, -10.0)
+    assert (i.charged, i.discharged) == (0.0, pytest.approx(1.0))
+    assert i.window_discharged == pytest.approx(1.0)  # the first hour left the window
+
+    i.add(7920.0 + 360 + 3600, -10.0)
+    assert i.window_discharged == pytest.approx(10.0)
+    assert i.window_charged == pytest.approx(0.0)
+
+
+def test_stack_analytics():
+    values = parsed_values()
+    analytics = StackAnalytics(window=60)
+    for t in range(0, 121):
+        analytics.update(values, timestamp=float(t))
+
+    cells = values.Module[1].CellVoltages
+    module = analytics.modules[1]
+    assert module.cell_spread.last == pytest.approx(max(cells) - min(cells))
+    assert module.current.mean == pytest.approx(values.Module[1].Current)
+    assert module.energy.discharged == pytest.approx(-values.Module[1].Power * 120 / 3600)
+    assert module.energy.window_discharged == pytest.approx(-values.Module[1].Power * 60 / 3600)
+
+    stack = analytics.summary()["Stack"]
+    all_cells = [v for m in values.Module for v in m.CellVoltages]
+    assert stack["CellSpread"] == pytest.approx(max(all_cells) - min(all_cells))
+    assert stack["DischargedEnergy"] == pytest.approx(-values.TotalPower * 120 / 3600)
+    assert stack["DischargedAh"] == pytest.approx(-sum(m.Current for m in values.Module) * 120 / 3600)
+    assert stack["ChargedAh"] == 0
+
+    analytics.reset()
+    assert analytics.summary()["Module"][0]["AhThroughput"] == 0
@@ -13,10 +13,15 @@ class MockSerial(object):
     def __init__(self, responses: List[bytes]):
         self.responses = responses
 
-    def readline(self) -> bytes:
+    @property
+    def in_waiting(self) -> int:
+        return len(self.responses[0]) if self.responses else 0
+
+    def read(self, size=1) -> bytes:
         assert len(self.responses) > 0
-        reply = self.responses[0]
-        self.responses = self.responses[1:]
+        reply = self.responses[0][:size]
+        rest = self.responses[0][size:]
+        self.responses = ([rest] if rest else []) + self.responses[1:]
         return reply
 
     def write(self, data: bytes):
@@ -0,0 +1,58 @@
+import math
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from frames import GET_VALUES_FRAMES
+from test_basic import MockSerial, Pylontech
+
+from pylontech.batch import decode_values_batch
+
+
+def _expected(frame):
+    p = Pylontech([])
+    p.s = MockSerial([frame])
+    return p.get_values()
+
+
+def _check(batch, frames):
+    for t, frame in enumerate(frames):
+        e = _expected(frame)
+        assert batch.valid[t]
+        assert batch.number_of_modules[t] == e.NumberOfModules
+        assert batch.total_power[t] == pytest.approx(e.TotalPower)
+        assert batch.state_of_charge[t] == pytest.approx(e.StateOfCharge)
+        for i, m in enumerate(e.Module):
+            assert list(batch.cell_voltages[t, i, :m.NumberOfCells]) == m.CellVoltages
+            assert list(batch.grouped_cells_temperatures[t, i, :m.NumberOfTemperatures - 1]) == m.GroupedCellsTemperatures
+            assert batch.average_bms_temperature[t, i] == m.AverageBMSTemperature
+            assert batch.current[t, i] == m.Current
+            assert batch.voltage[t, i] == m.Voltage
+            assert batch.power[t, i] == m.Power
+            assert batch.remaining_capacity[t, i] == m.RemainingCapacity
+            assert batch.total_capacity[t, i] == m.TotalCapacity
+            assert batch.cycle_number[t, i] == m.CycleNumber
+        for i in range(e.NumberOfModules, batch.current.shape[1]):
+            assert math.isnan(batch.current[t, i])
+
+
+def test_batch_matches_get_values():
+    batch = decode_values_batch(GET_VALUES_FRAMES)
+    assert batch.cell_voltages.shape == (3, 4, 15)
+    _check(batch, GET_VALUES_FRAMES)
+
+
+def test_batch_marks_corrupt_frames():
+    frames = [GET_VALUES_FRAMES[0], GET_VALUES_FRAMES[0][:-3] + b"00\r", b""]
+    batch = decode_values_batch(frames)
+    assert list(batch.valid) == [True, False, False]
+    assert math.isnan(batch.total_power[1])
+
+
+def test_batch_process_pool():
+    frames = GET_VALUES_FRAMES * 4
+    batch = decode_values_batch(frames, processes=2, parallel_threshold=1)
+    assert len(batch) == len(frames)
+    _check(batch, frames)
+
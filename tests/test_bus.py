@@ -0,0 +1,49 @@
+import threading
+
+import pytest
+
+from frames import UP2500_MANAGEMENT_INFO, US2000_3MODULES_VALUES
+from test_basic import Pylontech
+
+from pylontech.bus import SharedPylontech
+
+
+def test_identical_requests_are_coalesced():
+    shared = SharedPylontech(Pylontech([US2000_3MODULES_VALUES]))
+    release = threading.Event()
+    started = threading.Event()
+
+    def hold_bus():
+        started.set()
+        release.wait(5)
+
+    blocker = threading.Thread(target=shared.bus.call, args=(hold_bus,))
+    blocker.start()
+    started.wait(5)
+
+    results = []
+    consumers = [threading.Thread(target=lambda: results.append(shared.get_values())) for _ in range(10)]
+    for t in consumers:
+        t.start()
+    while shared.bus.coalesced < 9:
+        threading.Event().wait(0.001)
+    release.set()
+    for t in consumers + [blocker]:
+        t.join(5)
+
+    assert len(results) == 10
+    assert all(r.StateOfCharge == pytest.approx(0.67) for r in results)
+    assert shared.bus.transactions == 2  # the blocker and a single get_values
+    shared.close()
+
+
+def test_requests_are_serialised_and_errors_propagate():
+    shared = SharedPylontech(Pylontech([UP2500_MANAGEMENT_INFO]))
+    assert shared.get_management_info(2).ChargeVoltageLimit == 28.4
+
+    with pytest.raises(AssertionError):
+        shared.get_values()  # MockSerial has no more responses
+
+    with pytest.raises(RuntimeError):
+        shared.send_cmd(2, 0x42, b'FF')
+    shared.close()
@@ -0,0 +1,103 @@
+import pytest
+
+from frames import UP2500_MANAGEMENT_INFO, UP2500_SINGLE_VALUES, US2000_3MODULES_VALUES
+from test_basic import MockSerial
+
+import pylontech
+from pylontech.capture import RX, RX_INVALID, TX, CaptureReader, CaptureWriter, RecordingSerial, ReplaySerial
+from pylontech.exceptions import ChecksumError
+
+
+def _record(path):
+    writer = CaptureWriter(path)
+    p = pylontech.Pylontech(RecordingSerial(MockSerial([US2000_3MODULES_VALUES, UP2500_MANAGEMENT_INFO]), writer))
+    values = p.get_values()
+    management = p.get_management_info(2)
+    writer.close()
+    return values, management
+
+
+def test_record_and_index(tmp_path):
+    path = tmp_path / "capture.bin"
+    _record(path)
+
+    with CaptureReader(path) as reader:
+        records = list(reader)
+        assert [(r.direction, r.address) for r in records] == [(TX, 2), (RX, 2), (TX, 2), (RX, 2)]
+        assert bytes(records[1].frame) == US2000_3MODULES_VALUES
+        assert records[0].cid2 == 0x42
+        assert records[0].timestamp <= records[1].timestamp
+
+        t = records[2].timestamp
+        assert [bytes(r.frame) for r in reader.between(t, t + 3600)][-1] == UP2500_MANAGEMENT_INFO
+        assert len(list(reader.for_address(2, RX))) == 2
+        assert list(reader.for_address(3)) == []
+        del records
+
+
+def test_replay_through_pylontech(tmp_path):
+    path = tmp_path / "capture.bin"
+    values, management = _record(path)
+
+    s = ReplaySerial(path)
+    p = pylontech.Pylontech(s)
+    assert p.get_values().TotalPower == values.TotalPower
+    assert p.get_management_info(2).ChargeVoltageLimit == management.ChargeVoltageLimit
+    assert p.read_raw_frame() == b''
+    s.close()
+
+
+def test_empty_capture(tmp_path):
+    path = tmp_path / "empty.bin"
+    CaptureWriter(path).close()
+    with CaptureReader(path) as reader:
+        assert len(reader) == 0
+        assert list(reader.for_address(2)) == []
+
+
+def test_replay_rx_only_capture(tmp_path):
+    path = tmp_path / "rx.bin"
+    with CaptureWriter(path) as writer:
+        writer.write(RX, UP2500_SINGLE_VALUES)
+
+    s = ReplaySerial(path)
+    assert pylontech.Pylontech(s).get_values_single(2).NumberOfCells == 8
+    s.close()
+
+
+class ClosableMockSerial(MockSerial):
+    def close(self):
+        pass
+
+
+def test_record_invalid_bytes_and_replay_them(tmp_path):
+    path = tmp_path / "noisy.bin"
+    corrupt = UP2500_SINGLE_VALUES[:-2] + (b"0" if UP2500_SINGLE_VALUES[-2:-1] != b"0" else b"1") + b"\r"
+    s = RecordingSerial(ClosableMockSerial([b"\x00\xff" + corrupt, UP2500_SINGLE_VALUES, b"~2002"]), CaptureWriter(path))
+    p = pylontech.Pylontech(s)
+    with pytest.raises(ChecksumError):
+        p.get_values_single(2)
+    assert p.get_values_single(2).NumberOfCells == 8
+    s.read(5)
+    s.close()
+
+    with CaptureReader(path) as reader:
+        records = [(r.direction, bytes(r.frame)) for r in reader if r.direction != TX]
+    assert records == [(RX_INVALID, b"\x00\xff"), (RX_INVALID, corrupt), (RX, UP2500_SINGLE_VALUES),
+                       (RX_INVALID, b"~2002")]
+
+    s = ReplaySerial(path)
+    p = pylontech.Pylontech(s)
+    with pytest.raises(ChecksumError):
+        p.get_values_single(2)
+    assert p.get_values_single(2).NumberOfCells == 8
+    s.close()
+
+
+def test_recording_forwards_the_timeout(tmp_path):
+    port = MockSerial([])
+    port.timeout = 2
+    s = RecordingSerial(port, CaptureWriter(tmp_path / "capture.bin"))
+    s.timeout = 0.1
+    assert port.timeout == 0.1
+    s.writer.close()
@@ -0,0 +1,31 @@
+from frames import UP2500_MANAGEMENT_INFO
+
+from pylontech import codec
+
+
+def test_frame_checksum():
+    frame = UP2500_MANAGEMENT_INFO[1:-5]
+    assert codec.frame_checksum(frame) == 0xF915
+    assert codec.frame_checksum(memoryview(frame)) == 0xF915
+    assert codec.frame_checksum(b"") == 0x10000  # same as the historical implementation
+
+
+def test_encode_cmd_is_cached():
+    frame = codec.encode_cmd(2, 0x42, b'FF')
+    assert frame == b"~20024642E002FFFD09\r"
+    assert codec.encode_cmd(2, 0x42, b'FF') is frame
+
+
+def test_decode_frame():
+    f = codec.decode_frame(UP2500_MANAGEMENT_INFO[1:-5])
+    assert f.ver == b"\x20"
+    assert f.adr == b"\x02"
+    assert f.cid1 == b"\x46"
+    assert f.cid2 == b"\x00"
+    assert f.infolength == b"\xB0\x14"
+    assert f.info == bytes.fromhex("026EF05AA0022BFDD5C0")
+
+
+def test_length_field_roundtrip():
+    for lenid in range(0x1000):
+        assert codec.info_length(codec.length_field(lenid)) == lenid
@@ -0,0 +1,57 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+import pylontech
+from pylontech import cli
+from pylontech.daemon import PylontechDaemon
+from pylontech.simulator import SimulatedModule, StackSimulator
+
+
+@pytest.fixture
+def sim():
+    with StackSimulator([SimulatedModule(), SimulatedModule(cells=16)]) as sim:
+        yield sim
+
+
+def test_daemon_serves_cached_replies(sim, tmp_path):
+    path = str(tmp_path / "pylontech.sock")
+    p = pylontech.Pylontech(sim.port)
+    with PylontechDaemon(p, path, cache_ttl=60):
+        values = cli.query(path, "get_values")
+        assert values["NumberOfModules"] == 2
+        assert [m["NumberOfCells"] for m in values["Module"]] == [15, 16]
+        assert cli.query(path, "get_values") == values
+        assert sim.requests == 1
+
+        assert cli.query(path, "get_management_info", [3])["status"]["ChargeEnable"] is True
+        assert cli.query(path, "get_module_serial_number", [2])["ModuleSerialNumber"] == "PPTBH00000000002"
+
+        with pytest.raises(cli.DaemonError) as e:
+            cli.query(path, "send_cmd", [2])
+        assert e.value.error == "ValueError"
+
+        with pytest.raises(RuntimeError):
+            PylontechDaemon(p, path).start()
+    p.s.close()
+
+
+def test_cli_falls_back_to_the_port(sim, tmp_path, capsys):
+    code = cli.main(["--socket", str(tmp_path / "none.sock"), "--port", sim.port, "get_values_single", "3"])
+    assert code == 0
+    assert json.loads(capsys.readouterr().out)["NumberOfCells"] == 16
+
+    code = cli.main(["--socket", str(tmp_path / "none.sock"), "--port", sim.port, "get_management_info", "3"])
+    assert code == 0
+    assert json.loads(capsys.readouterr().out)["status"]["ChargeEnable"] is True  # nothing else on stdout
+
+    code = cli.main(["--socket", str(tmp_path / "none.sock"), "get_values", "--no-fallback"])
+    assert code == 1
+
+
+def test_client_does_not_import_construct():
+    out = subprocess.check_output([sys.executable, "-c", "import sys, pylontech.cli; "
+                                   "print(sorted(m for m in ('construct', 'serial') if m in sys.modules))"])
+    assert out.strip() == b"[]"
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from frames import UP2500_SINGLE_VALUES, parsed_values
+from test_basic import Pylontech
+
+from pylontech.delta import DeltaDecoder, DeltaEncoder, SequenceGap, flatten
+
+
+def test_keyframe_then_deltas_rebuild_state():
+    encoder = DeltaEncoder(keyframe_interval=3)
+    decoder = DeltaDecoder()
+    values = parsed_values()
+
+    key = encoder.encode(values)
+    assert key["type"] == "key"
+    decoder.apply(json.loads(json.dumps(key)))
+
+    values.Module[1].CellVoltages[4] += 0.0005  # within the 1 mV deadband
+    values.Module[2].CellVoltages[0] += 0.002
+    delta = encoder.encode(values)
+    assert delta["type"] == "delta"
+    assert len(delta["changes"]) == 1
+    state = decoder.apply(delta)
+    assert state["Module.2.CellVoltages.0"] == values.Module[2].CellVoltages[0]
+    assert state["Module.1.CellVoltages.4"] == pytest.approx(values.Module[1].CellVoltages[4], abs=0.001)
+
+    assert encoder.encode(values)["changes"] == []
+    assert encoder.encode(values)["type"] == "key"
+
+    nested = decoder.nested()
+    assert len(nested["Module"]) == 3
+    assert nested["Module"][0]["CellVoltages"] == list(values.Module[0].CellVoltages)
+
+
+def test_layout_change_forces_keyframe():
+    encoder = DeltaEncoder()
+    encoder.encode(parsed_values())
+    single = Pylontech([UP2500_SINGLE_VALUES]).get_values_single(2)
+    message = encoder.encode(single)
+    assert message["type"] == "key"
+    assert message["values"] == flatten(single)
+    assert "CellVoltages.7" in message["layout"]
+
+
+def test_lost_delta_needs_keyframe():
+    encoder = DeltaEncoder()
+    decoder = DeltaDecoder()
+    values = parsed_values()
+    decoder.apply(encoder.encode(values))
+    encoder.encode(values)
+    with pytest.raises(SequenceGap):
+        decoder.apply(encoder.encode(values))
+
+    encoder.keyframe()
+    decoder.apply(encoder.encode(values))
+    assert decoder.state()["TotalPower"] == values.TotalPower
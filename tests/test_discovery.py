@@ -0,0 +1,94 @@
+from pytest import approx
+
+import pylontech
+from pylontech.simulator import SimulatedModule, StackSimulator
+
+
+def serial_number_reply(adr: int, sn: str) -> bytes:
+    info = ("{:02X}".format(adr) + sn.encode().hex().upper()).encode()
+    return pylontech.Pylontech._encode_cmd(adr, 0x00, info)
+
+
+class StackSerial(object):
+    """ Answers 0x93 probes for the given address to serial number map """
+    def __init__(self, batteries):
+        self.batteries = batteries
+        self.baudrate = 115200
+        self.timeout = 2
+        self.probed = []
+        self.reply = b''
+
+    def write(self, data: bytes):
+        adr = int(data[3:5], 16)
+        self.probed.append(adr)
+        self.reply = serial_number_reply(adr, self.batteries[adr]) if adr in self.batteries else b''
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self.reply)
+
+    def read(self, size=1) -> bytes:
+        data, self.reply = self.reply[:size], self.reply[size:]
+        return data
+
+
+class Pylontech(pylontech.Pylontech):
+    def __init__(self, batteries):
+        self.s = StackSerial(batteries)
+
+
+STACK = {2: "PPTBH02400000001", 3: "PPTBH02400000002", 4: "PPTBH02400000003"}
+
+
+def test_scan_reuses_probe_reply():
+    p = Pylontech(STACK)
+    assert p.scan_for_batteries(0, 8) == STACK
+    assert p.s.probed == list(range(0, 8))
+
+
+def test_discover_stops_after_gap_and_restores_timeout():
+    p = Pylontech(STACK)
+    assert p.discover_batteries(max_missing=2) == STACK
+    assert p.s.probed == [2, 3, 4, 5, 6]
+    assert p.s.timeout == 2
+
+
+def test_discover_probe_timeout_follows_baudrate():
+    p = Pylontech(STACK)
+    fast = p.expected_frame_time(17)
+    p.s.baudrate = 9600
+    assert p.expected_frame_time(17) == approx(fast * 12)
+    assert p.expected_frame_time(17) == 52 * 10 / 9600
+
+
+def test_discover_uses_topology_cache(tmp_path):
+    cache = tmp_path / "topology.json"
+
+    p = Pylontech(STACK)
+    assert p.discover_batteries(cache_file=cache) == STACK
+
+    p = Pylontech(STACK)
+    assert p.discover_batteries(cache_file=cache) == STACK
+    assert p.s.probed == [2, 3, 4]
+
+    changed = dict(STACK)
+    changed[4] = "PPTBH02400000009"
+    p = Pylontech(changed)
+    assert p.discover_batteries(cache_file=cache) == changed
+    assert Pylontech._load_topology(cache) == changed
+
+
+def test_late_probe_replies_are_not_cached(tmp_path):
+    cache = tmp_path / "topology.json"
+    with StackSimulator([SimulatedModule() for _ in range(3)], response_delay=0.13) as sim:
+        p = pylontech.Pylontech(sim.port)
+        batteries = p.discover_batteries(end=8, max_missing=3, cache_file=cache)
+        assert all(sn == "PPTBH%011d" % adr for adr, sn in batteries.items())
+        assert p.stale_replies > 0
+        assert not cache.exists()
+
+        assert p.discover_batteries(end=8, max_missing=3, probe_margin=0.3, cache_file=cache) == {
+            2: "PPTBH00000000002", 3: "PPTBH00000000003", 4: "PPTBH00000000004"}
+        assert Pylontech._load_topology(cache) == {2: "PPTBH00000000002", 3: "PPTBH00000000003",
+                                                   4: "PPTBH00000000004"}
+        p.s.close()
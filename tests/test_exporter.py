@@ -0,0 +1,50 @@
+import urllib.request
+
+from frames import US3000_4MODULES_VALUES, parsed_values
+
+from pylontech.exporter import MetricsExporter, serve
+
+
+def test_exposition_text():
+    exporter = MetricsExporter(labels={"stack": "garage"})
+    exporter.update(parsed_values())
+    text = exporter.render().decode()
+
+    assert '# TYPE pylontech_cell_voltage_volts gauge\n' in text
+    assert 'pylontech_cell_voltage_volts{stack="garage",module="1",cell="1"} 3.303\n' in text
+    assert 'pylontech_module_temperature_celsius{stack="garage",module="3",sensor="bms"} 23.0\n' in text
+    assert 'pylontech_module_cycle_count{stack="garage",module="2"} 31\n' in text
+    assert text.count("\npylontech_cell_voltage_volts{") == 45
+
+
+def test_only_changed_values_are_rewritten():
+    exporter = MetricsExporter()
+    values = parsed_values()
+    exporter.update(values)
+    parts = exporter._parts
+    rendered = exporter.render()
+
+    exporter.update(values)
+    assert exporter.render() is rendered
+
+    values.Module[0].CellVoltages[0] = 3.5
+    exporter.update(values)
+    assert exporter._parts is parts
+    assert b'pylontech_cell_voltage_volts{module="1",cell="1"} 3.5\n' in exporter.render()
+
+    exporter.update(parsed_values(US3000_4MODULES_VALUES))  # new stack shape: labels rebuilt
+    assert exporter._parts is not parts
+    assert b'pylontech_module_cycle_count{module="4"}' in exporter.render()
+
+
+def test_http_scrape():
+    exporter = MetricsExporter()
+    exporter.update(parsed_values())
+    server = serve(exporter, port=0, address="127.0.0.1")
+    try:
+        url = "http://127.0.0.1:%d/metrics" % server.server_address[1]
+        with urllib.request.urlopen(url) as r:
+            assert r.read() == exporter.render()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,79 @@
+import pytest
+
+from frames import GET_VALUES_FRAMES, UP2500_SINGLE_VALUES, info_payload
+from test_basic import Pylontech
+
+from pylontech.fastdecode import decode_values, decode_values_lazy, decode_values_single
+
+
+MODULE_FIELDS = [
+    "NumberOfCells",
+    "CellVoltages",
+    "NumberOfTemperatures",
+    "AverageBMSTemperature",
+    "GroupedCellsTemperatures",
+    "Current",
+    "Voltage",
+    "Power",
+    "CycleNumber",
+    "RemainingCapacity",
+    "TotalCapacity",
+]
+
+
+@pytest.mark.parametrize("frame", GET_VALUES_FRAMES)
+def test_decode_values_matches_construct(frame):
+    info = info_payload(frame)
+    expected = Pylontech.get_values_fmt.parse(info)
+    got = decode_values(info)
+
+    assert got.NumberOfModules == expected.NumberOfModules
+    assert got.TotalPower == expected.TotalPower
+    assert got.StateOfCharge == expected.StateOfCharge
+    for m, e in zip(got.Module, expected.Module):
+        for field in MODULE_FIELDS:
+            assert m[field] == e[field], field
+
+
+def test_decode_values_single_matches_construct():
+    info = info_payload(UP2500_SINGLE_VALUES)
+    expected = Pylontech.get_values_single_fmt.parse(info)
+    got = decode_values_single(info)
+
+    for field in MODULE_FIELDS + ["NumberOfModule", "TotalPower", "StateOfCharge"]:
+        assert got[field] == expected[field], field
+
+
+def test_fast_decode_mode():
+    p = Pylontech(list(GET_VALUES_FRAMES))
+    p.fast_decode = True
+    d = p.get_values()
+    assert d.NumberOfModules == 3
+    assert d.Module[0].CycleNumber == 31
+    assert d.StateOfCharge == pytest.approx(0.67)
+
+
+@pytest.mark.parametrize("frame", GET_VALUES_FRAMES)
+def test_lazy_values_match_construct(frame):
+    info = info_payload(frame)
+    expected = Pylontech.get_values_fmt.parse(info)
+    got = decode_values_lazy(info)
+
+    assert got.NumberOfModules == expected.NumberOfModules
+    assert got.TotalPower == pytest.approx(expected.TotalPower)
+    assert got.StateOfCharge == pytest.approx(expected.StateOfCharge)
+    for m, e in zip(got.Module, expected.Module):
+        for field in MODULE_FIELDS:
+            assert m[field] == e[field], field
+
+
+def test_lazy_aggregates_do_not_decode_cells():
+    p = Pylontech(list(GET_VALUES_FRAMES))
+    p.lazy_decode = True
+    d = p.get_values()
+    assert d.StateOfCharge == pytest.approx(0.67)
+    assert d._modules is None
+    assert d.Module[2]._cells is None
+    cells = d.Module[2].CellVoltages
+    assert d.Module[2]._cells is cells
+    assert "TotalCapacity" in d.Module[0]
@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+
+from frames import MIXED_US3000_US2000_VALUES, US2000_3MODULES_VALUES
+from test_basic import Pylontech
+
+from pylontech.fleet import FleetManager
+
+
+class SlowPylontech(Pylontech):
+    def __init__(self, responses, delay):
+        super().__init__(responses)
+        self.delay = delay
+
+    def get_values(self):
+        time.sleep(self.delay)
+        return super().get_values()
+
+
+class StuckPylontech(Pylontech):
+    def __init__(self):
+        super().__init__([])
+        self.release = threading.Event()
+
+    def get_values(self):
+        self.release.wait(5)
+        raise TimeoutError("no answer")
+
+
+def test_refresh_in_parallel_with_fleet_totals():
+    fleet = FleetManager({
+        "a": SlowPylontech([US2000_3MODULES_VALUES], 0.2),
+        "b": SlowPylontech([MIXED_US3000_US2000_VALUES], 0.2),
+    })
+    start = time.monotonic()
+    snapshot = fleet.refresh()
+    assert time.monotonic() - start < 0.38
+
+    a, b = snapshot["a"].values, snapshot["b"].values
+    assert snapshot.NumberOfModules == 5
+    assert snapshot.StaleStacks == []
+    assert snapshot.TotalPower == pytest.approx(a.TotalPower + b.TotalPower)
+    assert snapshot.StateOfCharge == pytest.approx((3 * 33.5 + 32.56 + 24.5) / (3 * 50 + 74 + 50))
+    fleet.close()
+
+
+def test_stuck_bus_does_not_stall_others():
+    stuck = StuckPylontech()
+    fleet = FleetManager({"ok": Pylontech([US2000_3MODULES_VALUES, US2000_3MODULES_VALUES]), "stuck": stuck})
+
+    snapshot = fleet.refresh(timeout=0.1)
+    assert snapshot["stuck"].stale
+    assert snapshot["ok"].values.NumberOfModules == 3
+    assert snapshot.StateOfCharge == pytest.approx(0.67)
+
+    snapshot = fleet.refresh(timeout=0.1)  # the stuck poll is not queued a second time
+    assert snapshot["stuck"].stale
+    assert not snapshot["ok"].stale
+
+    stuck.release.set()
+    fleet.close()
+
+
+def test_stale_stacks_are_left_out_of_the_totals():
+    fleet = FleetManager({"a": Pylontech([US2000_3MODULES_VALUES, US2000_3MODULES_VALUES]),
+                          "b": Pylontech([MIXED_US3000_US2000_VALUES, b""])})
+    assert fleet.refresh().NumberOfModules == 5
+
+    snapshot = fleet.refresh()
+    assert snapshot["b"].stale and snapshot["b"].values.NumberOfModules == 2  # last known values
+    assert snapshot.StaleStacks == ["b"]
+    assert snapshot.NumberOfModules == 3
+    assert snapshot.TotalPower == pytest.approx(snapshot["a"].values.TotalPower)
+    assert snapshot.StateOfCharge == pytest.approx(0.67)
+    fleet.close()
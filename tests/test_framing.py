@@ -0,0 +1,57 @@
+from frames import US2000_3MODULES_VALUES, UP2500_MANAGEMENT_INFO, UP2500_SINGLE_VALUES
+from test_basic import MockSerial, Pylontech
+
+from pylontech.framing import FrameReader, info_length
+
+
+def test_info_length_checks_lchksum():
+    assert info_length(0xD05E) == 0x05E
+    assert info_length(0xE05E) is None
+    assert info_length(0x0000) == 0
+
+
+def test_frames_split_across_reads():
+    framer = FrameReader()
+    data = UP2500_MANAGEMENT_INFO + UP2500_SINGLE_VALUES
+    for i in range(0, len(data), 7):
+        framer.feed(data[i:i + 7])
+    assert list(framer) == [UP2500_MANAGEMENT_INFO, UP2500_SINGLE_VALUES]
+    assert framer.dropped_bytes == 0
+
+
+def test_resync_after_garbage_and_truncated_frame():
+    framer = FrameReader()
+    framer.feed(b"\x00\xff noise~20" + UP2500_SINGLE_VALUES[:40] + b"\r" + UP2500_MANAGEMENT_INFO)
+    assert list(framer) == [UP2500_MANAGEMENT_INFO]
+    assert framer.dropped_bytes > 0
+
+
+def test_bad_checksum_is_dropped():
+    broken = UP2500_MANAGEMENT_INFO[:-3] + b"00\r"
+    framer = FrameReader()
+    framer.feed(broken + UP2500_MANAGEMENT_INFO)
+    assert list(framer) == [UP2500_MANAGEMENT_INFO]
+    assert framer.bad_frames == 1
+
+
+def test_wanted_uses_lenid():
+    framer = FrameReader()
+    assert framer.wanted() == 13
+    framer.feed(US2000_3MODULES_VALUES[:13])
+    assert framer.wanted() == len(US2000_3MODULES_VALUES) - 13
+
+
+def test_read_frame_skips_noise_and_reads_in_bulk():
+    p = Pylontech([])
+    p.s = MockSerial([b"\x13\x37garbage", US2000_3MODULES_VALUES])
+    reads = []
+    read = p.s.read
+
+    def counting_read(size=1):
+        data = read(size)
+        reads.append(len(data))
+        return data
+
+    p.s.read = counting_read
+    assert p.get_values().NumberOfModules == 3
+    assert len(reads) <= 4
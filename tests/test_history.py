@@ -0,0 +1,64 @@
+import math
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from frames import GET_VALUES_FRAMES, MIXED_US3000_US2000_VALUES, US2000_3MODULES_VALUES, info_payload, parsed_values
+from test_basic import Pylontech
+
+from pylontech.history import MODULE_FIELDS, SnapshotBuffer
+
+
+@pytest.mark.parametrize("frame", GET_VALUES_FRAMES)
+def test_append_info_matches_construct(frame):
+    info = info_payload(frame)
+    expected = Pylontech.get_values_fmt.parse(info)
+    buf = SnapshotBuffer(capacity=4, modules=6)
+    buf.append_info(info, 1.0)
+
+    assert buf.last(1, "NumberOfModules")[0] == expected.NumberOfModules
+    assert buf.last(1, "TotalPower")[0] == pytest.approx(expected.TotalPower)
+    assert buf.last(1, "StateOfCharge")[0] == pytest.approx(expected.StateOfCharge)
+    cells = buf.last(1, "CellVoltages")[0]
+    temps = buf.last(1, "GroupedCellsTemperatures")[0]
+    for i, m in enumerate(expected.Module):
+        for field in MODULE_FIELDS:
+            assert buf.last(1, field)[0, i] == m[field], field
+        assert list(cells[i, :m.NumberOfCells]) == list(m.CellVoltages)
+        assert all(math.isnan(v) for v in cells[i, m.NumberOfCells:])
+        assert list(temps[i, :len(m.GroupedCellsTemperatures)]) == list(m.GroupedCellsTemperatures)
+    assert all(math.isnan(v) for v in buf.last(1, "Voltage")[0, expected.NumberOfModules:])
+
+
+def test_ring_wraps_with_contiguous_views():
+    buf = SnapshotBuffer(capacity=5, modules=3)
+    info = info_payload(US2000_3MODULES_VALUES)
+    assert len(buf.last()) == 0
+    for t in range(8):
+        buf.append_info(info, float(t))
+    assert len(buf) == 5
+    assert list(buf.last()) == [3.0, 4.0, 5.0, 6.0, 7.0]
+    assert list(buf.last(2)) == [6.0, 7.0]
+
+    cells = buf.last(3, "CellVoltages")
+    assert cells.shape == (3, 3, 16)
+    assert np.shares_memory(cells, buf.data)
+    assert buf.last(3, "Current").base is not None
+
+
+def test_append_decoded_values_and_layout_change():
+    buf = SnapshotBuffer(capacity=3, modules=4)
+    values = parsed_values()
+    buf.append(values, 1.0)
+    buf.append_info(info_payload(MIXED_US3000_US2000_VALUES), 2.0)
+    buf.append_info(info_payload(US2000_3MODULES_VALUES), 3.0)
+
+    current = buf.last(None, "Current")
+    assert list(current[0, :3]) == [m.Current for m in values.Module]
+    assert list(current[2, :3]) == list(current[0, :3])
+    assert buf.last(None, "TotalPower")[0] == pytest.approx(values.TotalPower)
+    assert len(buf._plans) == 2
+
+    with pytest.raises(ValueError):
+        SnapshotBuffer(modules=2).append_info(info_payload(US2000_3MODULES_VALUES), 0.0)
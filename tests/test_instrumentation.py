@@ -0,0 +1,81 @@
+import time
+
+import pytest
+
+from frames import UP2500_MANAGEMENT_INFO, US2000_3MODULES_VALUES
+import test_discovery
+from test_basic import Pylontech
+
+from pylontech.instrumentation import BusMetrics, Histogram
+
+
+def test_bus_metrics_hook():
+    broken = UP2500_MANAGEMENT_INFO[:-3] + b"00\r"
+    p = Pylontech([US2000_3MODULES_VALUES, b"xx" + broken + UP2500_MANAGEMENT_INFO])
+    metrics = BusMetrics()
+    p.add_hook(metrics)
+
+    p.get_values()
+    p.get_management_info(2)
+
+    assert metrics.commands == 2
+    assert metrics.tx_bytes == 2 * 20
+    assert metrics.rx_bytes == len(US2000_3MODULES_VALUES) + len(UP2500_MANAGEMENT_INFO)
+    assert metrics.checksum_errors == 1
+    assert metrics.dropped_bytes == 2
+    assert metrics.latency_by_command[0x42].count == 1
+    assert metrics.latency_by_address[2].count == 2
+    assert metrics.timeouts == 0
+
+
+def test_timeout_is_counted_and_raised():
+    p = Pylontech([b""])
+    metrics = BusMetrics()
+    p.add_hook(metrics)
+    with pytest.raises(ValueError):
+        p.get_values()
+    assert metrics.timeouts == 1
+
+    p.remove_hook(metrics)
+    assert p.hooks == ()
+
+
+class Recorder:
+    def __init__(self):
+        self.stats = []
+
+    def on_command(self, stats):
+        self.stats.append(stats)
+
+
+def test_decode_time_covers_the_payload_parse(monkeypatch):
+    p = Pylontech([US2000_3MODULES_VALUES])
+    recorder = Recorder()
+    p.add_hook(recorder)
+    parse = p.get_values_fmt.parse
+
+    def slow_parse(data):
+        time.sleep(0.05)
+        return parse(data)
+
+    monkeypatch.setattr(p.get_values_fmt, "parse", slow_parse)
+    assert p.get_values().NumberOfModules == 3
+    assert recorder.stats[0].decode_time >= 0.05
+
+
+def test_probes_go_through_the_hooks():
+    p = test_discovery.Pylontech(test_discovery.STACK)
+    recorder = Recorder()
+    p.add_hook(recorder)
+    assert p.scan_for_batteries(1, 4) == {2: test_discovery.STACK[2], 3: test_discovery.STACK[3]}
+    assert [(s.address, s.cid2, s.timeout) for s in recorder.stats] == [(1, 0x93, True), (2, 0x93, False),
+                                                                      (3, 0x93, False)]
+
+
+def test_histogram_quantile():
+    h = Histogram((0.1, 1.0))
+    for v in (0.05, 0.05, 0.5, 3.0):
+        h.observe(v)
+    assert h.counts == [2, 1, 1]
+    assert h.quantile(0.5) == 0.1
+    assert h.quantile(1.0) == float("inf")
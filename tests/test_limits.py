@@ -0,0 +1,95 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from frames import US3000_4MODULES_VALUES, parsed_values
+
+from pylontech.limits import LimitChecker
+
+PARAMETERS = {
+    "CellHighVoltageLimit": 3.7,
+    "CellLowVoltageLimit": 3.05,
+    "CellUnderVoltageLimit": 2.9,
+    "ChargeHighTemperatureLimit": 61.0,
+    "ChargeLowTemperatureLimit": 0.0,
+    "ChargeCurrentLimit": 10.2,
+    "ModuleHighVoltageLimit": 54.0,
+    "ModuleLowVoltageLimit": 46.0,
+    "ModuleUnderVoltageLimit": 44.5,
+    "DischargeHighTemperatureLimit": 61.0,
+    "DischargeLowTemperatureLimit": 0.0,
+    "DischargeCurrentLimit": -10.0,
+}
+
+
+def _describe(events):
+    return [(e.limit, e.module, e.index, e.raised) for e in events]
+
+
+def test_edge_triggered_with_hysteresis():
+    checker = LimitChecker(PARAMETERS)
+    values = parsed_values()
+    assert checker.check(values) == []
+
+    values.Module[1].CellVoltages[4] = 3.8
+    events = checker.check(values, timestamp=12.0)
+    assert _describe(events) == [("CellHighVoltageLimit", 1, 4, True)]
+    assert events[0].value == pytest.approx(3.8)
+    assert events[0].timestamp == 12.0
+    assert checker.check(values) == []
+
+    values.Module[1].CellVoltages[4] = 3.68  # below the limit but within the hysteresis
+    assert checker.check(values) == []
+    assert checker.active_alarms() == [("CellHighVoltageLimit", 1, 4)]
+
+    values.Module[1].CellVoltages[4] = 3.6
+    assert _describe(checker.check(values)) == [("CellHighVoltageLimit", 1, 4, False)]
+    assert checker.active_alarms() == []
+
+
+def test_temperature_limits_follow_current_direction():
+    checker = LimitChecker(PARAMETERS)
+    values = parsed_values()
+    assert values.Module[0].Current < 0
+    values.Module[0].GroupedCellsTemperatures[2] = 70.0
+    assert _describe(checker.check(values)) == [("DischargeHighTemperatureLimit", 0, 2, True)]
+
+    values.Module[0].Current = 12.0
+    assert _describe(checker.check(values)) == [
+        ("ChargeHighTemperatureLimit", 0, 2, True),
+        ("DischargeHighTemperatureLimit", 0, 2, False),
+        ("ChargeCurrentLimit", 0, None, True),
+    ]
+
+
+def test_average_bms_temperature_is_checked():
+    checker = LimitChecker(PARAMETERS)
+    values = parsed_values()
+    values.Module[2].AverageBMSTemperature = 65.0
+    events = checker.check(values)
+    assert _describe(events) == [("DischargeHighTemperatureLimit", 2, None, True)]
+    assert events[0].value == pytest.approx(65.0)
+
+    values.Module[2].AverageBMSTemperature = 30.0
+    assert _describe(checker.check(values)) == [("DischargeHighTemperatureLimit", 2, None, False)]
+
+
+def test_parameters_and_layout_changes(caplog):
+    checker = LimitChecker()
+    with pytest.raises(ValueError):
+        checker.check(parsed_values())
+
+    values = parsed_values(US3000_4MODULES_VALUES)
+    assert checker.check(values, PARAMETERS) == []
+    assert not checker.set_parameters(dict(PARAMETERS))
+
+    lower = dict(PARAMETERS, ModuleHighVoltageLimit=40.0)
+    assert checker.set_parameters(lower)
+    events = checker.check(values)
+    assert {(e.limit, e.raised) for e in events} == {("ModuleHighVoltageLimit", True)}
+    assert [e.module for e in events] == [0, 1, 2, 3]
+
+    with caplog.at_level("WARNING", logger="pylontech.limits"):
+        assert checker.check(parsed_values(), lower)[0].limit == "ModuleHighVoltageLimit"
+    assert "4 active alarms dropped" in caplog.text
+    assert "('ModuleHighVoltageLimit', 3, None)" in caplog.text
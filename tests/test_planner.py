@@ -0,0 +1,75 @@
+import pytest
+
+from frames import US2000_3MODULES_VALUES, US3000_4MODULES_VALUES, ClockedStack
+
+import pylontech
+from pylontech.exceptions import ReplyTimeout
+from pylontech.planner import BROADCAST, SINGLE, PollPlanner
+from pylontech.simulator import SimulatedModule, StackSimulator
+
+
+def test_combined_structure_and_fallback():
+    stack = ClockedStack(US3000_4MODULES_VALUES)
+    planner = PollPlanner(stack, explore_interval=0, clock=stack.clock)
+
+    d = planner.poll()
+    assert d.Strategy == BROADCAST
+    assert d.Addresses == [2, 3, 4, 5]
+    assert d.TotalPower == pytest.approx(stack.values.TotalPower)
+    assert d.StateOfCharge == pytest.approx(stack.values.StateOfCharge)
+
+    stack.flaky = True
+    d = planner.poll([2, 3, 4, 5])
+    assert d.Strategy == SINGLE
+    assert d.Addresses == [2, 4, 5]
+    assert d.Missing == [3]
+    assert d.NumberOfModules == 3
+    m = stack.values.Module
+    assert d.StateOfCharge == pytest.approx(sum(m[i].RemainingCapacity for i in (0, 2, 3)) /
+                                            sum(m[i].TotalCapacity for i in (0, 2, 3)))
+
+    # Module 3 fails both ways: a few more broadcasts are tried while the estimates converge, then no more
+    # 2 s broadcast timeouts
+    strategies = [planner.poll().Strategy for _ in range(20)]
+    assert strategies[-10:] == [SINGLE] * 10
+    assert stack.broadcasts <= 5
+    assert planner.broadcast.error_rate > 0
+
+
+def test_failing_module_queries_count_in_their_cost():
+    stack = ClockedStack(US3000_4MODULES_VALUES)
+    planner = PollPlanner(stack, explore_interval=0, clock=stack.clock)
+    planner.poll()
+    assert planner.plan([3]) == SINGLE
+
+    def no_single_reply(dev_id):
+        stack.now += 2.0
+        raise ReplyTimeout("no reply")
+    stack.get_values_single = no_single_reply
+    with pytest.raises(ValueError):
+        planner.poll([3])
+    assert planner.single_cost(3) > planner.single_cost(2) + 0.3  # 20% chance of losing 2 s
+    assert [planner.poll([3]).Strategy for _ in range(5)] == [BROADCAST] * 5
+
+
+def test_plan_follows_measured_costs():
+    with StackSimulator([SimulatedModule() for _ in range(6)], baudrate=19200, response_delay=0.005) as sim:
+        p = pylontech.Pylontech(sim.port, baudrate=19200)
+        planner = PollPlanner(p, explore_interval=0)
+        assert planner.poll().NumberOfModules == 6
+        assert planner.plan([3]) == SINGLE
+        assert planner.plan(range(2, 8)) == BROADCAST
+
+        d = planner.poll([3, 6])
+        assert d.Strategy == SINGLE
+        assert [m.NumberOfCells for m in d.Module] == [15, 15]
+        assert planner.single[3].cost < planner.broadcast.cost
+        p.s.close()
+
+
+def test_exploration_refreshes_the_other_estimate():
+    stack = ClockedStack(US2000_3MODULES_VALUES)
+    planner = PollPlanner(stack, explore_interval=4, clock=stack.clock)
+    strategies = [planner.poll([2]).Strategy for _ in range(8)]
+    assert strategies == [BROADCAST, SINGLE, SINGLE, BROADCAST, SINGLE, SINGLE, SINGLE, BROADCAST]
+    assert planner.broadcast.samples == 3
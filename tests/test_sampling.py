@@ -0,0 +1,88 @@
+import pytest
+
+from frames import US3000_4MODULES_VALUES, ClockedStack
+
+from pylontech.planner import PollPlanner
+from pylontech.sampling import AdaptiveSampler
+
+PARAMETERS = {
+    "CellHighVoltageLimit": 3.7,
+    "CellLowVoltageLimit": 3.05,
+    "ChargeHighTemperatureLimit": 61.0,
+    "ChargeLowTemperatureLimit": 0.0,
+    "ChargeCurrentLimit": 100.0,
+    "ModuleHighVoltageLimit": 54.0,
+    "ModuleLowVoltageLimit": 46.0,
+    "DischargeHighTemperatureLimit": 61.0,
+    "DischargeLowTemperatureLimit": 0.0,
+    "DischargeCurrentLimit": -100.0,
+}
+
+
+def _sampler(stack, **kwargs):
+    planner = PollPlanner(stack, explore_interval=0, clock=stack.clock)
+    return AdaptiveSampler(planner, clock=stack.clock, **kwargs)
+
+
+def _run(stack, sampler, seconds):
+    end = stack.now + seconds
+    while stack.now < end:
+        stack.now += sampler.next_due()
+        sampler.poll()
+
+
+def test_idle_stack_slows_down():
+    stack = ClockedStack(US3000_4MODULES_VALUES)
+    sampler = _sampler(stack, max_interval=30)
+    assert sampler.poll().Addresses == [2, 3, 4, 5]
+    assert sampler.poll() is None  # nothing due yet
+
+    _run(stack, sampler, 120)
+    intervals = [r["interval"] for r in sampler.rates().values()]
+    assert intervals == [30] * 4
+    assert {r["reason"] for r in sampler.rates().values()} == {"idle"}
+    assert len(stack.requests) < 4 * 20  # instead of 4 * 120 at one poll per second
+
+
+def test_changing_module_speeds_up():
+    stack = ClockedStack(US3000_4MODULES_VALUES)
+    sampler = _sampler(stack, max_interval=30)
+    _run(stack, sampler, 200)
+
+    stack.values.Module[1].Current += 20.0  # module at address 3 starts charging
+    _run(stack, sampler, 30)
+    rates = sampler.rates()
+    assert rates[3]["reason"] == "Current changing"
+    assert rates[3]["interval"] < 2
+    assert rates[2]["interval"] == 30
+
+    # The current settles: the module slows down again, one growth step per sample
+    _run(stack, sampler, 5)
+    assert rates[3]["interval"] < sampler.rates()[3]["interval"] < 30
+
+
+def test_near_limit_polls_at_min_interval():
+    stack = ClockedStack(US3000_4MODULES_VALUES)
+    sampler = _sampler(stack, parameters=PARAMETERS, max_interval=30)
+    _run(stack, sampler, 200)
+    assert sampler.rates()[4]["interval"] == 30
+
+    stack.values.Module[2].CellVoltages[5] = 3.68
+    _run(stack, sampler, 40)
+    assert sampler.rates()[4] == {"interval": 1.0, "effective_interval": pytest.approx(1.0, rel=0.2),
+                                  "reason": "near CellHighVoltageLimit", "samples": sampler.rates()[4]["samples"]}
+    assert sampler.rates()[5]["interval"] == 30
+
+
+def test_bus_utilisation_cap():
+    stack = ClockedStack(US3000_4MODULES_VALUES)
+    sampler = _sampler(stack, max_utilisation=0.1)
+    sampler.poll()
+    rates = sampler.rates()
+    assert sampler.utilisation == pytest.approx(0.1)
+    assert all(r["interval"] == 1.0 and r["effective_interval"] > 1.0 for r in rates.values())
+
+    start, first = stack.now, len(stack.requests)
+    _run(stack, sampler, 100)
+    busy = sum(stack.expected_frame_time(55 if r != "all" else 214) for r in stack.requests[first:])
+    assert busy / (stack.now - start) < 0.12
@@ -0,0 +1,111 @@
+from pylontech.scheduler import PollScheduler, TTLCache
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class Stack(object):
+    def __init__(self):
+        self.calls = []
+
+    def get_values(self):
+        self.calls.append("values")
+        return len(self.calls)
+
+    def get_system_parameters(self):
+        self.calls.append("parameters")
+        return "limits"
+
+    def get_protocol_version(self):
+        self.calls.append("version")
+        return "3.5"
+
+    def get_manufacturer_info(self):
+        self.calls.append("manufacturer")
+        return "PYLON"
+
+    def get_management_info(self, adr):
+        self.calls.append("management/%d" % adr)
+        return adr
+
+    def get_module_serial_number(self, adr):
+        self.calls.append("serial/%d" % adr)
+        return "SN%d" % adr
+
+
+def test_ttl_cache_expiry():
+    clock = Clock()
+    cache = TTLCache(clock)
+    cache.set("a", 1, ttl=5)
+    cache.set("b", 2)
+    clock.now += 4
+    assert cache.get("a") == 1
+    assert cache.age("a") == 4
+    clock.now += 1
+    assert cache.get("a") is None
+    assert cache.snapshot() == {"b": 2}
+
+
+def test_default_schedule_rates():
+    clock = Clock()
+    stack = Stack()
+    scheduler = PollScheduler.default(stack, addresses=[2, 3], clock=clock)
+
+    assert scheduler.run_pending() == 1.0
+    assert sorted(stack.calls) == sorted(["values", "parameters", "version", "manufacturer",
+                                          "management/2", "serial/2", "management/3", "serial/3"])
+    assert scheduler.get("serial_number/3") == "SN3"
+
+    for _ in range(10):
+        clock.now += 1
+        stack.calls = []
+        scheduler.run_pending()
+    assert stack.calls == ["values", "management/2", "management/3"]
+    assert scheduler.get("system_parameters") == "limits"
+
+
+def test_failing_job_keeps_last_value():
+    clock = Clock()
+    scheduler = PollScheduler(None, clock=clock)
+    results = iter([1, RuntimeError("timeout")])
+
+    def poll():
+        r = next(results)
+        if isinstance(r, Exception):
+            raise r
+        return r
+
+    scheduler.add("values", poll, interval=1)
+    scheduler.run_pending()
+    clock.now += 1
+    scheduler.run_pending()
+    assert scheduler.get("values") == 1
+    clock.now += 3
+    assert scheduler.get("values") is None
+
+
+def test_failing_one_shot_job_backs_off():
+    clock = Clock()
+    scheduler = PollScheduler(None, clock=clock)
+    attempts = []
+
+    def serial_number():
+        attempts.append(clock.now)
+        if len(attempts) < 4:
+            raise RuntimeError("timeout")
+        return "SN"
+
+    scheduler.add("values", lambda: 1, interval=3)
+    scheduler.add("serial_number", serial_number)
+    assert scheduler.run_pending() == 1.0
+    assert scheduler.run_pending() == 1.0  # not retried back to back
+    for _ in range(20):
+        clock.now += 0.5
+        scheduler.run_pending()
+    assert [t - 100.0 for t in attempts] == [0.0, 1.0, 3.0, 6.0]  # 1, 2 then 3 s (the longest interval)
+    assert scheduler.get("serial_number") == "SN"
@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+import pylontech
+from pylontech.simulator import BAD_CHECKSUM, DROP, GARBAGE, SimulatedModule, StackSimulator
+
+
+@pytest.fixture
+def sim():
+    modules = [SimulatedModule(), SimulatedModule(cells=16, extended_capacity=True, total_capacity=74000),
+               SimulatedModule(cells=8, current=12)]
+    with StackSimulator(modules, seed=1) as sim:
+        yield sim
+
+
+@pytest.fixture
+def p(sim):
+    p = pylontech.Pylontech(sim.port)
+    p.s.timeout = 0.3
+    yield p
+    p.s.close()
+
+
+def test_simulated_stack(p):
+    d = p.get_values()
+    assert d.NumberOfModules == 3
+    assert [m.NumberOfCells for m in d.Module] == [15, 16, 8]
+    assert d.Module[1].TotalCapacity == 74
+    assert d.Module[0].Voltage == pytest.approx(49.5)
+    assert d.Module[0].AverageBMSTemperature == pytest.approx(25.0)
+
+    single = p.get_values_single(4)
+    assert single.NumberOfModule == 4
+    assert single.Current == pytest.approx(1.2)
+
+    assert p.get_system_parameters().CellHighVoltageLimit == 3.7
+    assert p.get_manufacturer_info().ManufacturerName == b"PYLON"
+    assert p.get_management_info(3).status.ChargeEnable
+    assert p.get_module_serial_number(2).ModuleSerialNumber == b"PPTBH00000000002"
+    assert p.discover_batteries() == {2: "PPTBH00000000002", 3: "PPTBH00000000003", 4: "PPTBH00000000004"}
+
+
+def test_fault_injection(sim, p):
+    sim.inject(GARBAGE)
+    assert p.get_values().NumberOfModules == 3
+
+    for fault in (DROP, BAD_CHECKSUM):
+        sim.inject(fault)
+        with pytest.raises(ValueError):
+            p.get_values()  # nothing valid arrives before the timeout
+        assert p.get_values().NumberOfModules == 3
+
+
+def test_transmit_time_model():
+    sim = StackSimulator([SimulatedModule() for _ in range(4)], baudrate=9600, module_delay=0.01)
+    with sim:
+        p = pylontech.Pylontech(sim.port)
+        start = time.monotonic()
+        p.get_values()
+        elapsed = time.monotonic() - start
+        p.s.close()
+
+    assert sim.replies == 1
+    info_length = 2 + 4 * (1 + 2 * 15 + 1 + 2 * 5 + 11)
+    assert elapsed >= (18 + 2 * info_length) * 10 / 9600 + 4 * 0.01
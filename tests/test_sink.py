@@ -0,0 +1,124 @@
+import time
+
+from frames import parsed_values
+
+from standin import StandInHttpServer, StandInMqttBroker
+
+from pylontech.sink import HttpTransport, LineProtocolSink, MqttTransport, build_template
+
+
+class ListTransport:
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.batches = []
+        self.closed = False
+
+    def send(self, data):
+        time.sleep(self.delay)
+        if self.fail:
+            raise OSError("backend down")
+        self.batches.append(bytes(data))
+
+    def close(self):
+        self.closed = True
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.01)
+
+
+def test_render_one_sample():
+    v = parsed_values()
+    transport = ListTransport()
+    with LineProtocolSink(transport, tags={"stack": "garage"}, flush_interval=60) as sink:
+        sink.write(v, timestamp=1.5)
+    assert transport.closed
+    lines = b"".join(transport.batches).decode().splitlines()
+
+    cells = sum(len(m.CellVoltages) for m in v.Module)
+    temps = sum(len(m.GroupedCellsTemperatures) + 1 for m in v.Module)
+    assert len(lines) == cells + temps + len(v.Module) + 1
+    assert lines[0] == "pylontech_cell,stack=garage,module=1,cell=1 voltage=%r 1500000000" % v.Module[0].CellVoltages[0]
+    m = v.Module[2]
+    module_line = [line for line in lines if line.startswith("pylontech_module,stack=garage,module=3 ")][0]
+    assert "current=%r," % float(m.Current) in module_line
+    assert "cycles=%di " % m.CycleNumber in module_line
+    assert lines[-1].startswith("pylontech_stack,stack=garage total_power=")
+    assert build_template(v, ",stack=garage").count("\n") == len(lines)
+
+
+def test_batches_by_size_and_time():
+    v = parsed_values()
+    transport = ListTransport()
+    sink = LineProtocolSink(transport, max_bytes=4000, max_pending=100, flush_interval=0.2)
+    for t in range(10):
+        sink.write(v, timestamp=t)
+    wait_for(lambda: sink.sent_batches >= 1)
+    assert len(transport.batches[0]) >= 4000  # sent on size, not one request per sample
+    wait_for(lambda: sum(b.count(b"pylontech_stack") for b in transport.batches) == 10)  # the rest on time
+    sink.close()
+    assert sink.dropped_samples == sink.skipped_samples == 0
+
+
+def test_slow_backend_never_blocks_writes():
+    v = parsed_values()
+    transport = ListTransport(delay=0.3)
+    sink = LineProtocolSink(transport, max_bytes=2000, max_pending=2, flush_interval=0.05)
+    start = time.monotonic()
+    for t in range(200):
+        sink.write(v, timestamp=t)
+    assert time.monotonic() - start < 0.3
+    assert sink.decimation > 1
+    assert sink.dropped_samples + sink.skipped_samples > 0
+    sink.close()
+    assert sink.sent_batches >= 1
+
+
+def test_failures_reduce_the_rate():
+    transport = ListTransport(fail=True)
+    sink = LineProtocolSink(transport, flush_interval=0.2)
+    sink.write(parsed_values(), timestamp=0)
+    sink.write(parsed_values(), timestamp=1)
+    wait_for(lambda: sink.failed_batches == 1)
+    assert sink.failed_samples == 2
+    assert sink.decimation == 2
+    sink.close()
+
+
+def test_http_standin():
+    v = parsed_values()
+    with StandInHttpServer() as server:
+        sink = LineProtocolSink(HttpTransport(server.url), flush_interval=0.05)
+        for t in range(3):
+            sink.write(v, timestamp=t)
+        sink.close(timeout=5)
+        lines = server.lines()
+    assert sum(line.startswith(b"pylontech_stack") for line in lines) == 3
+    assert server.paths[0] == "/api/v2/write?bucket=test&precision=ns"
+
+
+def test_http_standin_error_is_counted():
+    with StandInHttpServer(status=500) as server:
+        sink = LineProtocolSink(HttpTransport(server.url), flush_interval=0.01)
+        sink.write(parsed_values(), timestamp=0)
+        wait_for(lambda: sink.failed_batches == 1)
+        sink.close(timeout=5)
+
+
+def test_mqtt_standin():
+    v = parsed_values()
+    with StandInMqttBroker() as broker:
+        host, port = broker.address
+        sink = LineProtocolSink(MqttTransport(host, port, topic="site/batteries"), flush_interval=0.05)
+        sink.write(v, timestamp=0)
+        sink.flush()
+        wait_for(lambda: len(broker.messages) == 1)
+        sink.write(v, timestamp=1)
+        sink.close(timeout=5)
+        wait_for(lambda: len(broker.messages) == 2)
+    assert {topic for topic, _ in broker.messages} == {"site/batteries"}
+    assert sum(line.startswith(b"pylontech_stack") for line in broker.lines()) == 2
@@ -0,0 +1,136 @@
+import time
+
+import pytest
+
+from frames import US2000_3MODULES_VALUES
+from test_basic import Pylontech
+
+import pylontech
+from pylontech.exceptions import ChecksumError, ReplyTimeout
+from pylontech.simulator import BAD_CHECKSUM, DROP, SimulatedModule, StackSimulator
+from pylontech.timing import AdaptiveTimeout, frame_time
+
+
+def test_deadline_follows_reply_size_and_measured_rtt():
+    t = AdaptiveTimeout(initial_margin=0.5)
+    probe = t.deadline(2, 0x93, b"02", 9600)
+    values = t.deadline(2, 0x42, b"FF", 9600)
+    assert probe == pytest.approx(frame_time(1, 9600) + frame_time(17, 9600) + 0.5)
+    assert values > probe + 1.0
+
+    for _ in range(20):
+        t.on_reply(2, 0x42, b"FF", 100, frame_time(1, 9600) + frame_time(100, 9600) + 0.01, 9600)
+    learned = t.deadline(2, 0x42, b"FF", 9600)
+    assert learned == pytest.approx(frame_time(1, 9600) + frame_time(100, 9600) + 0.02, abs=0.01)
+
+    t.on_timeout(0x42)
+    assert t.deadline(2, 0x42, b"FF", 9600) > learned
+    assert t.deadline(2, 0x42, b"FF", 300) == 2.0  # capped at max_timeout
+
+
+def _corrupt(frame: bytes) -> bytes:
+    return frame[:-2] + (b"0" if frame[-2:-1] != b"0" else b"1") + b"\r"
+
+
+def test_typed_errors_and_retries():
+    p = Pylontech([b""])
+    with pytest.raises(ReplyTimeout):
+        p.get_values()
+
+    p = Pylontech([_corrupt(US2000_3MODULES_VALUES)])
+    with pytest.raises(ChecksumError):  # without waiting for the timeout
+        p.get_values()
+
+    p = Pylontech([_corrupt(US2000_3MODULES_VALUES), US2000_3MODULES_VALUES])
+    p.retries = 1
+    p.retry_backoff = 0
+    assert p.get_values().NumberOfModules == 3
+
+    with pytest.raises(ChecksumError):
+        Pylontech._decode_hw_frame(_corrupt(US2000_3MODULES_VALUES))
+
+
+def test_adaptive_timeout_on_simulated_stack():
+    with StackSimulator([SimulatedModule() for _ in range(4)], baudrate=9600, response_delay=0.01) as sim:
+        p = pylontech.Pylontech(sim.port, baudrate=9600, timeouts=AdaptiveTimeout(), retries=2, retry_backoff=0.0)
+        reconfigurations = []
+        reconfigure = p.s._reconfigure_port
+        p.s._reconfigure_port = lambda *args: reconfigurations.append(1) or reconfigure(*args)
+        for _ in range(5):
+            p.get_module_serial_number(3)
+        assert p.timeouts.margin(0x93) < 0.2
+        assert len(reconfigurations) < 5  # not twice per command
+
+        sim.inject(DROP)
+        start = time.monotonic()
+        assert p.get_module_serial_number(3).ModuleSerialNumber == b"PPTBH00000000003"
+        assert time.monotonic() - start < 0.5  # instead of the 2 s serial timeout
+        assert p.get_values().NumberOfModules == 4
+        p.s.close()
+
+
+def test_bad_checksum_fails_fast():
+    with StackSimulator([SimulatedModule() for _ in range(2)], baudrate=9600) as sim:
+        p = pylontech.Pylontech(sim.port, baudrate=9600)
+        sim.inject(BAD_CHECKSUM)
+        start = time.monotonic()
+        with pytest.raises(ChecksumError):
+            p.get_module_serial_number(3)
+        assert time.monotonic() - start < 0.5
+
+        p.retries = 1
+        sim.inject(BAD_CHECKSUM)
+        start = time.monotonic()
+        assert p.get_module_serial_number(3).ModuleSerialNumber == b"PPTBH00000000003"
+        assert time.monotonic() - start < 0.5
+        p.s.close()
+
+
+class StallingSerial:
+    """ Sends the header of a reply `delay` seconds after the request, and nothing else """
+    def __init__(self, header: bytes, delay: float):
+        self.header = header
+        self.delay = delay
+        self.timeout = 2
+        self.baudrate = 115200
+        self.available_at = None
+
+    def write(self, data: bytes):
+        self.available_at = time.monotonic() + self.delay
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self.header) if time.monotonic() >= self.available_at else 0
+
+    def read(self, size=1) -> bytes:
+        end = time.monotonic() + self.timeout
+        if self.header and len(self.header) >= size and self.available_at <= end:
+            time.sleep(max(0.0, self.available_at - time.monotonic()))
+            data, self.header = self.header[:size], self.header[size:]
+            return data
+        time.sleep(self.timeout)
+        return b""
+
+
+def test_no_read_waits_past_the_deadline():
+    p = pylontech.Pylontech(StallingSerial(US2000_3MODULES_VALUES[:13], 0.2), timeouts=AdaptiveTimeout(max_timeout=0.3))
+    start = time.monotonic()
+    with pytest.raises(ReplyTimeout):
+        p.get_values()
+    assert time.monotonic() - start < 0.4  # the body read only gets the 0.1 s left
+
+
+def test_late_reply_is_not_taken_for_the_next_one():
+    modules = [SimulatedModule(current=10 * i) for i in range(3)]
+    with StackSimulator(modules) as sim:
+        p = pylontech.Pylontech(sim.port, timeouts=AdaptiveTimeout(max_timeout=0.1))
+        sim.response_delay = 0.15
+        with pytest.raises(ReplyTimeout):
+            p.get_values_single(2)
+        sim.response_delay = 0.0
+
+        p.timeouts.max_timeout = 1.0
+        single = p.get_values_single(3)  # module 2 answers meanwhile
+        assert (single.NumberOfModule, single.Current) == (3, 1.0)
+        assert p.stale_replies == 1
+        p.s.close()
@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+from frames import parsed_values
+
+from pylontech.tsstore import TelemetryStore, raw_row, series_names
+
+
+def test_raw_units_roundtrip(tmp_path):
+    values = parsed_values()
+    start = 1700000000.0
+    with TelemetryStore(str(tmp_path), chunk_samples=50) as store:
+        for i in range(120):
+            values.Module[0].CellVoltages[0] = 3.3 + (i % 7) / 1000
+            store.append(values, start + i)
+
+    store = TelemetryStore(str(tmp_path))
+    assert store.series == series_names(values)
+    rows = list(store.read_raw(start, start + 120))
+    assert len(rows) == 120
+    assert rows[-1][1][1:] == raw_row(values)[1:]
+    assert [row[0] for _, row in rows[:8]] == [3300, 3301, 3302, 3303, 3304, 3305, 3306, 3300]
+    assert rows[-1][0] == start + 119
+    assert [t for t, _ in store.read_raw(start + 10, start + 12)] == [start + 10, start + 11]
+
+    cell = store.series.index("m0.cell0")
+    current = store.series.index("m0.current")
+    assert rows[0][1][current] == round(values.Module[0].Current * 10)
+    assert rows[0][1][cell] == 3300
+    store.close()
+
+
+def test_rollups_and_query_resolution(tmp_path):
+    values = parsed_values()
+    start = 1700000000.0 - 1700000000.0 % 3600
+    store = TelemetryStore(str(tmp_path))
+    for i in range(3 * 3600):
+        values.Module[1].CellVoltages[2] = 3.3 + (i % 60) / 1000
+        store.append(values, start + i)
+    store.flush()
+
+    minutes = store.read_rollups(60, start, start + 3 * 3600)
+    assert len(minutes) == 180
+    i = store.series.index("m1.cell2")
+    assert minutes[0].count == 60
+    assert (minutes[0].mins[i], minutes[0].maxs[i]) == (3300, 3359)
+    assert minutes[0].means[i] == pytest.approx(3329.5)
+    assert [m.start for m in store.read_rollups(60, start + 3000, start + 3000 + 600)] == [
+        (start + 3000 + 60 * k) * 1000 for k in range(10)]
+    assert store.read_rollups(60, start + 3 * 3600, start + 4 * 3600) == []
+
+    assert len(store.query("m1.cell2", start, start + 600)) == 600
+    assert len(store.query("m1.cell2", start, start + 3 * 3600)) == 180
+    hours = store.query("m1.cell2", start, start + 3 * 3600, max_points=100)
+    assert hours == [(start + h * 3600, 3300, 3359, pytest.approx(3329.5)) for h in range(3)]
+
+    raw_size = os.path.getsize(os.path.join(str(tmp_path), "raw.bin"))
+    assert raw_size < 3 * 3600 * len(store.series) / 10
+    store.close()
+
+
+def test_flushed_bucket_is_merged_on_reopen(tmp_path):
+    values = parsed_values()
+    start = 1700000000.0 - 1700000000.0 % 3600
+    store = TelemetryStore(str(tmp_path))
+    store.append(values, start)
+    store.close()
+
+    values.Module[0].CellVoltages[0] = 3.4
+    store = TelemetryStore(str(tmp_path))
+    store.append(values, start + 1)
+    store.close()
+
+    i = store.series.index("m0.cell0")
+    (minute,) = store.read_rollups(60, start, start + 60)
+    assert minute.count == 2
+    assert minute.maxs[i] == 3400
+
+    values.Module.pop()
+    with pytest.raises(ValueError):
+        TelemetryStore(str(tmp_path)).append(values, start + 2)